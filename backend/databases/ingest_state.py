@@ -0,0 +1,105 @@
+"""
+Book-keeping tables for the ingestion pipeline.
+
+Checkpoints (position within one export file) and watermarks (highest
+message ingested per chat) are written in the same transaction as the rows of
+a batch, so a crashed run resumes exactly after the last committed batch.
+A checkpoint is deleted once its run completes.
+"""
+
+import os
+
+
+def create_ingest_checkpoints_table(cur):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ingest_checkpoints (
+            source TEXT PRIMARY KEY,
+            title TEXT,
+            last_index INTEGER NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """
+    )
+
+
+def checkpoint_source(json_file_path: str, chat_id) -> str:
+    """
+    Checkpoint key of an export: its absolute path plus the chat id, since
+    every Telegram export is called result.json.
+    """
+    return f"{os.path.abspath(json_file_path)}#{chat_id}"
+
+
+def get_checkpoint(cur, source: str) -> tuple[int, str | None]:
+    """
+    Returns (index of the last committed message, chat title) for this
+    export, or (-1, None) when there is no checkpoint.
+    """
+    cur.execute(
+        "SELECT last_index, title FROM ingest_checkpoints WHERE source = %s;",
+        (source,),
+    )
+    row = cur.fetchone()
+    return (row[0], row[1]) if row else (-1, None)
+
+
+def set_checkpoint(cur, source: str, title: str, last_index: int):
+    cur.execute(
+        """
+        INSERT INTO ingest_checkpoints (source, title, last_index)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (source) DO UPDATE
+        SET title = EXCLUDED.title,
+            last_index = EXCLUDED.last_index,
+            updated_at = now();
+        """,
+        (source, title, last_index),
+    )
+
+
+def clear_checkpoint(cur, source: str):
+    cur.execute("DELETE FROM ingest_checkpoints WHERE source = %s;", (source,))
+
+
+def create_ingest_watermarks_table(cur):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ingest_watermarks (
+            title TEXT PRIMARY KEY,
+            max_message_id BIGINT NOT NULL,
+            max_date TEXT,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """
+    )
+
+
+def get_watermark(cur, title: str) -> tuple[int, str | None]:
+    """
+    Returns (highest ingested message_id, its latest date) for a chat,
+    or (0, None) if the chat was never ingested.
+    """
+    cur.execute(
+        "SELECT max_message_id, max_date FROM ingest_watermarks WHERE title = %s;",
+        (title,),
+    )
+    row = cur.fetchone()
+    return (row[0], row[1]) if row else (0, None)
+
+
+def advance_watermark(cur, title: str, max_message_id: int, max_date: str | None):
+    """
+    Moves the chat watermark forward; never moves it back.
+    """
+    cur.execute(
+        """
+        INSERT INTO ingest_watermarks (title, max_message_id, max_date)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (title) DO UPDATE
+        SET max_message_id = GREATEST(ingest_watermarks.max_message_id, EXCLUDED.max_message_id),
+            max_date = GREATEST(ingest_watermarks.max_date, EXCLUDED.max_date),
+            updated_at = now();
+        """,
+        (title, max_message_id, max_date),
+    )
@@ -0,0 +1,183 @@
+"""
+Idempotent schema for items_3: the table itself and everything added to it
+since. Each ensure_* function can be run on every start-up.
+"""
+
+
+def _index_exists(cur, index_name: str) -> bool:
+    cur.execute("SELECT 1 FROM pg_indexes WHERE indexname = %s;", (index_name,))
+    return cur.fetchone() is not None
+
+
+def ensure_items_table(cur):
+    """
+    The pgvector extension and the items_3 table. The embedding column is a
+    plain `vector`; the ANN index build gives it EMBEDDING_DIMENSIONS.
+    """
+    cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS items_3 (
+            id SERIAL PRIMARY KEY,
+            content TEXT,
+            embedding vector,
+            metadata JSONB
+        );
+        """
+    )
+
+
+def ensure_message_identity(cur) -> int:
+    """
+    Adds the content_hash column and makes (title, message_id) unique so a
+    message can only be stored once. Duplicates left by earlier full
+    re-ingests are removed first, keeping the oldest row.
+    Returns the number of duplicate rows removed.
+    """
+    cur.execute("ALTER TABLE items_3 ADD COLUMN IF NOT EXISTS content_hash TEXT;")
+    if _index_exists(cur, "items_3_title_message_id_key"):
+        return 0
+
+    cur.execute(
+        """
+        DELETE FROM items_3 a
+        USING items_3 b
+        WHERE a.id > b.id
+          AND a.metadata->>'title' = b.metadata->>'title'
+          AND a.metadata->>'message_id' = b.metadata->>'message_id';
+        """
+    )
+    removed = cur.rowcount
+    cur.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS items_3_title_message_id_key
+        ON items_3 ((metadata->>'title'), (metadata->>'message_id'));
+        """
+    )
+    return removed
+
+
+def ensure_thread_indexes(cur):
+    """
+    Expression indexes used by the recursive thread query in
+    chaining_service: parent lookups go through the unique
+    (title, message_id) index, child lookups through this one.
+    """
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS items_3_title_reply_to_idx
+        ON items_3 ((metadata->>'title'), (metadata->>'reply_to_message_id'));
+        """
+    )
+
+
+def ensure_thread_id_column(cur):
+    """
+    thread_id holds the message_id of the thread root, filled in by
+    scripts/assign_threads.py, so a whole thread is one index range scan.
+    """
+    cur.execute("ALTER TABLE items_3 ADD COLUMN IF NOT EXISTS thread_id BIGINT;")
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS items_3_title_thread_id_idx
+        ON items_3 ((metadata->>'title'), thread_id);
+        """
+    )
+
+
+def ensure_fulltext_index(cur):
+    """
+    GIN index for the lexical half of hybrid retrieval. The 'simple'
+    configuration neither stems nor drops stop words, which suits the mixed
+    Russian/Spanish/English chats and keeps school names like "ILSE" intact.
+    Queries must use the same to_tsvector('simple', content) expression.
+    """
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS items_3_content_fts_idx
+        ON items_3 USING GIN (to_tsvector('simple', content));
+        """
+    )
+
+
+def ensure_metadata_columns(cur):
+    """
+    Stored generated columns for the retrieval filters (chat title, message
+    date, author), each with a btree index, so a filtered vector search is a
+    plain WHERE on indexed columns instead of JSONB extraction per row.
+    Adding them rewrites items_3 once.
+    """
+    # A generated column needs an immutable expression; text::timestamp is
+    # only stable (it follows DateStyle), and a malformed date must not make
+    # inserts fail. The fields are parsed with a fixed pattern and
+    # make_timestamp, and an impossible date such as 2023-13-45 gives NULL.
+    cur.execute(
+        r"""
+        CREATE OR REPLACE FUNCTION items_3_message_date(metadata jsonb)
+        RETURNS timestamp
+        LANGUAGE plpgsql IMMUTABLE PARALLEL SAFE
+        AS $$
+        DECLARE
+            parts text[] := regexp_match(
+                metadata->>'date',
+                '^(\d{4})-(\d{2})-(\d{2})(?:[T ](\d{2}):(\d{2})(?::(\d{2}))?)?$'
+            );
+        BEGIN
+            IF parts IS NULL THEN
+                RETURN NULL;
+            END IF;
+            RETURN make_timestamp(
+                parts[1]::int, parts[2]::int, parts[3]::int,
+                coalesce(parts[4], '0')::int, coalesce(parts[5], '0')::int,
+                coalesce(parts[6], '0')::double precision
+            );
+        EXCEPTION WHEN data_exception THEN
+            RETURN NULL;
+        END
+        $$;
+        """
+    )
+    cur.execute(
+        """
+        ALTER TABLE items_3
+            ADD COLUMN IF NOT EXISTS chat_title TEXT
+                GENERATED ALWAYS AS (metadata->>'title') STORED,
+            ADD COLUMN IF NOT EXISTS message_date TIMESTAMP
+                GENERATED ALWAYS AS (items_3_message_date(metadata)) STORED,
+            ADD COLUMN IF NOT EXISTS author TEXT
+                GENERATED ALWAYS AS (metadata->>'from') STORED;
+        """
+    )
+    for column in ("chat_title", "message_date", "author"):
+        cur.execute(
+            f"CREATE INDEX IF NOT EXISTS items_3_{column}_idx ON items_3 ({column});"
+        )
+
+
+def apply_migrations(cur) -> int:
+    """
+    Runs every ensure_* step. Returns the number of duplicate rows removed.
+    """
+    ensure_items_table(cur)
+    removed = ensure_message_identity(cur)
+    ensure_thread_indexes(cur)
+    ensure_thread_id_column(cur)
+    ensure_fulltext_index(cur)
+    ensure_metadata_columns(cur)
+    return removed
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+
+    sys.path.append(
+        os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+    )
+    from backend.databases.pool import close_pool, connection
+
+    with connection() as conn:
+        with conn.cursor() as cur:
+            removed = apply_migrations(cur)
+    close_pool()
+    print(f"items_3 schema is up to date (removed {removed} duplicate rows).")
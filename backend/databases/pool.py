@@ -0,0 +1,236 @@
+import asyncio
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from dotenv import load_dotenv
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool, ConnectionPool
+
+load_dotenv()
+
+
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = os.getenv("DB_PORT", "5432")
+DB_NAME = os.getenv("DB_NAME", "postgres")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "")
+
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "20"))
+# Seconds a caller may wait for a free connection before PoolTimeout is raised
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Idle connections above min_size are closed after this many seconds
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "600"))
+
+_async_pool: AsyncConnectionPool | None = None
+_async_pool_lock = asyncio.Lock()
+
+_sync_pool: ConnectionPool | None = None
+_sync_pool_lock = threading.Lock()
+
+
+class _AcquireStats:
+    """
+    Running totals of how long callers waited to get a connection from a pool.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.count = 0
+            self.total_seconds = 0.0
+            self.max_seconds = 0.0
+            self.errors = 0
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.count += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            avg = self.total_seconds / self.count if self.count else 0.0
+            return {
+                "acquire_count": self.count,
+                "acquire_errors": self.errors,
+                "acquire_avg_ms": avg * 1000,
+                "acquire_max_ms": self.max_seconds * 1000,
+            }
+
+
+_async_acquire_stats = _AcquireStats()
+_sync_acquire_stats = _AcquireStats()
+
+
+def get_conninfo() -> str:
+    """
+    Builds the libpq connection string from the DB_* environment variables.
+    """
+    return make_conninfo(
+        host=DB_HOST,
+        port=DB_PORT,
+        dbname=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+    )
+
+
+def _pool_kwargs() -> dict:
+    return {
+        "min_size": DB_POOL_MIN_SIZE,
+        "max_size": DB_POOL_MAX_SIZE,
+        "timeout": DB_POOL_TIMEOUT,
+        "max_idle": DB_POOL_MAX_IDLE,
+        "open": False,
+    }
+
+
+async def open_async_pool() -> AsyncConnectionPool:
+    """
+    Opens the process-wide async connection pool (idempotent).
+    Waits until min_size connections are established so a misconfigured
+    database fails at startup rather than on the first request.
+    """
+    global _async_pool
+    async with _async_pool_lock:
+        if _async_pool is None:
+            pool = AsyncConnectionPool(
+                get_conninfo(),
+                check=AsyncConnectionPool.check_connection,
+                name="api",
+                **_pool_kwargs(),
+            )
+            await pool.open(wait=True, timeout=DB_POOL_TIMEOUT)
+            _async_pool = pool
+    return _async_pool
+
+
+async def get_async_pool() -> AsyncConnectionPool:
+    """
+    Returns the async connection pool, opening it on first use.
+    """
+    if _async_pool is not None:
+        return _async_pool
+    return await open_async_pool()
+
+
+async def close_async_pool():
+    """
+    Closes the async connection pool. Safe to call when it was never opened.
+    """
+    global _async_pool
+    async with _async_pool_lock:
+        if _async_pool is not None:
+            await _async_pool.close()
+            _async_pool = None
+
+
+@asynccontextmanager
+async def async_connection():
+    """
+    Borrows a connection from the async pool and records the acquire latency.
+    The connection is committed on success and rolled back on error.
+    """
+    pool = await get_async_pool()
+    start = time.perf_counter()
+    acquired = False
+    try:
+        async with pool.connection() as conn:
+            acquired = True
+            _async_acquire_stats.record(time.perf_counter() - start)
+            yield conn
+    except Exception:
+        if not acquired:
+            _async_acquire_stats.record_error()
+        raise
+
+
+def get_pool() -> ConnectionPool:
+    """
+    Returns the blocking connection pool used by scripts and worker threads,
+    opening it on first use.
+    """
+    global _sync_pool
+    with _sync_pool_lock:
+        if _sync_pool is None:
+            pool = ConnectionPool(
+                get_conninfo(),
+                check=ConnectionPool.check_connection,
+                name="ingest",
+                **_pool_kwargs(),
+            )
+            pool.open(wait=True, timeout=DB_POOL_TIMEOUT)
+            _sync_pool = pool
+    return _sync_pool
+
+
+def close_pool():
+    """
+    Closes the blocking connection pool. Safe to call when it was never opened.
+    """
+    global _sync_pool
+    with _sync_pool_lock:
+        if _sync_pool is not None:
+            _sync_pool.close()
+            _sync_pool = None
+
+
+@contextmanager
+def connection():
+    """
+    Blocking counterpart of async_connection().
+    """
+    pool = get_pool()
+    start = time.perf_counter()
+    acquired = False
+    try:
+        with pool.connection() as conn:
+            acquired = True
+            _sync_acquire_stats.record(time.perf_counter() - start)
+            yield conn
+    except Exception:
+        if not acquired:
+            _sync_acquire_stats.record_error()
+        raise
+
+
+def _describe_pool(pool, acquire_stats: _AcquireStats) -> dict:
+    if pool is None:
+        return {"open": False, **acquire_stats.as_dict()}
+    stats = pool.get_stats()
+    size = stats.get("pool_size", 0)
+    available = stats.get("pool_available", 0)
+    return {
+        "open": True,
+        "min_size": stats.get("pool_min"),
+        "max_size": stats.get("pool_max"),
+        "size": size,
+        "in_use": size - available,
+        "available": available,
+        "waiting": stats.get("requests_waiting", 0),
+        "requests_total": stats.get("requests_num", 0),
+        "requests_timed_out": stats.get("requests_errors", 0),
+        "connections_lost": stats.get("connections_lost", 0),
+        **acquire_stats.as_dict(),
+    }
+
+
+def get_pool_metrics() -> dict:
+    """
+    Snapshot of both pools for sizing: connections in use, callers waiting
+    and how long acquiring a connection took.
+    """
+    return {
+        "async": _describe_pool(_async_pool, _async_acquire_stats),
+        "sync": _describe_pool(_sync_pool, _sync_acquire_stats),
+    }
@@ -0,0 +1,347 @@
+"""
+Approximate nearest neighbour index on items_3.embedding.
+
+The index type and its build parameters come from the environment and can be
+overridden from the command line to rebuild it:
+
+    python databases/vector_index.py --type hnsw --m 16 --ef-construction 64
+    python databases/vector_index.py --type ivfflat --lists 2000
+    python databases/vector_index.py --show
+
+Search-time parameters (hnsw.ef_search, ivfflat.probes) are set per query
+with SEARCH_SETTINGS_SQL; see find_similar_items.
+
+EMBEDDING_STORAGE picks what the index stores: "vector" (float32), "halfvec"
+(float16, half the size) or "bit" (one sign bit per dimension, 1/32 of the
+size). The column itself keeps full precision: with a compact index the
+index returns RERANK_FACTOR times more candidates by the quantized distance
+and those are re-ranked by the exact one (nearest_sql). halfvec and bit
+need pgvector 0.7 or later.
+
+    python databases/vector_index.py --type hnsw --storage bit
+"""
+
+import math
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+INDEX_NAME = "items_3_embedding_idx"
+INDEX_TYPES = ("hnsw", "ivfflat")
+# Indexed expression and operator class per storage; {dims} is the dimension
+STORAGES = {
+    "vector": ("embedding", "vector_cosine_ops"),
+    "halfvec": ("(embedding::halfvec({dims}))", "halfvec_cosine_ops"),
+    "bit": ("(binary_quantize(embedding)::bit({dims}))", "bit_hamming_ops"),
+}
+COMPACT_STORAGE_MIN_VERSION = (0, 7, 0)
+
+# "hnsw", "ivfflat" or "none" (exact search only)
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "hnsw")
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "768"))
+# "vector", "halfvec" or "bit"; used for the build and for every search, so
+# the ingest and the API must agree
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "vector")
+# Candidates per requested row re-ranked at full precision (compact storage)
+RERANK_FACTOR = int(os.getenv("RERANK_FACTOR", "4"))
+
+# Build parameters
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+# 0 picks rows / 1000 (sqrt(rows) above a million rows), as pgvector advises
+IVFFLAT_LISTS = int(os.getenv("IVFFLAT_LISTS", "0"))
+# Index builds are much faster when the graph fits in maintenance_work_mem
+VECTOR_INDEX_MAINTENANCE_WORK_MEM = os.getenv(
+    "VECTOR_INDEX_MAINTENANCE_WORK_MEM", "1GB"
+)
+
+# Search parameters: higher is better recall and slower queries
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "40"))
+IVFFLAT_PROBES = int(os.getenv("IVFFLAT_PROBES", "10"))
+
+
+def default_lists(row_count: int) -> int:
+    if row_count <= 1_000_000:
+        return max(1, row_count // 1000)
+    return int(math.sqrt(row_count))
+
+
+def get_vector_index(cur) -> dict | None:
+    """
+    Describes the existing embedding index: {"type", "options", "storage"}
+    with the build parameters as stored by Postgres, or None when there is
+    none.
+    """
+    cur.execute(
+        """
+        SELECT am.amname, c.reloptions, opc.opcname
+        FROM pg_class c
+        JOIN pg_am am ON am.oid = c.relam
+        JOIN pg_index i ON i.indexrelid = c.oid
+        JOIN pg_opclass opc ON opc.oid = i.indclass[0]
+        WHERE c.relname = %s;
+        """,
+        (INDEX_NAME,),
+    )
+    row = cur.fetchone()
+    if row is None:
+        return None
+    options = dict(option.split("=", 1) for option in row[1] or [])
+    storage = next(
+        (name for name, (_, opclass) in STORAGES.items() if opclass == row[2]), row[2]
+    )
+    return {"type": row[0], "options": options, "storage": storage}
+
+
+def get_index_size(cur) -> int | None:
+    """
+    Bytes on disk of the embedding index, None when there is none.
+    """
+    cur.execute("SELECT pg_relation_size(to_regclass(%s));", (INDEX_NAME,))
+    return cur.fetchone()[0]
+
+
+def check_storage(cur, storage: str):
+    """
+    Raises ValueError when the installed pgvector cannot index `storage`.
+    """
+    if storage not in STORAGES:
+        raise ValueError(f"Unknown embedding storage: {storage}")
+    if storage == "vector":
+        return
+    cur.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector';")
+    version = cur.fetchone()[0]
+    if tuple(int(part) for part in version.split(".")) < COMPACT_STORAGE_MIN_VERSION:
+        raise ValueError(
+            f"{storage} storage needs pgvector "
+            f"{'.'.join(map(str, COMPACT_STORAGE_MIN_VERSION))} or later "
+            f"(installed: {version})"
+        )
+
+
+def index_distance(query_vector: str, storage: str = None) -> str:
+    """
+    Distance expression the index serves for `storage`; query_vector is a
+    SQL expression of type vector.
+    """
+    storage = storage or EMBEDDING_STORAGE
+    dims = EMBEDDING_DIMENSIONS
+    if storage == "halfvec":
+        return f"embedding::halfvec({dims}) <=> ({query_vector})::halfvec({dims})"
+    if storage == "bit":
+        return f"binary_quantize(embedding)::bit({dims}) <~> binary_quantize({query_vector})"
+    return f"embedding <=> {query_vector}"
+
+
+def nearest_sql(
+    columns: str,
+    where: str,
+    query_vector: str,
+    limit: str,
+    storage: str = None,
+    rerank_factor: int = None,
+) -> str:
+    """
+    SELECT of `columns` and the exact cosine `distance` of the `limit`
+    nearest items_3 rows to query_vector, nearest first. With a compact
+    storage the index picks limit * rerank_factor candidates by the
+    quantized distance and the exact distance re-ranks them. All arguments
+    are SQL fragments, never user input.
+    """
+    storage = storage or EMBEDDING_STORAGE
+    if storage == "vector":
+        return f"""
+            SELECT {columns}, embedding <=> {query_vector} AS distance
+            FROM items_3
+            WHERE {where}
+            ORDER BY distance
+            LIMIT {limit}
+        """
+    return f"""
+        SELECT {columns}, embedding <=> {query_vector} AS distance
+        FROM (
+            SELECT {columns}, embedding
+            FROM items_3
+            WHERE {where}
+            ORDER BY {index_distance(query_vector, storage)}
+            LIMIT {limit} * {int(rerank_factor or RERANK_FACTOR)}
+        ) candidates
+        ORDER BY distance
+        LIMIT {limit}
+    """
+
+
+def _build_options(cur, index_type, m, ef_construction, lists) -> dict:
+    if index_type == "hnsw":
+        return {
+            "m": str(m or HNSW_M),
+            "ef_construction": str(ef_construction or HNSW_EF_CONSTRUCTION),
+        }
+    if not (lists or IVFFLAT_LISTS):
+        cur.execute("SELECT count(*) FROM items_3;")
+        lists = default_lists(cur.fetchone()[0])
+    return {"lists": str(lists or IVFFLAT_LISTS)}
+
+
+def ensure_embedding_dimensions(cur):
+    """
+    ANN indexes need a fixed dimension; a plain `vector` column is given
+    EMBEDDING_DIMENSIONS.
+    """
+    cur.execute(
+        """
+        SELECT format_type(atttypid, atttypmod)
+        FROM pg_attribute
+        WHERE attrelid = 'items_3'::regclass AND attname = 'embedding';
+        """
+    )
+    if cur.fetchone()[0] == "vector":
+        cur.execute(
+            f"ALTER TABLE items_3 ALTER COLUMN embedding "
+            f"TYPE vector({EMBEDDING_DIMENSIONS});"
+        )
+
+
+def create_vector_index(
+    cur,
+    index_type: str = None,
+    m: int = None,
+    ef_construction: int = None,
+    lists: int = None,
+    storage: str = None,
+) -> bool:
+    """
+    Builds the embedding index with the given (or configured) parameters.
+    An existing index with the same type, parameters and storage is kept;
+    any other is dropped and rebuilt. Returns True when an index was built.
+    """
+    index_type = index_type or VECTOR_INDEX_TYPE
+    storage = storage or EMBEDDING_STORAGE
+    if index_type == "none":
+        return False
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown vector index type: {index_type}")
+    check_storage(cur, storage)
+
+    options = _build_options(cur, index_type, m, ef_construction, lists)
+    wanted = {"type": index_type, "options": options, "storage": storage}
+    if get_vector_index(cur) == wanted:
+        return False
+
+    ensure_embedding_dimensions(cur)
+    cur.execute(f"DROP INDEX IF EXISTS {INDEX_NAME};")
+    cur.execute(
+        "SELECT set_config('maintenance_work_mem', %s, true);",
+        (VECTOR_INDEX_MAINTENANCE_WORK_MEM,),
+    )
+    with_clause = ", ".join(f"{key} = {int(value)}" for key, value in options.items())
+    expression, opclass = STORAGES[storage]
+    cur.execute(
+        f"""
+        CREATE INDEX {INDEX_NAME} ON items_3
+        USING {index_type} ({expression.format(dims=EMBEDDING_DIMENSIONS)} {opclass})
+        WITH ({with_clause});
+        """
+    )
+    return True
+
+
+def ensure_vector_index(cur) -> bool:
+    """
+    Creates the configured index if there is no embedding index yet. An
+    existing one is left alone (rebuilding is an explicit create_vector_index
+    call), so this is cheap to run after every ingest. Returns True when an
+    index was built.
+    """
+    if VECTOR_INDEX_TYPE == "none":
+        return False
+    index = get_vector_index(cur)
+    if index is None:
+        return create_vector_index(cur)
+    if index["storage"] != EMBEDDING_STORAGE:
+        print(
+            f"{INDEX_NAME} stores {index['storage']} but EMBEDDING_STORAGE is "
+            f"{EMBEDDING_STORAGE}; searches will not use it until it is rebuilt "
+            f"(databases/vector_index.py --storage {EMBEDDING_STORAGE})."
+        )
+    return False
+
+
+def drop_vector_index(cur):
+    cur.execute(f"DROP INDEX IF EXISTS {INDEX_NAME};")
+
+
+def search_settings(
+    top_k: int,
+    ef_search: int = None,
+    probes: int = None,
+    storage: str = None,
+    rerank_factor: int = None,
+) -> tuple[str, str]:
+    """
+    Parameters of SEARCH_SETTINGS_SQL for one search: (ef_search, probes),
+    applied transaction-locally. ef_search never drops below the number of
+    rows the index has to return (top_k, times RERANK_FACTOR with a compact
+    storage), otherwise HNSW returns fewer rows.
+    """
+    if (storage or EMBEDDING_STORAGE) != "vector":
+        top_k *= rerank_factor or RERANK_FACTOR
+    return (
+        str(max(ef_search or HNSW_EF_SEARCH, top_k)),
+        str(probes or IVFFLAT_PROBES),
+    )
+
+
+# Both settings in one round trip; only the one matching the index matters
+SEARCH_SETTINGS_SQL = """
+    SELECT set_config('hnsw.ef_search', %s, true),
+           set_config('ivfflat.probes', %s, true);
+"""
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    import time
+
+    sys.path.append(
+        os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+    )
+    from backend.databases.pool import close_pool, connection
+
+    parser = argparse.ArgumentParser(description="Manage the items_3 vector index")
+    parser.add_argument("--type", choices=INDEX_TYPES + ("none",))
+    parser.add_argument("--m", type=int)
+    parser.add_argument("--ef-construction", type=int)
+    parser.add_argument("--lists", type=int)
+    parser.add_argument("--storage", choices=list(STORAGES))
+    parser.add_argument("--show", action="store_true")
+    args = parser.parse_args()
+
+    with connection() as conn:
+        with conn.cursor() as cur:
+            if args.show:
+                print(get_vector_index(cur), f"{get_index_size(cur)} bytes")
+            elif args.type == "none":
+                drop_vector_index(cur)
+                print(f"Dropped {INDEX_NAME}.")
+            else:
+                start = time.time()
+                built = create_vector_index(
+                    cur,
+                    args.type,
+                    args.m,
+                    args.ef_construction,
+                    args.lists,
+                    args.storage,
+                )
+                if built:
+                    print(
+                        f"Built {get_vector_index(cur)} in {time.time() - start:.1f}s."
+                    )
+                else:
+                    print(f"{INDEX_NAME} is already up to date.")
+    close_pool()
@@ -1,12 +1,34 @@
+from contextlib import asynccontextmanager
+import asyncio
+import os
+import sys
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 import uvicorn
 
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(project_root)
+
 from routes.chat_router import router
+from routes.metrics_router import router as metrics_router
+from backend.databases.pool import open_async_pool, close_async_pool, close_pool
+from backend.services.interaction_log import flush_interaction_log
+from backend.services.ollama_service import warm_up
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await open_async_pool()
+    await asyncio.to_thread(warm_up)
+    yield
+    await flush_interaction_log()
+    await close_async_pool()
+    close_pool()
 
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 origins = ["http://localhost:5173"]
 
@@ -19,6 +41,7 @@ app.add_middleware(
 )
 
 app.include_router(router)
+app.include_router(metrics_router)
 
 
 @app.get("/")
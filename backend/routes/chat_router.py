@@ -1,11 +1,17 @@
 from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
+import json
 import uuid
 
 
-from schemas.schema import MessageCreate, Message
+from schemas.schema import BatchCreate, MessageCreate, Message
 
-from services.google_service import get_llm_response_with_context
-from services.google_service import validate_input
+from services.google_service import answer_question
+from services.google_service import stream_answer
+from services.google_service import answer_batch
+
+# Same module object as the services' own imports, so they share the trace
+from backend.services.tracing import stage_timings, trace, trace_summary
 
 router = APIRouter()
 
@@ -13,16 +19,92 @@ router = APIRouter()
 @router.post("/ai", response_model=Message)
 async def process_user_message(msg: MessageCreate):
     user_query = msg.message
+    filters = msg.filters.model_dump(exclude_none=True) if msg.filters else None
     response_id = uuid.uuid4().hex
-    if not validate_input(user_query):
-        return {
-            "message": "Invalid input. Please input related question.",
-            "id": response_id,
-            "process_time": None,
-        }
-    llm_response_text, process_time = get_llm_response_with_context(user_query)
+    with trace("POST /ai") as current:
+        # Identical questions in flight share one answer (single_flight)
+        llm_response_text, process_time = await answer_question(
+            user_query, filters=filters
+        )
     return {
         "message": llm_response_text,
         "id": response_id,
         "process_time": process_time,
+        "timings": stage_timings(current),
+        "trace": trace_summary(current) if msg.trace else None,
     }
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@router.post("/ai/stream")
+async def stream_user_message(msg: MessageCreate):
+    """
+    Server-sent events version of /ai: "metadata" after retrieval, "token"
+    events while the LLM streams, and a final "done" event whose data is a
+    Message. Failures after the stream started arrive as an "error" event.
+    A request identical to one in flight replays that stream.
+    """
+    user_query = msg.message
+    filters = msg.filters.model_dump(exclude_none=True) if msg.filters else None
+    response_id = uuid.uuid4().hex
+
+    async def events():
+        try:
+            with trace("POST /ai/stream") as current:
+                async for event, data in stream_answer(user_query, filters=filters):
+                    if event == "done":
+                        # The trace so far: everything but sending this event
+                        data = Message(
+                            id=response_id,
+                            **{"timings": stage_timings(current), **data},
+                            trace=trace_summary(current) if msg.trace else None,
+                        ).model_dump()
+                    yield _sse(event, data)
+        except Exception as e:
+            print(f"Error streaming LLM response: {e}")
+            yield _sse(
+                "error",
+                {
+                    "id": response_id,
+                    "detail": "Sorry, an error occurred while getting the response.",
+                },
+            )
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/ai/batch")
+async def batch_user_messages(batch: BatchCreate):
+    """
+    Answers many questions in one call, streamed as server-sent events: a
+    "result" event per answer as soon as it is ready (with the index of the
+    question in the request), then "done" with the throughput in questions
+    per minute. Questions are not checked for relevance.
+    """
+    filters = batch.filters.model_dump(exclude_none=True) if batch.filters else None
+
+    async def events():
+        try:
+            async for event, data in answer_batch(
+                batch.messages, filters=filters, concurrency=batch.concurrency
+            ):
+                yield _sse(event, data)
+        except Exception as e:
+            print(f"Error answering batch: {e}")
+            yield _sse(
+                "error",
+                {"detail": "Sorry, an error occurred while answering the batch."},
+            )
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
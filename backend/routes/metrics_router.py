@@ -0,0 +1,70 @@
+import os
+import sys
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.append(project_root)
+
+from backend.databases.pool import get_pool_metrics
+from backend.services.embedding_cache import query_embedding_cache
+from backend.services.answer_cache import get_answer_cache_stats
+from backend.services.relevance_gate import get_relevance_gate_stats
+from backend.services.llm_providers import get_llm_provider_stats
+from backend.services.tracing import get_stage_stats, prometheus_text
+from backend.services.interaction_log import get_interaction_log_stats
+from backend.services.local_embedder import get_local_embedder_stats
+from backend.services.single_flight import get_single_flight_stats
+
+router = APIRouter(prefix="/metrics")
+
+
+@router.get("/pool")
+async def pool_metrics():
+    return get_pool_metrics()
+
+
+@router.get("/embedding-cache")
+async def embedding_cache_metrics():
+    return query_embedding_cache.stats()
+
+
+@router.get("/local-embedder")
+async def local_embedder_metrics():
+    return get_local_embedder_stats()
+
+
+@router.get("/answer-cache")
+async def answer_cache_metrics():
+    return get_answer_cache_stats()
+
+
+@router.get("/relevance-gate")
+async def relevance_gate_metrics():
+    return get_relevance_gate_stats()
+
+
+@router.get("/llm-providers")
+async def llm_provider_metrics():
+    return get_llm_provider_stats()
+
+
+@router.get("/single-flight")
+async def single_flight_metrics():
+    return get_single_flight_stats()
+
+
+@router.get("/stages")
+async def stage_metrics():
+    return get_stage_stats()
+
+
+@router.get("/prometheus", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(prometheus_text(), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/interaction-log")
+async def interaction_log_metrics():
+    return get_interaction_log_stats()
@@ -1,15 +1,37 @@
-from pydantic import BaseModel
+from datetime import datetime
+from pydantic import BaseModel, Field
 from typing import Optional
 
 
+class RetrievalFilters(BaseModel):
+    titles: Optional[list[str]] = None
+    date_from: Optional[datetime] = None
+    date_to: Optional[datetime] = None
+    authors: Optional[list[str]] = None
+
+
 class MessageCreate(BaseModel):
     message: str
+    filters: Optional[RetrievalFilters] = None
+    # Return the per-stage spans of this request in Message.trace
+    trace: bool = False
+
+
+class BatchCreate(BaseModel):
+    messages: list[str] = Field(min_length=1, max_length=5000)
+    filters: Optional[RetrievalFilters] = None
+    # LLM calls in flight; BATCH_LLM_CONCURRENCY when not set
+    concurrency: Optional[int] = Field(default=None, ge=1, le=64)
 
 
 class Message(BaseModel):
     message: str
     id: str
     process_time: Optional[float]
+    # Per-stage timings in seconds
+    timings: Optional[dict[str, float]] = None
+    # Spans of the request, when MessageCreate.trace was set
+    trace: Optional[dict] = None
 
     class Config:
         from_attributes = True
@@ -0,0 +1,295 @@
+"""
+Offline recall@k vs latency benchmark for the items_3 vector index.
+
+Query vectors are stored embeddings with a little gaussian noise, so they
+behave like new questions close to the corpus. Exact results come from the
+same query with index scans disabled; every ef_search (HNSW) or probes
+(IVFFlat) value is then measured against them. An index over a compact
+storage (halfvec, bit) is measured once per --rerank factor.
+
+--storages rebuilds the index once per storage and reports its size next
+to the recall/latency trade-off, then restores the index it found:
+
+    python scripts/ann_benchmark.py --queries 200 --k 5
+    python scripts/ann_benchmark.py --build hnsw --m 24 --ef-construction 128 \\
+        --ef-search 20 40 80 160 --output hnsw_m24.json
+    python scripts/ann_benchmark.py --storages vector halfvec bit --rerank 1 4 10
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import time
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.append(project_root)
+
+from backend.databases.pool import close_pool, connection
+from backend.databases.vector_index import (
+    SEARCH_SETTINGS_SQL,
+    STORAGES,
+    create_vector_index,
+    get_index_size,
+    get_vector_index,
+    nearest_sql,
+    search_settings,
+)
+
+
+def search_query(storage: str = "vector", rerank_factor: int = None) -> str:
+    return (
+        nearest_sql("id", "TRUE", "%(query)s::vector", "%(k)s", storage, rerank_factor)
+        + ";"
+    )
+
+
+def sample_queries(cur, count: int, noise: float, seed: int) -> list[list[float]]:
+    cur.execute(
+        "SELECT embedding::real[] FROM items_3 ORDER BY random() LIMIT %s;",
+        (count,),
+    )
+    rng = random.Random(seed)
+    queries = []
+    for (embedding,) in cur.fetchall():
+        norm = math.sqrt(sum(x * x for x in embedding))
+        scale = noise * norm / math.sqrt(len(embedding))
+        queries.append([x + rng.gauss(0.0, scale) for x in embedding])
+    return queries
+
+
+def exact_search(cur, query: list[float], k: int) -> list[int]:
+    cur.execute("SET LOCAL enable_indexscan = off;")
+    cur.execute(search_query(), {"query": query, "k": k})
+    ids = [row[0] for row in cur.fetchall()]
+    cur.execute("RESET enable_indexscan;")
+    return ids
+
+
+def timed_search(
+    cur,
+    query,
+    k,
+    ef_search=None,
+    probes=None,
+    storage: str = "vector",
+    rerank_factor: int = None,
+) -> tuple[list, float]:
+    """
+    One search through the index, re-ranked at full precision when the
+    index stores a compact type.
+    """
+    start = time.perf_counter()
+    cur.execute(
+        SEARCH_SETTINGS_SQL,
+        search_settings(k, ef_search, probes, storage, rerank_factor),
+    )
+    cur.execute(search_query(storage, rerank_factor), {"query": query, "k": k})
+    ids = [row[0] for row in cur.fetchall()]
+    return ids, time.perf_counter() - start
+
+
+def _summarize(latencies: list[float], recalls: list[float]) -> dict:
+    summary = {
+        "recall": statistics.mean(recalls),
+        "mean_ms": statistics.mean(latencies) * 1000,
+    }
+    if len(latencies) >= 2:
+        percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+        summary["p50_ms"] = percentiles[49] * 1000
+        summary["p99_ms"] = percentiles[98] * 1000
+    return summary
+
+
+def run_benchmark(
+    query_count: int,
+    k: int,
+    values: list[int],
+    noise: float = 0.1,
+    seed: int = 0,
+    build: dict = None,
+    rerank_factors: list[int] = None,
+) -> dict:
+    """
+    Returns the index description and size, the exact-search latency and,
+    per ef_search / probes value (and rerank factor for a compact storage),
+    recall@k and latency.
+    """
+    with connection() as conn:
+        with conn.cursor() as cur:
+            build_time = None
+            if build:
+                start = time.perf_counter()
+                create_vector_index(cur, **build)
+                build_time = time.perf_counter() - start
+            index = get_vector_index(cur)
+            index_bytes = get_index_size(cur)
+            cur.execute("SELECT count(*) FROM items_3;")
+            rows = cur.fetchone()[0]
+            queries = sample_queries(cur, query_count, noise, seed)
+
+    if index is None:
+        raise SystemExit("items_3 has no vector index; build one with --build.")
+    parameter = "ef_search" if index["type"] == "hnsw" else "probes"
+    storage = index["storage"]
+    if storage == "vector" or not rerank_factors:
+        rerank_factors = [None]
+
+    with connection() as conn:
+        with conn.cursor() as cur:
+            truth = []
+            exact_latencies = []
+            for query in queries:
+                start = time.perf_counter()
+                truth.append(set(exact_search(cur, query, k)))
+                exact_latencies.append(time.perf_counter() - start)
+
+            results = []
+            for value in values:
+                for factor in rerank_factors:
+                    latencies = []
+                    recalls = []
+                    for query, expected in zip(queries, truth):
+                        ids, elapsed = timed_search(
+                            cur,
+                            query,
+                            k,
+                            storage=storage,
+                            rerank_factor=factor,
+                            **{parameter: value},
+                        )
+                        latencies.append(elapsed)
+                        recalls.append(len(expected.intersection(ids)) / len(expected))
+                    row = {parameter: value}
+                    if factor is not None:
+                        row["rerank_factor"] = factor
+                    results.append({**row, **_summarize(latencies, recalls)})
+
+    return {
+        "rows": rows,
+        "queries": len(queries),
+        "k": k,
+        "index": index,
+        "index_bytes": index_bytes,
+        "build_seconds": build_time,
+        "exact": _summarize(exact_latencies, [1.0] * len(exact_latencies)),
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall@k vs latency of the ANN index")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--noise", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--ef-search", type=int, nargs="+", default=[10, 20, 40, 80, 160]
+    )
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 5, 10, 20, 50])
+    parser.add_argument("--build", choices=["hnsw", "ivfflat"])
+    parser.add_argument("--m", type=int)
+    parser.add_argument("--ef-construction", type=int)
+    parser.add_argument("--lists", type=int)
+    parser.add_argument("--storage", choices=list(STORAGES), help="with --build")
+    parser.add_argument(
+        "--storages",
+        nargs="+",
+        choices=list(STORAGES),
+        help="compare index storages (rebuilds the index per storage)",
+    )
+    parser.add_argument(
+        "--rerank",
+        type=int,
+        nargs="+",
+        default=[1, 4, 10],
+        help="candidates per result re-ranked at full precision",
+    )
+    parser.add_argument("--output", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    with connection() as conn:
+        with conn.cursor() as cur:
+            existing = get_vector_index(cur)
+    build = None
+    if args.build or args.storages:
+        build = {
+            "index_type": args.build or (existing or {}).get("type"),
+            "m": args.m,
+            "ef_construction": args.ef_construction,
+            "lists": args.lists,
+            "storage": args.storage,
+        }
+    index_type = build["index_type"] if build else (existing or {}).get("type")
+    values = args.ef_search if index_type == "hnsw" else args.probes
+
+    runs = []
+    try:
+        for storage in args.storages or [None]:
+            if storage:
+                build["storage"] = storage
+            try:
+                runs.append(
+                    run_benchmark(
+                        args.queries,
+                        args.k,
+                        values,
+                        args.noise,
+                        args.seed,
+                        build,
+                        args.rerank,
+                    )
+                )
+            except ValueError as e:
+                # Checked before the old index is dropped
+                print(f"Skipping {storage}: {e}")
+    finally:
+        if args.storages and existing:
+            # Leave the index the application was configured with
+            with connection() as conn:
+                with conn.cursor() as cur:
+                    create_vector_index(
+                        cur,
+                        existing["type"],
+                        lists=existing["options"].get("lists"),
+                        storage=existing["storage"],
+                        **{
+                            key: existing["options"].get(key)
+                            for key in ("m", "ef_construction")
+                        },
+                    )
+        close_pool()
+
+    baseline_bytes = next(
+        (r["index_bytes"] for r in runs if r["index"]["storage"] == "vector"), None
+    )
+    for result in runs:
+        print(
+            f"{result['rows']} rows, {result['queries']} queries, k={result['k']}, "
+            f"index {result['index']}"
+        )
+        size = f"Index size: {result['index_bytes'] / 2**20:.1f} MiB"
+        if baseline_bytes and result["index"]["storage"] != "vector":
+            size += f" ({1 - result['index_bytes'] / baseline_bytes:.0%} smaller than vector)"
+        print(size)
+        if result["build_seconds"] is not None:
+            print(f"Build time: {result['build_seconds']:.1f}s")
+        exact = result["exact"]
+        print(f"exact search: mean {exact['mean_ms']:.2f}ms")
+        for row in result["results"]:
+            name, value = next(iter(row.items()))
+            line = f"{name}={value:<5}"
+            if "rerank_factor" in row:
+                line += f" rerank x{row['rerank_factor']:<3}"
+            line += f" recall@{args.k} {row['recall']:.3f}  mean {row['mean_ms']:.2f}ms"
+            if "p50_ms" in row:
+                line += f"  p50 {row['p50_ms']:.2f}ms  p99 {row['p99_ms']:.2f}ms"
+            print(line)
+        print()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(runs if args.storages else runs[0], f, indent=4)
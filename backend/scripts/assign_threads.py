@@ -0,0 +1,102 @@
+import os
+import sys
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.append(project_root)
+
+from backend.databases.pool import close_pool, connection
+
+
+def compute_thread_roots(replies: dict[int, int | None]) -> dict[int, int]:
+    """
+    Maps every message_id of a chat to the message_id of its thread root.
+
+    replies maps message_id -> reply_to_message_id. A reply whose parent is
+    not stored starts its own thread, as before. Messages are grouped with
+    union-find; the root of a group is the member without a stored parent
+    (the smallest id if a broken export contains a reply cycle).
+    """
+    parent = {message_id: message_id for message_id in replies}
+
+    def find(message_id):
+        root = message_id
+        while parent[root] != root:
+            root = parent[root]
+        while parent[message_id] != root:
+            parent[message_id], message_id = root, parent[message_id]
+        return root
+
+    for message_id, reply_to in replies.items():
+        if reply_to is None or reply_to not in parent:
+            continue
+        a, b = find(message_id), find(reply_to)
+        if a != b:
+            # Keep the smaller id as representative; the real root is
+            # picked below
+            parent[max(a, b)] = min(a, b)
+
+    thread_root = {}
+    for message_id, reply_to in replies.items():
+        if reply_to is None or reply_to not in replies:
+            thread_root[find(message_id)] = message_id
+    return {
+        message_id: thread_root.get(find(message_id), find(message_id))
+        for message_id in replies
+    }
+
+
+def assign_thread_ids(title: str) -> int:
+    """
+    Recomputes thread_id for every stored message of a chat and writes the
+    ones that changed. Cheap to rerun after each (incremental) ingest since
+    only the (message_id, reply_to_message_id) pairs are read.
+    Returns the number of rows updated.
+    """
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT (metadata->>'message_id')::bigint,
+                       (metadata->>'reply_to_message_id')::bigint
+                FROM items_3
+                WHERE metadata->>'title' = %s;
+                """,
+                (title,),
+            )
+            replies = dict(cur.fetchall())
+            roots = compute_thread_roots(replies)
+
+            cur.execute(
+                """
+                UPDATE items_3 AS i
+                SET thread_id = v.thread_id
+                FROM unnest(%s::text[], %s::bigint[]) AS v(message_id, thread_id)
+                WHERE i.metadata->>'title' = %s
+                  AND i.metadata->>'message_id' = v.message_id
+                  AND i.thread_id IS DISTINCT FROM v.thread_id;
+                """,
+                ([str(m) for m in roots], list(roots.values()), title),
+            )
+            return cur.rowcount
+
+
+def assign_all_thread_ids():
+    """
+    Backfills thread_id for every chat in items_3.
+    """
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT DISTINCT metadata->>'title' FROM items_3 "
+                "WHERE metadata->>'title' IS NOT NULL;"
+            )
+            titles = [row[0] for row in cur.fetchall()]
+
+    for title in titles:
+        updated = assign_thread_ids(title)
+        print(f"'{title}': {updated} rows got a new thread_id.")
+
+
+if __name__ == "__main__":
+    assign_all_thread_ids()
+    close_pool()
@@ -0,0 +1,73 @@
+"""
+Answers a file of questions with answer_batch and reports the throughput.
+
+The input is a JSON list of questions (or of {"query": ...} objects, as in
+the retrieval benchmark sets) or a text file with one question per line.
+Answers are written as JSON lines in completion order.
+
+    python scripts/batch_answer.py questions.txt --output answers.jsonl --concurrency 8
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.append(project_root)
+
+from backend.databases.pool import close_async_pool, open_async_pool
+from backend.services.google_service import answer_batch
+from backend.services.interaction_log import flush_interaction_log
+
+
+def load_questions(path: str) -> list[str]:
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if path.endswith(".json"):
+        return [
+            entry["query"] if isinstance(entry, dict) else entry
+            for entry in json.loads(text)
+        ]
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+
+async def main(args) -> dict:
+    questions = load_questions(args.questions)
+    output = open(args.output, "w", encoding="utf-8") if args.output else None
+    await open_async_pool()
+    try:
+        async for event, data in answer_batch(
+            questions,
+            top_k_context=args.top_k,
+            concurrency=args.concurrency,
+            chunk_size=args.chunk_size,
+        ):
+            if event == "done":
+                return data
+            if output:
+                output.write(json.dumps(data, ensure_ascii=False) + "\n")
+            status = "error" if "error" in data else "ok"
+            print(f"[{data['index']}] {status}: {data['query']}")
+    finally:
+        if output:
+            output.close()
+        await flush_interaction_log()
+        await close_async_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer many questions in one run")
+    parser.add_argument("questions", help="JSON list or one question per line")
+    parser.add_argument("--output", help="answers as JSON lines")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, help="LLM calls in flight")
+    parser.add_argument("--chunk-size", type=int, help="questions per retrieval batch")
+    args = parser.parse_args()
+
+    summary = asyncio.run(main(args))
+    print(
+        f"{summary['questions']} questions, {summary['errors']} errors in "
+        f"{summary['seconds']:.1f}s: {summary['questions_per_minute']:.1f} questions/min"
+    )
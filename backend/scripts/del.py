@@ -1,12 +1,27 @@
 import json
 import os
+import sys
 
 SCRIPT_DIR = os.path.abspath(os.path.dirname(__file__))
 
+project_root = os.path.abspath(os.path.join(SCRIPT_DIR, "..", ".."))
+sys.path.append(project_root)
+
+from backend.scripts.telegram_export import open_export
+
+
+def _write_record(f, record, first: bool):
+    # Same layout as json.dump(list, indent=4), one record at a time
+    if not first:
+        f.write(",\n")
+    encoded = json.dumps(record, ensure_ascii=False, indent=4)
+    f.write("\n".join("    " + line for line in encoded.splitlines()))
+
 
 def delete_records_before_id(filename, target_id):
     """
     Deletes all records from a JSON file that come before the record with the specified target_id.
+    The export is streamed record by record, so memory use does not depend on its size.
 
     Args:
         filename (str): Имя JSON-файла.
@@ -15,50 +30,62 @@ def delete_records_before_id(filename, target_id):
 
     data_filepath = os.path.join(SCRIPT_DIR, "..", "data", filename)
 
+    # Формируем имя нового файла
+    base, ext = os.path.splitext(filename)
+    new_filename = f"{base}-lite{ext}"
+    new_data_filepath = os.path.join(SCRIPT_DIR, "..", "data", new_filename)
+    tmp_filepath = new_data_filepath + ".part"
+
+    total_records = 0
+    kept_records = 0
     try:
-        with open(data_filepath, "r", encoding="utf-8") as f:
-            data = json.load(f).get("messages", [])
+        with open_export(data_filepath) as (_, records), open(
+            tmp_filepath, "w", encoding="utf-8"
+        ) as out:
+            out.write("[\n")
+            for record in records:
+                total_records += 1
+                # Оставляем записи, начиная с найденного индекса
+                if not kept_records and not (
+                    isinstance(record, dict) and record.get("id") == target_id
+                ):
+                    continue
+                _write_record(out, record, first=kept_records == 0)
+                kept_records += 1
+            out.write("\n]" if kept_records else "]")
     except FileNotFoundError:
         print(f"Ошибка: Файл '{filename}' не найден.")
         return
-    except json.JSONDecodeError:
+    except ValueError:
+        # json.JSONDecodeError is a ValueError too
         print(f"Ошибка: Не удалось декодировать JSON из файла '{filename}'.")
+        _remove_quietly(tmp_filepath)
         return
-
-    if not isinstance(data, list):
-        print(f"Ошибка: Ожидалось, что '{filename}' содержит список JSON-объектов.")
+    except IOError:
+        print(f"Ошибка: Не удалось записать обновленные данные в '{new_filename}'.")
+        _remove_quietly(tmp_filepath)
         return
 
-    found_index = -1
-    for i, record in enumerate(data):
-        if isinstance(record, dict) and record.get("id") == target_id:
-            found_index = i
-            break
-
-    if found_index != -1:
-        # Оставляем записи, начиная с найденного индекса
-        updated_data = data[found_index:]
-
-        # Формируем имя нового файла
-        base, ext = os.path.splitext(filename)
-        new_filename = f"{base}-lite{ext}"
-        new_data_filepath = os.path.join(SCRIPT_DIR, "..", "data", new_filename)
-
-        try:
-            with open(new_data_filepath, "w", encoding="utf-8") as f:
-                json.dump(updated_data, f, ensure_ascii=False, indent=4)
-            print(f"Обновленные данные сохранены в файл '{new_filename}'.")
-            print(
-                f"В новом файле {len(updated_data)} записей (исходный файл содержал {len(data)})."
-            )
-        except IOError:
-            print(f"Ошибка: Не удалось записать обновленные данные в '{new_filename}'.")
+    if kept_records:
+        os.replace(tmp_filepath, new_data_filepath)
+        print(f"Обновленные данные сохранены в файл '{new_filename}'.")
+        print(
+            f"В новом файле {kept_records} записей (исходный файл содержал {total_records})."
+        )
     else:
+        _remove_quietly(tmp_filepath)
         print(
             f"Запись с id {target_id} не найдена в файле '{filename}'. Файл не изменен."
         )
 
 
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
 if __name__ == "__main__":
     # Убедитесь, что файл estudia-liite.json находится в той же директории,
     # что и этот скрипт, или укажите полный путь к файлу.
@@ -0,0 +1,173 @@
+"""
+Embeddings per second and per-query latency of the embedding backends.
+
+  - ollama        the current path: one HTTP call per query, /api/embed
+                  for batches
+  - local         the in-process engine (services/local_embedder.py),
+                  queries micro-batched
+  - local-serial  the same model, one forward pass per query
+  - hash          the offline stand-in, as a floor
+
+Throughput embeds --texts synthetic messages in chunks of each
+--batch-sizes value. Latency sends --queries single-text requests with
+--concurrency requests in flight, the way concurrent /ai calls would.
+
+    python scripts/embedding_benchmark.py --backends ollama local --concurrency 1 8 32
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.append(project_root)
+
+import ollama
+
+from backend.scripts.synthetic_export import sample_texts
+from backend.services import local_embedder
+from backend.services.hash_embedder import hash_embedding, hash_embeddings
+from backend.services.ollama_service import OLLAMA_MODEL
+
+_clients = {}
+
+
+def _ollama_batch(texts):
+    return ollama.embed(model=OLLAMA_MODEL, input=texts)["embeddings"]
+
+
+async def _ollama_single(text):
+    # Client per event loop; asyncio.run below creates one per measurement
+    client = _clients.setdefault(id(asyncio.get_running_loop()), ollama.AsyncClient())
+    response = await client.embeddings(model=OLLAMA_MODEL, prompt=text)
+    return response["embedding"]
+
+
+async def _local_serial(text):
+    return (await asyncio.to_thread(local_embedder.embed_texts, [text]))[0]
+
+
+async def _hash_single(text):
+    return hash_embedding(text)
+
+
+# name: (embed a batch, embed one query asynchronously)
+BACKENDS = {
+    "ollama": (_ollama_batch, _ollama_single),
+    "local": (local_embedder.embed_texts, local_embedder.embed),
+    "local-serial": (local_embedder.embed_texts, _local_serial),
+    "hash": (hash_embeddings, _hash_single),
+}
+
+
+def _latency_summary(latencies: list[float], seconds: float) -> dict:
+    summary = {
+        "queries_per_second": len(latencies) / seconds,
+        "mean_ms": statistics.mean(latencies) * 1000,
+    }
+    if len(latencies) >= 2:
+        percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+        summary["p50_ms"] = percentiles[49] * 1000
+        summary["p99_ms"] = percentiles[98] * 1000
+    return summary
+
+
+def bench_throughput(embed_batch, texts: list[str], batch_size: int) -> float:
+    start = time.perf_counter()
+    for offset in range(0, len(texts), batch_size):
+        embed_batch(texts[offset : offset + batch_size])
+    return len(texts) / (time.perf_counter() - start)
+
+
+async def bench_latency(embed_one, texts: list[str], concurrency: int) -> dict:
+    latencies = []
+    pending = iter(texts)
+
+    async def worker():
+        for text in pending:
+            start = time.perf_counter()
+            await embed_one(text)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return _latency_summary(latencies, time.perf_counter() - start)
+
+
+def run_benchmark(args) -> dict:
+    texts = sample_texts(args.texts, args.seed)
+    queries = sample_texts(args.queries, args.seed + 1)
+    results = {}
+    for name in args.backends:
+        embed_batch, embed_one = BACKENDS[name]
+        start = time.perf_counter()
+        # Warm-up: model load, first forward pass, HTTP connection
+        embed_batch(texts[:1])
+        result = {"warm_up_seconds": time.perf_counter() - start}
+        result["throughput"] = {
+            str(batch_size): bench_throughput(embed_batch, texts, batch_size)
+            for batch_size in args.batch_sizes
+        }
+        result["latency"] = {}
+        for concurrency in args.concurrency:
+            engine = local_embedder.get_local_embedder_stats()
+            summary = asyncio.run(bench_latency(embed_one, queries, concurrency))
+            if name.startswith("local"):
+                after = local_embedder.get_local_embedder_stats()
+                batches = after["batches"] - engine["batches"]
+                summary["mean_batch"] = (after["texts"] - engine["texts"]) / batches
+            result["latency"][str(concurrency)] = summary
+        results[name] = result
+        print(f"{name}: done")
+    if any(name.startswith("local") for name in args.backends):
+        results["local_engine"] = local_embedder.get_local_embedder_stats()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embedding backend benchmark")
+    parser.add_argument(
+        "--backends", nargs="+", choices=list(BACKENDS), default=["ollama", "local"]
+    )
+    parser.add_argument("--texts", type=int, default=1000, help="throughput corpus")
+    parser.add_argument("--queries", type=int, default=200, help="latency requests")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+
+    for name in args.backends:
+        result = results[name]
+        print(f"\n{name} (warm-up {result['warm_up_seconds']:.2f}s)")
+        for batch_size, rate in result["throughput"].items():
+            print(f"  batch {batch_size:>4}: {rate:8.1f} embeddings/s")
+        for concurrency, summary in result["latency"].items():
+            line = (
+                f"  {concurrency:>4} in flight: {summary['queries_per_second']:8.1f} "
+                f"queries/s  mean {summary['mean_ms']:.2f}ms"
+            )
+            if "p50_ms" in summary:
+                line += (
+                    f"  p50 {summary['p50_ms']:.2f}ms  p99 {summary['p99_ms']:.2f}ms"
+                )
+            if "mean_batch" in summary:
+                line += f"  batch {summary['mean_batch']:.1f}"
+            print(line)
+    if "local_engine" in results:
+        engine = results["local_engine"]
+        print(
+            f"\nlocal engine: {engine['model']} on {engine['runtime']}, "
+            f"{engine['threads'] or 'default'} threads, loaded in "
+            f"{engine['load_seconds']:.1f}s"
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
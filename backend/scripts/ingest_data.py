@@ -1,19 +1,53 @@
 # backend/ingest_data.py
 
-import json
+import argparse
 import concurrent.futures
+import hashlib
+import json
 import os
 import sys
+import time
 import uuid
+from collections import deque
 
 # Настройка путей для корректных импортов
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
 sys.path.append(project_root)
 
 # Импортируем функции из наших модулей
-from backend.services.google_vectorise import save_embedding_to_db
-from backend.services.ollama_service import get_text_embedding
-from backend.databases.postgre_db import create_items_table
+from backend.services.google_vectorise import (
+    RETRIEVER_BACKEND,
+    copy_embeddings_to_db,
+    save_embedding_to_db,
+)
+from backend.services.local_index import build_from_database
+from backend.services.ollama_service import get_text_embedding, get_text_embeddings
+from backend.services.answer_cache import (
+    create_answer_cache_table,
+    invalidate_answers_for_titles,
+)
+from backend.databases.pool import close_pool, connection, get_pool_metrics
+from backend.databases.migrations import apply_migrations
+from backend.databases.vector_index import (
+    EMBEDDING_STORAGE,
+    check_storage,
+    ensure_vector_index,
+)
+from backend.scripts.telegram_export import get_chat_title, open_export
+from backend.scripts.assign_threads import assign_thread_ids
+from backend.databases.ingest_state import (
+    advance_watermark,
+    checkpoint_source,
+    clear_checkpoint,
+    create_ingest_checkpoints_table,
+    create_ingest_watermarks_table,
+    get_checkpoint,
+    get_watermark,
+    set_checkpoint,
+)
+
+DEFAULT_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+DEFAULT_EMBED_WORKERS = int(os.getenv("INGEST_EMBED_WORKERS", "2"))
 
 
 def _get_processed_text_from_message_field(
@@ -38,22 +72,22 @@ def _get_processed_text_from_message_field(
     return ""
 
 
-def process_message_item(message_data, index, title):
+def _build_record(message_data, title):
     """
-    Processes a single message using the full thread context.
+    Returns (text, metadata) for a message worth embedding, or None to skip it.
     """
     message_id = message_data.get("id")
     if not message_id:
-        return False  # Skip messages without ID
+        return None  # Skip messages without ID
 
     if message_data.get("type") != "message" or not message_data.get("text"):
-        return False  # Skip non-messages or empty
+        return None  # Skip non-messages or empty
 
     text_to_embed = _get_processed_text_from_message_field(message_data.get("text"))
 
     if not text_to_embed or len(text_to_embed) < 3:
         print(f"Skipping message ID {message_id}: text for embedding is too short.")
-        return False
+        return None
 
     metadata = {
         "message_id": message_id,
@@ -63,14 +97,37 @@ def process_message_item(message_data, index, title):
         "from": message_data.get("from"),
         "reply_to_message_id": message_data.get("reply_to_message_id"),
     }
+    return text_to_embed, metadata
+
+
+def _content_hash(text: str, metadata: dict) -> str:
+    """
+    Fingerprint of everything stored for a message; it changes when the
+    message is edited in a newer export.
+    """
+    payload = json.dumps([text, metadata], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def process_message_item(message_data, index, title):
+    """
+    Processes a single message using the full thread context.
+    """
+    record = _build_record(message_data, title)
+    if record is None:
+        return False
+    text_to_embed, metadata = record
+    message_id = metadata["message_id"]
 
     try:
         embedding = get_text_embedding(text_to_embed)
         if embedding:
-            original_text = _get_processed_text_from_message_field(
-                message_data.get("text")
+            save_embedding_to_db(
+                text_to_embed,
+                embedding,
+                metadata,
+                content_hash=_content_hash(text_to_embed, metadata),
             )
-            save_embedding_to_db(original_text, embedding, metadata)
             return True
         else:
             print(f"Skipped message ID {message_id}: failed to obtain embedding.")
@@ -88,53 +145,366 @@ def ingest_messages_from_json(json_file_path: str):
         print(f"Error: File not found at path: {json_file_path}")
         return
 
-    with open(json_file_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    title = data.get("name", data.get("title", "Unknown Chat"))
-    messages_data = data.get("messages", [])
-
-    if not isinstance(messages_data, list):
-        print("Error: JSON file must contain a list of messages.")
-        return
-
-    print(f"Found {len(messages_data)} messages to process.")
     try:
-        create_items_table()
+        with connection() as conn:
+            with conn.cursor() as cur:
+                apply_migrations(cur)
+                create_answer_cache_table(cur)
     except Exception as e:
         print(f"Failed to prepare DB table: {e}")
         return
 
     successful_imports = 0
     failed_imports = 0
+    max_workers = os.cpu_count()
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
-        future_to_message = {
-            executor.submit(process_message_item, msg_data, i, title): msg_data.get(
-                "id", f"N/A_idx_{i}"
-            )
-            for i, msg_data in enumerate(messages_data)
-        }
-        for future in concurrent.futures.as_completed(future_to_message):
-            message_id_info = future_to_message[future]
-            try:
-                if future.result():
-                    successful_imports += 1
-                else:
-                    failed_imports += 1
-            except Exception as exc:
-                print(f"Message {message_id_info} caused an exception: {exc}")
-                failed_imports += 1
+    with open_export(json_file_path) as (header, messages_data):
+        title = get_chat_title(header)
+        print(f"Processing messages of '{title}'.")
+
+        # Only a bounded window of messages is in flight, so memory does not
+        # grow with the size of the export.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            future_to_message = {}
+
+            def collect(futures):
+                nonlocal successful_imports, failed_imports
+                for future in futures:
+                    message_id_info = future_to_message.pop(future)
+                    try:
+                        if future.result():
+                            successful_imports += 1
+                        else:
+                            failed_imports += 1
+                    except Exception as exc:
+                        print(f"Message {message_id_info} caused an exception: {exc}")
+                        failed_imports += 1
+
+            for i, msg_data in enumerate(messages_data):
+                future = executor.submit(process_message_item, msg_data, i, title)
+                future_to_message[future] = msg_data.get("id", f"N/A_idx_{i}")
+                if len(future_to_message) >= max_workers * 4:
+                    done, _ = concurrent.futures.wait(
+                        future_to_message,
+                        return_when=concurrent.futures.FIRST_COMPLETED,
+                    )
+                    collect(done)
+            collect(list(future_to_message))
+
+    if successful_imports:
+        with connection() as conn:
+            with conn.cursor() as cur:
+                invalidate_answers_for_titles(cur, [title])
+        print(f"Assigned thread ids to {assign_thread_ids(title)} rows.")
 
     print(
         f"\nProcessing complete. Successfully saved: {successful_imports}, skipped/errors: {failed_imports}."
     )
+    print(f"Connection pool: {get_pool_metrics()['sync']}")
+    close_pool()
+
+
+def _iter_batches(messages_data, title, start_index: int, batch_size: int):
+    """
+    Yields (last_index, records) where records holds up to batch_size
+    (text, metadata, content_hash) tuples and last_index is the index of the last message
+    consumed, skipped ones included, so it can serve as a checkpoint.
+    """
+    records = []
+    last_index = yielded_index = start_index
+    for i, message_data in enumerate(messages_data):
+        if i <= start_index:
+            continue
+        last_index = i
+        record = _build_record(message_data, title)
+        if record is not None:
+            records.append((*record, _content_hash(*record)))
+        if len(records) >= batch_size:
+            yield last_index, records
+            records = []
+            yielded_index = last_index
+    if last_index > yielded_index:
+        yield last_index, records
+
+
+def _drop_unchanged(records, title, watermark_id: int):
+    """
+    Splits off messages that are already stored with the same content hash.
+    Only ids at or below the chat watermark can exist in the DB, so newer
+    messages skip the lookup entirely. Returns (records to embed, skipped).
+    """
+    known_ids = [
+        str(metadata["message_id"])
+        for _, metadata, _ in records
+        if metadata["message_id"] <= watermark_id
+    ]
+    if not known_ids:
+        return records, 0
+
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT metadata->>'message_id', content_hash
+                FROM items_3
+                WHERE metadata->>'title' = %s AND metadata->>'message_id' = ANY(%s);
+                """,
+                (title, known_ids),
+            )
+            stored_hashes = dict(cur.fetchall())
+
+    changed = [
+        record
+        for record in records
+        if stored_hashes.get(str(record[1]["message_id"])) != record[2]
+    ]
+    return changed, len(records) - len(changed)
+
+
+def _embed_batch(records):
+    return get_text_embeddings([text for text, _, _ in records])
+
+
+def _write_batch(source, title, last_index, records, embeddings) -> int:
+    """
+    Writes one batch with COPY and, in the same transaction, advances the
+    chat watermark, drops cached answers built from this chat and (unless
+    source is None) advances the file checkpoint.
+    """
+    rows = [
+        (text, embedding, metadata, content_hash)
+        for (text, metadata, content_hash), embedding in zip(records, embeddings)
+        if embedding
+    ]
+    written = 0
+    with connection() as conn:
+        with conn.cursor() as cur:
+            if rows:
+                written = copy_embeddings_to_db(cur, rows)
+                advance_watermark(
+                    cur,
+                    title,
+                    max(metadata["message_id"] for _, _, metadata, _ in rows),
+                    # None leaves the stored date alone (GREATEST ignores NULL)
+                    max(
+                        (
+                            metadata["date"]
+                            for _, _, metadata, _ in rows
+                            if metadata["date"]
+                        ),
+                        default=None,
+                    ),
+                )
+                if written:
+                    invalidate_answers_for_titles(cur, [title])
+            if source is not None:
+                set_checkpoint(cur, source, title, last_index)
+    return written
+
+
+def _ingest_batches(
+    messages_data,
+    title,
+    source,
+    start_index,
+    batch_size,
+    embed_workers,
+    incremental=False,
+):
+    """
+    Embeds and writes batches in order. In incremental mode messages whose
+    content hash is already stored are dropped before embedding.
+    Returns (rows saved, unchanged messages skipped, messages consumed,
+    elapsed seconds).
+    """
+    saved = 0
+    unchanged = 0
+    consumed = 0
+    watermark_id = 0
+    if incremental:
+        with connection() as conn:
+            with conn.cursor() as cur:
+                watermark_id, watermark_date = get_watermark(cur, title)
+        print(f"Watermark for '{title}': message {watermark_id} ({watermark_date}).")
+    started = time.perf_counter()
+    previous_index = start_index
+
+    # Embedding of the next batches overlaps with writing the current one;
+    # batches are still written in order so the checkpoint stays monotonic.
+    in_flight = deque()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=embed_workers) as executor:
+
+        def drain_one():
+            nonlocal saved, consumed, previous_index
+            last_index, records, future = in_flight.popleft()
+            saved += _write_batch(source, title, last_index, records, future.result())
+            consumed += last_index - previous_index
+            previous_index = last_index
+            elapsed = time.perf_counter() - started
+            print(
+                f"Index {last_index}: saved {saved}, unchanged {unchanged}, "
+                f"{consumed / elapsed:.1f} messages/s, {saved / elapsed:.1f} rows/s"
+            )
+
+        for last_index, records in _iter_batches(
+            messages_data, title, start_index, batch_size
+        ):
+            if incremental:
+                records, skipped = _drop_unchanged(records, title, watermark_id)
+                unchanged += skipped
+            future = executor.submit(_embed_batch, records)
+            in_flight.append((last_index, records, future))
+            if len(in_flight) >= embed_workers:
+                drain_one()
+        while in_flight:
+            drain_one()
+
+    return saved, unchanged, consumed, time.perf_counter() - started
+
+
+def ingest_messages_batched(
+    json_file_path: str,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    embed_workers: int = DEFAULT_EMBED_WORKERS,
+    restart: bool = False,
+    incremental: bool = False,
+    build_local_index: bool = None,
+):
+    """
+    Streams messages in batches: one embedding call and one COPY per batch.
+    Progress is checkpointed per batch, so rerunning after a crash resumes
+    from the last committed batch unless restart is set. The checkpoint is
+    keyed by the file's absolute path and chat id, is only resumed for the
+    same chat title, and is deleted once the run completes.
+
+    With incremental set the file checkpoint is not used; instead a newer
+    export of an already ingested chat is compared against the stored
+    content hashes and only new or edited messages are embedded.
+
+    build_local_index rewrites the in-process vector index after the load;
+    by default it does so when RETRIEVER_BACKEND is "local" and rows changed.
+    """
+    if not os.path.exists(json_file_path):
+        print(f"Error: File not found at path: {json_file_path}")
+        return
+
+    try:
+        with connection() as conn:
+            with conn.cursor() as cur:
+                removed = apply_migrations(cur)
+                # Fail before embedding anything, not at the index build
+                check_storage(cur, EMBEDDING_STORAGE)
+                create_ingest_checkpoints_table(cur)
+                create_ingest_watermarks_table(cur)
+                create_answer_cache_table(cur)
+    except Exception as e:
+        print(f"Failed to prepare DB table: {e}")
+        return
+
+    if removed:
+        print(f"Removed {removed} duplicate rows left by earlier re-ingests.")
+
+    with open_export(json_file_path) as (header, messages_data):
+        title = get_chat_title(header)
+        source = checkpoint_source(json_file_path, header.get("id"))
+        start_index = -1
+        if not incremental:
+            with connection() as conn:
+                with conn.cursor() as cur:
+                    if restart:
+                        clear_checkpoint(cur, source)
+                    start_index, checkpoint_title = get_checkpoint(cur, source)
+            if start_index >= 0 and checkpoint_title != title:
+                print(
+                    f"Checkpoint for '{source}' belongs to chat '{checkpoint_title}', "
+                    f"not '{title}'. Rerun with --restart to ingest from the start."
+                )
+                close_pool()
+                return
+            if start_index >= 0:
+                print(f"Resuming '{source}' after message index {start_index}.")
+
+        print(f"Processing messages of '{title}' (batch size {batch_size}).")
+        saved, unchanged, consumed, elapsed = _ingest_batches(
+            messages_data,
+            title,
+            None if incremental else source,
+            start_index,
+            batch_size,
+            embed_workers,
+            incremental=incremental,
+        )
+
+    if not incremental:
+        # The whole file is in; a later export at this path starts afresh
+        with connection() as conn:
+            with conn.cursor() as cur:
+                clear_checkpoint(cur, source)
+
+    if saved:
+        print(f"Assigned thread ids to {assign_thread_ids(title)} rows.")
+        # Built after the first load rather than before it: bulk inserts into
+        # an existing HNSW graph are several times slower than one build.
+        with connection() as conn:
+            with conn.cursor() as cur:
+                if ensure_vector_index(cur):
+                    print("Built the embedding index.")
+
+    if build_local_index is None:
+        build_local_index = bool(saved) and RETRIEVER_BACKEND == "local"
+    if build_local_index:
+        print(f"Wrote {build_from_database()} rows to the local vector index.")
+
+    rate = consumed / elapsed if elapsed else 0.0
+    print(
+        f"\nProcessing complete. Saved {saved} new/changed rows, "
+        f"skipped {unchanged} unchanged, from {consumed} messages "
+        f"in {elapsed:.1f}s ({rate:.1f} messages/s)."
+    )
+    close_pool()
 
 
 if __name__ == "__main__":
-    json_path = os.path.join(os.path.dirname(__file__), "..", "data", "russians.json")
-    print(f"Starting data loading from {json_path}...")
-    ingest_messages_from_json(
-        json_path
-    )  # Corrected typo in "ingest_messages_from_json"
+    parser = argparse.ArgumentParser(description="Load a Telegram export into items_3")
+    parser.add_argument(
+        "json_path",
+        nargs="?",
+        default=os.path.join(os.path.dirname(__file__), "..", "data", "russians.json"),
+    )
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=DEFAULT_EMBED_WORKERS)
+    parser.add_argument(
+        "--restart", action="store_true", help="ignore the saved checkpoint"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="re-ingest a newer export: embed only new or edited messages",
+    )
+    parser.add_argument(
+        "--per-message",
+        action="store_true",
+        help="legacy mode: one embedding call and INSERT per message",
+    )
+    parser.add_argument(
+        "--build-local-index",
+        action="store_true",
+        default=None,
+        help="rewrite the local vector index after loading",
+    )
+    args = parser.parse_args()
+
+    print(f"Starting data loading from {args.json_path}...")
+    if args.per_message:
+        ingest_messages_from_json(args.json_path)
+    else:
+        ingest_messages_batched(
+            args.json_path,
+            batch_size=args.batch_size,
+            embed_workers=args.workers,
+            restart=args.restart,
+            incremental=args.incremental,
+            build_local_index=args.build_local_index,
+        )
     print("Загрузка данных завершена.")  # Corrected typo in "завершена"
     print("Data loading finished.")
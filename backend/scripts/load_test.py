@@ -0,0 +1,93 @@
+"""
+Concurrent load test for the /ai endpoint.
+
+Fires a fixed number of requests from N concurrent clients against a running
+server and reports throughput and p50/p99 latency.
+
+    python scripts/load_test.py --url http://127.0.0.1:8000 --clients 50 --requests 500
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+DEFAULT_QUERIES = [
+    "Need information on technical schools?",
+    "ILSE cuota",
+    "Bilingual primary schools in Belgrano",
+    "How does the secondary school admission work in Buenos Aires?",
+]
+
+
+async def _client_worker(client, url, queries, counter, latencies, errors):
+    while True:
+        index = counter["next"]
+        if index >= counter["total"]:
+            return
+        counter["next"] += 1
+
+        payload = {"message": queries[index % len(queries)]}
+        start = time.perf_counter()
+        try:
+            response = await client.post(f"{url}/ai", json=payload)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            errors.append(str(e))
+
+
+async def run_load_test(
+    url: str, clients: int, total_requests: int, queries: list[str] = None
+) -> dict:
+    """
+    Runs the load test and returns a summary with latency percentiles in seconds.
+    """
+    queries = queries or DEFAULT_QUERIES
+    counter = {"next": 0, "total": total_requests}
+    latencies = []
+    errors = []
+
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(
+                _client_worker(client, url, queries, counter, latencies, errors)
+                for _ in range(clients)
+            )
+        )
+        wall_time = time.perf_counter() - started
+
+    summary = {
+        "clients": clients,
+        "requests": total_requests,
+        "succeeded": len(latencies),
+        "failed": len(errors),
+        "wall_time": wall_time,
+        "throughput_rps": len(latencies) / wall_time if wall_time else 0.0,
+    }
+    if len(latencies) >= 2:
+        percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+        summary["p50"] = percentiles[49]
+        summary["p99"] = percentiles[98]
+        summary["max"] = max(latencies)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test for the /ai endpoint")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    result = asyncio.run(run_load_test(args.url, args.clients, args.requests))
+
+    print(f"Clients: {result['clients']}, requests: {result['requests']}")
+    print(f"Succeeded: {result['succeeded']}, failed: {result['failed']}")
+    print(f"Throughput: {result['throughput_rps']:.2f} req/s")
+    if "p50" in result:
+        print(f"p50: {result['p50']:.3f}s  p99: {result['p99']:.3f}s")
@@ -0,0 +1,517 @@
+"""
+Reproducible end-to-end benchmark that needs neither network nor models.
+
+Embeddings come from the deterministic hash embedder (EMBEDDING_BACKEND=
+hash) and answers from the "local" LLM provider; the corpus is a synthetic
+Telegram export (scripts/synthetic_export.py) loaded into its own database,
+BENCHMARK_DB_NAME (rag_benchmark), which is created when missing and whose
+tables are dropped on every run. Measured:
+
+  - ingestion throughput of ingest_messages_batched
+  - retrieval hit rate / MRR / latency per backend (retrieval_benchmark)
+    and ANN recall@k vs ef_search / probes (ann_benchmark)
+  - get_chain latency per thread size, by thread_id and by reply walk
+  - end-to-end p50/p99 of validation + retrieval + generation, per stage
+
+Results are written as JSON to data/benchmarks/ and can be compared with an
+earlier run:
+
+    python scripts/offline_benchmark.py --messages 100000
+    python scripts/offline_benchmark.py --messages 100000 --compare data/benchmarks/offline-100000-<ts>.json
+
+Absolute numbers depend on the machine; compare runs from the same box.
+Retrieval quality with hash embeddings is lexical quality, so it tracks
+changes to the retrieval code, not to the embedding model.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# The stand-ins have to be in place before the services read their settings
+os.environ.update(
+    {
+        "EMBEDDING_BACKEND": "hash",
+        "LLM_PROVIDERS": "local",
+        "VALIDATION_MODE": "local",
+        # The gate threshold is tuned for the real model; let everything through
+        "RELEVANCE_MAX_DISTANCE": "2.0",
+        "ANSWER_CACHE_ENABLED": "false",
+        "EMBEDDING_CACHE_PERSIST": "false",
+        "INTERACTION_LOG_ENABLED": "false",
+    }
+)
+# Provider clients are created at import time and only need a value
+os.environ.setdefault("GOOGLE_API_KEY", "offline")
+os.environ.setdefault("OPENAI_API_KEY", "offline")
+os.environ.setdefault(
+    "LOCAL_INDEX_DIR", tempfile.mkdtemp(prefix="rag_benchmark_index_")
+)
+APP_DB_NAME = os.getenv("DB_NAME", "postgres")
+BENCHMARK_DB_NAME = os.getenv("BENCHMARK_DB_NAME", "rag_benchmark")
+os.environ["DB_NAME"] = BENCHMARK_DB_NAME
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.append(project_root)
+
+import psycopg
+from psycopg.conninfo import make_conninfo
+
+from backend.databases.pool import (
+    async_connection,
+    close_async_pool,
+    close_pool,
+    connection,
+    get_conninfo,
+    open_async_pool,
+)
+from backend.databases.vector_index import (
+    EMBEDDING_STORAGE,
+    check_storage,
+    get_vector_index,
+)
+from backend.scripts import ann_benchmark, retrieval_benchmark
+from backend.scripts.ingest_data import ingest_messages_batched
+from backend.scripts.synthetic_export import generate_export
+from backend.services.chaining_service import get_chain
+from backend.services.google_service import check_query, get_llm_response_with_context
+from backend.services.local_index import build_from_database
+from backend.services.tracing import stage_timings, trace
+
+BENCHMARK_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "benchmarks")
+BENCHMARK_TABLES = (
+    "items_3",
+    "ingest_checkpoints",
+    "ingest_watermarks",
+    "answer_cache",
+    "embedding_cache",
+)
+# Compared metrics by the end of their key; counts and settings are not
+LOWER_IS_BETTER = ("_ms", "seconds", "_bytes")
+HIGHER_IS_BETTER = ("recall", "hit_rate", "precision", "mrr", "per_second")
+ANN_PARAMETERS = ("ef_search", "probes", "rerank_factor")
+# Latency changes below this are timer noise, whatever the relative change
+COMPARE_MIN_MS = 1.0
+
+
+def _summarize(latencies: list[float]) -> dict:
+    summary = {"count": len(latencies), "mean_ms": statistics.mean(latencies) * 1000}
+    if len(latencies) >= 2:
+        percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+        summary["p50_ms"] = percentiles[49] * 1000
+        summary["p99_ms"] = percentiles[98] * 1000
+    return summary
+
+
+@contextlib.contextmanager
+def _quiet(verbose: bool):
+    # The services print per query; that would drown the report
+    if verbose:
+        yield
+        return
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def prepare_database():
+    """
+    Creates BENCHMARK_DB_NAME when missing and drops the tables a previous
+    run left behind.
+    """
+    if BENCHMARK_DB_NAME == APP_DB_NAME:
+        raise SystemExit(
+            f"BENCHMARK_DB_NAME is the application database ({APP_DB_NAME}); "
+            "the benchmark drops its tables, pick another name."
+        )
+    admin_conninfo = make_conninfo(get_conninfo(), dbname=APP_DB_NAME)
+    with psycopg.connect(admin_conninfo, autocommit=True) as conn:
+        exists = conn.execute(
+            "SELECT 1 FROM pg_database WHERE datname = %s;", (BENCHMARK_DB_NAME,)
+        ).fetchone()
+        if not exists:
+            conn.execute(f'CREATE DATABASE "{BENCHMARK_DB_NAME}";')
+            print(f"Created database {BENCHMARK_DB_NAME}.")
+
+    try:
+        with connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+                check_storage(cur, EMBEDDING_STORAGE)
+    except ValueError as e:
+        close_pool()
+        raise SystemExit(str(e))
+
+    with connection() as conn:
+        with conn.cursor() as cur:
+            for table in BENCHMARK_TABLES:
+                cur.execute(f"DROP TABLE IF EXISTS {table} CASCADE;")
+
+
+def bench_ingest(export_path: str, args) -> dict:
+    start = time.perf_counter()
+    with _quiet(args.verbose):
+        ingest_messages_batched(
+            export_path,
+            batch_size=args.batch_size,
+            embed_workers=args.workers,
+            restart=True,
+        )
+    seconds = time.perf_counter() - start
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT count(*), count(thread_id) FROM items_3;")
+            rows, threaded = cur.fetchone()
+            index = get_vector_index(cur)
+
+    start = time.perf_counter()
+    build_from_database()
+    local_index_seconds = time.perf_counter() - start
+    return {
+        "rows": rows,
+        "rows_with_thread_id": threaded,
+        "seconds": seconds,
+        "rows_per_second": rows / seconds if seconds else 0.0,
+        "index": index,
+        "local_index_seconds": local_index_seconds,
+    }
+
+
+def bench_ann(args, index: dict | None) -> dict | None:
+    if index is None:
+        print("No vector index on items_3 (corpus too small?), skipping ANN recall.")
+        return None
+    values = args.ef_search if index["type"] == "hnsw" else args.probes
+    result = ann_benchmark.run_benchmark(
+        args.ann_queries, args.k, values, rerank_factors=args.rerank
+    )
+    return {
+        "index_bytes": result["index_bytes"],
+        "exact": result["exact"],
+        "results": result["results"],
+    }
+
+
+async def _chain_item(title: str, message_id: int) -> dict | None:
+    # get_chain only needs what a retrieved item carries
+    async with async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                SELECT id, metadata, thread_id FROM items_3
+                WHERE metadata->>'title' = %s AND metadata->>'message_id' = %s;
+                """,
+                (title, str(message_id)),
+            )
+            row = await cur.fetchone()
+    if row is None:
+        return None
+    return {"id": row[0], "metadata": row[1], "thread_id": row[2]}
+
+
+async def bench_chains(labels: dict, rounds: int) -> dict:
+    """
+    get_chain latency per thread size bucket, once through the precomputed
+    thread_id and once through the recursive reply walk.
+    """
+    title = labels["meta"]["title"]
+    buckets = {}
+    for sample in labels["chains"]:
+        item = await _chain_item(title, sample["message_id"])
+        if item is None:
+            continue
+        bucket = buckets.setdefault(
+            sample["bucket"], {"thread_id": [], "walk": [], "sizes": [], "depths": []}
+        )
+        for method, chain_item in (
+            ("thread_id", item),
+            ("walk", {**item, "thread_id": None}),
+        ):
+            for _ in range(rounds):
+                start = time.perf_counter()
+                chain = await get_chain(chain_item)
+                bucket[method].append(time.perf_counter() - start)
+        # The first entry of a chain is {"root_id": ...}
+        bucket["sizes"].append(len(chain) - 1)
+        bucket["depths"].append(sample["depth"])
+
+    return {
+        str(bound): {
+            "samples": len(bucket["sizes"]),
+            "mean_thread_size": statistics.mean(bucket["sizes"]),
+            "max_depth": max(bucket["depths"]),
+            "thread_id": _summarize(bucket["thread_id"]),
+            "walk": _summarize(bucket["walk"]),
+        }
+        for bound, bucket in sorted(buckets.items())
+    }
+
+
+async def bench_end_to_end(queries: list[str], rounds: int, top_k: int) -> dict:
+    """
+    The /ai path without HTTP: validation, retrieval and generation under a
+    trace, so the stages can be reported separately.
+    """
+    latencies = []
+    stages = {}
+    valid_count = 0
+    for _ in range(rounds):
+        for query in queries:
+            start = time.perf_counter()
+            with trace("offline_benchmark") as current:
+                valid, context = await check_query(query, top_k)
+                if valid:
+                    await get_llm_response_with_context(query, top_k, context)
+            latencies.append(time.perf_counter() - start)
+            valid_count += valid
+            for stage, seconds in stage_timings(current).items():
+                stages.setdefault(stage, []).append(seconds)
+    return {
+        **_summarize(latencies),
+        "valid": valid_count,
+        "stages": {stage: _summarize(values) for stage, values in stages.items()},
+    }
+
+
+async def bench_async(labels: dict, args) -> dict:
+    await open_async_pool()
+    try:
+        results = {}
+        with _quiet(args.verbose):
+            results["retrieval"] = await retrieval_benchmark.run_benchmark(
+                labels["queries"], args.k, args.backends, args.rounds
+            )
+            results["chains"] = await bench_chains(labels, args.rounds)
+            results["end_to_end"] = await bench_end_to_end(
+                [label["query"] for label in labels["queries"]], args.rounds, args.k
+            )
+        return results
+    finally:
+        await close_async_pool()
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(__file__),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args) -> dict:
+    export_path = args.export
+    if export_path:
+        with open(args.labels, encoding="utf-8") as f:
+            labels = json.load(f)
+    else:
+        export_path = os.path.join(
+            tempfile.gettempdir(), f"rag_benchmark_{args.messages}_{args.seed}.json"
+        )
+        start = time.perf_counter()
+        labels = generate_export(
+            export_path, args.messages, seed=args.seed, queries=args.queries
+        )
+        print(
+            f"Generated {args.messages} messages in {time.perf_counter() - start:.1f}s."
+        )
+
+    prepare_database()
+    print("Ingesting...")
+    ingest = bench_ingest(export_path, args)
+    print(f"Ingested {ingest['rows']} rows ({ingest['rows_per_second']:.0f} rows/s).")
+    ann = bench_ann(args, ingest["index"])
+    close_pool()
+    print("Retrieval, chains and end-to-end...")
+    results = asyncio.run(bench_async(labels, args))
+    close_pool()
+
+    return {
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "corpus": labels["meta"],
+            "params": {
+                key: value
+                for key, value in vars(args).items()
+                if key not in ("compare", "output", "verbose")
+            },
+        },
+        "ingest": ingest,
+        "ann": ann,
+        **results,
+    }
+
+
+def _flatten(value, prefix: str = "") -> dict:
+    if isinstance(value, dict):
+        flat = {}
+        for key, child in value.items():
+            flat.update(_flatten(child, f"{prefix}.{key}" if prefix else str(key)))
+        return flat
+    if isinstance(value, list):
+        flat = {}
+        for index, child in enumerate(value):
+            # ANN rows are keyed by their parameters rather than position
+            labels = [
+                f"{name}={child[name]}"
+                for name in ANN_PARAMETERS
+                if isinstance(child, dict) and name in child
+            ]
+            key = ",".join(labels) or str(index)
+            flat.update(_flatten(child, f"{prefix}[{key}]"))
+        return flat
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: value}
+    return {}
+
+
+def compare(old: dict, new: dict, threshold: float) -> list[str]:
+    """
+    Prints every metric of both runs with its relative change and returns
+    the metrics that got worse by more than threshold.
+    """
+    old_flat = _flatten({k: v for k, v in old.items() if k != "meta"})
+    new_flat = _flatten({k: v for k, v in new.items() if k != "meta"})
+    regressions = []
+    for key in sorted(old_flat.keys() & new_flat.keys()):
+        before, after = old_flat[key], new_flat[key]
+        if key.endswith(LOWER_IS_BETTER):
+            worse = after - before
+        elif key.endswith(HIGHER_IS_BETTER):
+            worse = before - after
+        else:
+            continue
+        if not before:
+            continue
+        change = (after - before) / abs(before)
+        flag = ""
+        if key.endswith("_ms") and worse < COMPARE_MIN_MS:
+            worse = 0.0
+        if worse / abs(before) > threshold:
+            flag = "  REGRESSION"
+            regressions.append(key)
+        print(f"{key:<60} {before:>12.3f} -> {after:>12.3f} {change:+7.1%}{flag}")
+    return regressions
+
+
+def print_report(result: dict, k: int):
+    ingest = result["ingest"]
+    print(
+        f"\nIngest: {ingest['rows']} rows in {ingest['seconds']:.1f}s "
+        f"({ingest['rows_per_second']:.0f} rows/s), local index "
+        f"{ingest['local_index_seconds']:.1f}s"
+    )
+    for backend, summary in result["retrieval"].items():
+        print(
+            f"Retrieval {backend:<9} hit@{k} {summary['hit_rate']:.2f}  "
+            f"P@{k} {summary['precision']:.2f}  MRR {summary['mrr']:.2f}  "
+            f"p50 {summary.get('p50_ms', summary['mean_ms']):.2f}ms  "
+            f"p99 {summary.get('p99_ms', summary['mean_ms']):.2f}ms"
+        )
+    ann = result["ann"] or {}
+    if ann:
+        print(f"ANN index {ann['index_bytes'] / 2**20:.1f} MiB")
+    for row in ann.get("results", []):
+        label = " ".join(
+            f"{name}={row[name]}" for name in ANN_PARAMETERS if name in row
+        )
+        print(
+            f"ANN {label:<28} recall@{k} {row['recall']:.3f}  mean {row['mean_ms']:.2f}ms"
+        )
+    for bound, bucket in result["chains"].items():
+        print(
+            f"get_chain threads of {bound:>4}+ messages (mean {bucket['mean_thread_size']:.0f}, "
+            f"depth {bucket['max_depth']}): thread_id {bucket['thread_id']['mean_ms']:.2f}ms  "
+            f"walk {bucket['walk']['mean_ms']:.2f}ms"
+        )
+    e2e = result["end_to_end"]
+    print(
+        f"End to end: {e2e['count']} questions, p50 {e2e.get('p50_ms', 0):.1f}ms  "
+        f"p99 {e2e.get('p99_ms', 0):.1f}ms"
+    )
+    for stage, summary in sorted(e2e["stages"].items()):
+        print(f"  {stage:<14} mean {summary['mean_ms']:.2f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline RAG benchmark")
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--export", help="use this export instead of generating one")
+    parser.add_argument("--labels", help="labels file of --export")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--rounds", type=int, default=3, help="timing repetitions")
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        choices=list(retrieval_benchmark.RETRIEVERS),
+        default=["pgvector", "hybrid", "local"],
+    )
+    parser.add_argument("--ann-queries", type=int, default=100)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[10, 40, 160])
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument(
+        "--rerank",
+        type=int,
+        nargs="+",
+        default=[1, 4, 10],
+        help="rerank factors measured when EMBEDDING_STORAGE is compact",
+    )
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--output", help="result file (default: data/benchmarks/)")
+    parser.add_argument("--compare", help="earlier result file to compare with")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative change that counts as a regression",
+    )
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    if args.export and not args.labels:
+        parser.error("--export needs --labels")
+
+    result = run(args)
+    print_report(result, args.k)
+
+    output = args.output
+    if not output:
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        output = os.path.join(BENCHMARK_DIR, f"offline-{args.messages}-{stamp}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=4, default=str)
+    print(f"Results written to {output}.")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+        print(f"\nCompared with {args.compare} ({previous['meta'].get('commit')}):")
+        regressions = compare(previous, result, args.threshold)
+        if regressions:
+            print(
+                f"{len(regressions)} metrics regressed by more than {args.threshold:.0%}."
+            )
+            sys.exit(1)
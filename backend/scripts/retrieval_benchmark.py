@@ -0,0 +1,133 @@
+"""
+Retrieval quality and latency per retriever backend on a labelled query set.
+
+A labelled set is a JSON list of
+
+    {"query": "ILSE cuota", "relevant_contains": ["ILSE"], "relevant_ids": [123]}
+
+where a retrieved item counts as relevant when its id is in relevant_ids,
+its content contains one of relevant_contains, or it contains every term of
+relevant_contains_all (both case-insensitive). Reported
+per backend: hit rate@k, precision@k, MRR and search latency (the query
+embedding is computed once beforehand, so only retrieval is timed).
+
+    python scripts/retrieval_benchmark.py --labels data/labelled_queries.json --k 5
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.append(project_root)
+
+from backend.databases.pool import close_async_pool, open_async_pool
+from backend.services.google_vectorise import RETRIEVERS
+from backend.services.ollama_service import get_query_embedding
+
+DEFAULT_LABELS = [
+    {"query": "ILSE", "relevant_contains": ["ILSE"]},
+    {"query": "ILSE cuota", "relevant_contains": ["ILSE"]},
+    {"query": "Northlands", "relevant_contains": ["Northlands"]},
+    {"query": "St. George's College", "relevant_contains": ["St. George", "St George"]},
+    {"query": "Lincoln school fees", "relevant_contains": ["Lincoln"]},
+    {"query": "technical schools", "relevant_contains": ["técnic", "technical"]},
+]
+
+
+def _is_relevant(item: dict, label: dict) -> bool:
+    if item["id"] in label.get("relevant_ids", []):
+        return True
+    content = (item.get("content") or "").lower()
+    if any(term.lower() in content for term in label.get("relevant_contains", [])):
+        return True
+    terms = label.get("relevant_contains_all")
+    return bool(terms) and all(term.lower() in content for term in terms)
+
+
+async def run_benchmark(labels: list[dict], k: int, backends: list[str], rounds: int):
+    """
+    Returns {backend: summary}. Each backend sees the same embeddings.
+    """
+    embeddings = [await get_query_embedding(label["query"]) for label in labels]
+
+    results = {}
+    for backend in backends:
+        retriever = RETRIEVERS[backend]
+        latencies = []
+        hits = 0
+        precision = []
+        reciprocal_ranks = []
+        for round_index in range(rounds):
+            for label, embedding in zip(labels, embeddings):
+                start = time.perf_counter()
+                items = await retriever(embedding, k, query_text=label["query"])
+                latencies.append(time.perf_counter() - start)
+                if round_index:
+                    continue
+                relevant = [_is_relevant(item, label) for item in items]
+                hits += any(relevant)
+                precision.append(sum(relevant) / k)
+                first = next((i for i, r in enumerate(relevant) if r), None)
+                reciprocal_ranks.append(0.0 if first is None else 1.0 / (first + 1))
+
+        summary = {
+            "queries": len(labels),
+            "hit_rate": hits / len(labels),
+            "precision": statistics.mean(precision),
+            "mrr": statistics.mean(reciprocal_ranks),
+            "mean_ms": statistics.mean(latencies) * 1000,
+        }
+        if len(latencies) >= 2:
+            percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+            summary["p50_ms"] = percentiles[49] * 1000
+            summary["p99_ms"] = percentiles[98] * 1000
+        results[backend] = summary
+    return results
+
+
+async def main(args):
+    labels = DEFAULT_LABELS
+    if args.labels:
+        with open(args.labels, encoding="utf-8") as f:
+            labels = json.load(f)
+    await open_async_pool()
+    try:
+        return await run_benchmark(labels, args.k, args.backends, args.rounds)
+    finally:
+        await close_async_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Retrieval quality per backend")
+    parser.add_argument("--labels", help="labelled query set (JSON)")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--rounds", type=int, default=5, help="timing repetitions")
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        choices=list(RETRIEVERS),
+        default=["pgvector", "hybrid"],
+    )
+    parser.add_argument("--output", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    result = asyncio.run(main(args))
+
+    for backend, summary in result.items():
+        line = (
+            f"{backend:<9} hit@{args.k} {summary['hit_rate']:.2f}  "
+            f"P@{args.k} {summary['precision']:.2f}  MRR {summary['mrr']:.2f}  "
+            f"mean {summary['mean_ms']:.2f}ms"
+        )
+        if "p50_ms" in summary:
+            line += f"  p50 {summary['p50_ms']:.2f}ms  p99 {summary['p99_ms']:.2f}ms"
+        print(line)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=4)
@@ -0,0 +1,306 @@
+"""
+Generates a synthetic Telegram chat export with realistic reply trees, plus
+a labels file for the benchmarks.
+
+Messages are written one at a time, so 10M messages need no more memory
+than 10k. Threads have heavy-tailed sizes (Pareto): most are one or two
+messages, a few run to hundreds. A reply either continues the latest
+message of its thread (a deep chain) or answers an earlier one (a fork).
+Each thread is about a (school, subject) topic picked with Zipf weights;
+topic messages name both, everything else is filler that names neither.
+
+The labels file holds
+  - "queries": "<school> <subject>" queries for retrieval_benchmark, where
+    a hit must contain both words (relevant_contains_all)
+  - "chains": sampled message ids per thread-size bucket for get_chain
+
+    python scripts/synthetic_export.py 100000 --output data/synthetic.json
+"""
+
+import argparse
+import json
+import os
+import random
+from datetime import datetime, timedelta
+
+SCHOOLS = [
+    "ILSE",
+    "Northlands",
+    "Lincoln",
+    "Belgrano Day",
+    "Holy Cross",
+    "Saint Andrew",
+    "Washington",
+    "Pestalozzi",
+    "Goethe",
+    "Michael Ham",
+    "Nightingale",
+    "San Patricio",
+    "Cardenal Newman",
+    "Quilmes High",
+    "Bayard",
+    "Lasalle",
+]
+SUBJECTS = [
+    "cuota",
+    "uniforme",
+    "transporte",
+    "inscripción",
+    "vacantes",
+    "matrícula",
+    "idiomas",
+    "deportes",
+    "comedor",
+    "horarios",
+    "becas",
+    "examen",
+]
+FILLER = (
+    "hola gracias alguien sabe donde como cuando porque tenemos hijos hija "
+    "hijo año grado primaria secundaria jardín barrio zona precio nivel "
+    "bueno buena muy mucho poco caro barato recomiendo experiencia familia "
+    "chicos maestros clase clases español inglés ruso casa mudanza trabajo "
+    "pregunta respuesta gracias saludos buenas tardes noches mañana semana "
+    "mes también pero nosotros ellos tienen hay está están puede pueden "
+    "pasó dijeron escribir llamar visitar entrevista papeles documentos "
+    "dni visa residencia consulado ciudad provincia capital norte sur"
+).split()
+AUTHORS = [f"User {i}" for i in range(1, 401)]
+
+CHAIN_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+CHAIN_SAMPLES_PER_BUCKET = 20
+# Message ids kept per active thread to pick fork targets from
+FORK_CANDIDATES = 32
+
+
+def _bucket(size: int) -> int:
+    return max(bound for bound in CHAIN_BUCKETS if bound <= size)
+
+
+class _Generator:
+    """
+    Thread model state. Only active threads are kept; a thread retires
+    when it reaches its drawn size.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.topics = [(school, subject) for school in SCHOOLS for subject in SUBJECTS]
+        self.rng.shuffle(self.topics)
+        self.topic_weights = [
+            1.0 / (rank + 1) ** args.zipf for rank in range(len(self.topics))
+        ]
+        self.topic_mentions = [0] * len(self.topics)
+        self.active = []
+        self.chains = {bound: [] for bound in CHAIN_BUCKETS}
+        self.chains_seen = {bound: 0 for bound in CHAIN_BUCKETS}
+        self.threads = 0
+        self.date = datetime(2021, 1, 1, 9, 0, 0)
+
+    def _words(self, count: int) -> list[str]:
+        return self.rng.choices(FILLER, k=count)
+
+    def _text(self, topic: int, on_topic: bool) -> str:
+        words = self._words(self.rng.randint(4, 18))
+        if on_topic:
+            school, subject = self.topics[topic]
+            words.insert(self.rng.randrange(len(words) + 1), school)
+            words.insert(self.rng.randrange(len(words) + 1), subject)
+            self.topic_mentions[topic] += 1
+        return " ".join(words)
+
+    def _retire(self, thread: dict):
+        bucket = _bucket(thread["size"])
+        self.chains_seen[bucket] += 1
+        sample = {
+            "message_id": thread["deepest"],
+            "thread_size": thread["size"],
+            "depth": thread["max_depth"],
+        }
+        # Reservoir sampling keeps every bucket uniform over all threads
+        samples = self.chains[bucket]
+        if len(samples) < CHAIN_SAMPLES_PER_BUCKET:
+            samples.append(sample)
+        else:
+            index = self.rng.randrange(self.chains_seen[bucket])
+            if index < CHAIN_SAMPLES_PER_BUCKET:
+                samples[index] = sample
+
+    def _new_thread(self, message_id: int) -> dict:
+        self.threads += 1
+        size = int(self.rng.paretovariate(self.args.thread_alpha))
+        thread = {
+            "topic": self.rng.choices(
+                range(len(self.topics)), weights=self.topic_weights
+            )[0],
+            "target": min(size, self.args.max_thread_size),
+            "size": 1,
+            "last": message_id,
+            "depths": {message_id: 0},
+            "deepest": message_id,
+            "max_depth": 0,
+        }
+        return thread
+
+    def message(self, message_id: int) -> dict:
+        rng = self.rng
+        self.date += timedelta(seconds=rng.expovariate(1 / 90))
+        reply_to = None
+        if self.active and (
+            len(self.active) >= self.args.active_threads
+            or rng.random() > self.args.new_thread_rate
+        ):
+            thread = rng.choice(self.active)
+            if rng.random() < self.args.deepen_rate:
+                reply_to = thread["last"]
+            else:
+                reply_to = rng.choice(list(thread["depths"]))
+            depth = thread["depths"][reply_to] + 1
+            thread["size"] += 1
+            thread["last"] = message_id
+            if len(thread["depths"]) >= FORK_CANDIDATES:
+                # Forget a random earlier message, never the latest one
+                del thread["depths"][rng.choice(list(thread["depths"]))]
+            thread["depths"][message_id] = depth
+            if depth > thread["max_depth"]:
+                thread["max_depth"] = depth
+                thread["deepest"] = message_id
+            on_topic = rng.random() < self.args.on_topic_rate
+        else:
+            thread = self._new_thread(message_id)
+            self.active.append(thread)
+            on_topic = True
+
+        if thread["size"] >= thread["target"]:
+            self.active.remove(thread)
+            self._retire(thread)
+
+        message = {
+            "id": message_id,
+            "type": "message",
+            "date": self.date.isoformat(timespec="seconds"),
+            "from": rng.choice(AUTHORS),
+            "text": self._text(thread["topic"], on_topic),
+        }
+        if reply_to is not None:
+            message["reply_to_message_id"] = reply_to
+        return message
+
+    def finish(self):
+        for thread in self.active:
+            self._retire(thread)
+        self.active = []
+
+    def labels(self, query_count: int) -> dict:
+        mentioned = sorted(
+            (index for index, count in enumerate(self.topic_mentions) if count),
+            key=lambda index: -self.topic_mentions[index],
+        )
+        # Spread the queries from the most to the least discussed topics
+        step = max(1, len(mentioned) // max(1, query_count))
+        queries = []
+        for index in mentioned[::step][:query_count]:
+            school, subject = self.topics[index]
+            queries.append(
+                {
+                    "query": f"{school} {subject}",
+                    "relevant_contains_all": [school, subject],
+                    "mentions": self.topic_mentions[index],
+                }
+            )
+        chains = [
+            {"bucket": bound, **sample}
+            for bound in CHAIN_BUCKETS
+            for sample in self.chains[bound]
+        ]
+        return {"queries": queries, "chains": chains}
+
+
+def sample_texts(count: int, seed: int = 0) -> list[str]:
+    """
+    Message texts as the export would contain them, without writing one.
+    """
+    generator = _Generator(parse_args([str(count), "--seed", str(seed)]))
+    return [generator.message(message_id)["text"] for message_id in range(1, count + 1)]
+
+
+def generate_export(
+    output: str, messages: int, labels_path: str = None, **options
+) -> dict:
+    """
+    Writes the export and, when labels_path is set, the labels file.
+    Returns the labels. Options are the command line flags.
+    """
+    defaults = vars(parse_args([str(messages)]))
+    args = argparse.Namespace(**{**defaults, **options, "messages": messages})
+    generator = _Generator(args)
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        header = {"name": args.title, "type": "public_supergroup", "id": args.seed}
+        f.write(json.dumps(header, ensure_ascii=False)[:-1] + ', "messages": [\n')
+        for message_id in range(1, messages + 1):
+            if message_id > 1:
+                f.write(",\n")
+            f.write(json.dumps(generator.message(message_id), ensure_ascii=False))
+        f.write("\n]}\n")
+    generator.finish()
+
+    labels = generator.labels(args.queries)
+    labels["meta"] = {
+        "messages": messages,
+        "threads": generator.threads,
+        "title": args.title,
+        "seed": args.seed,
+    }
+    if labels_path:
+        with open(labels_path, "w", encoding="utf-8") as f:
+            json.dump(labels, f, indent=4, ensure_ascii=False)
+    return labels
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Synthetic Telegram export")
+    parser.add_argument("messages", type=int, help="number of messages")
+    parser.add_argument("--output", default="data/synthetic.json")
+    parser.add_argument("--labels", help="labels file (default: <output>.labels.json)")
+    parser.add_argument("--title", default="Synthetic chat")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument(
+        "--thread-alpha",
+        type=float,
+        default=1.1,
+        help="Pareto shape of thread sizes; smaller means longer threads",
+    )
+    parser.add_argument("--max-thread-size", type=int, default=2000)
+    parser.add_argument("--active-threads", type=int, default=40)
+    parser.add_argument("--new-thread-rate", type=float, default=0.3)
+    parser.add_argument(
+        "--deepen-rate",
+        type=float,
+        default=0.7,
+        help="share of replies to the latest message of the thread",
+    )
+    parser.add_argument("--on-topic-rate", type=float, default=0.4)
+    parser.add_argument("--zipf", type=float, default=1.0)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    labels_path = args.labels or os.path.splitext(args.output)[0] + ".labels.json"
+    options = {
+        key: value
+        for key, value in vars(args).items()
+        if key not in ("messages", "output", "labels")
+    }
+    labels = generate_export(
+        args.output, args.messages, labels_path=labels_path, **options
+    )
+    print(
+        f"Wrote {labels['meta']['messages']} messages in "
+        f"{labels['meta']['threads']} threads to {args.output}, "
+        f"{len(labels['queries'])} queries and {len(labels['chains'])} chain "
+        f"samples to {labels_path}."
+    )
@@ -0,0 +1,137 @@
+import json
+from contextlib import contextmanager
+
+_WHITESPACE = " \t\n\r"
+_NUMBER_CHARS = "0123456789+-.eE"
+
+
+class _ExportStream:
+    """
+    Incremental reader for a Telegram chat export
+    ({"name": ..., ..., "messages": [...]}).
+
+    Only the current message and one read chunk are held in memory, so RSS
+    stays flat no matter how large the export is.
+    """
+
+    def __init__(self, f, chunk_size: int):
+        self._file = f
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+        self._messages_pending = False
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        chunk = self._file.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        # Drop the consumed prefix so the buffer does not grow with the file
+        self._buffer = self._buffer[self._pos :] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        while True:
+            while self._pos < len(self._buffer):
+                if self._buffer[self._pos] not in _WHITESPACE:
+                    return self._buffer[self._pos]
+                self._pos += 1
+            if not self._fill():
+                return ""
+
+    def _expect(self, chars: str) -> str:
+        char = self._peek()
+        if not char or char not in chars:
+            raise json.JSONDecodeError(
+                f"Expected one of {chars!r}", self._buffer, self._pos
+            )
+        self._pos += 1
+        return char
+
+    def _buffer_whole_number(self):
+        # raw_decode happily parses "1." as 1, so make sure a number is not
+        # cut by the chunk boundary before decoding it
+        end = self._pos
+        while True:
+            while end < len(self._buffer) and self._buffer[end] in _NUMBER_CHARS:
+                end += 1
+            if end < len(self._buffer):
+                return
+            offset = end - self._pos
+            if not self._fill():
+                return
+            end = self._pos + offset
+
+    def _decode_value(self):
+        if self._peek() in _NUMBER_CHARS:
+            self._buffer_whole_number()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                # Most likely the value continues in the next chunk
+                if self._fill():
+                    continue
+                raise
+            self._pos = end
+            return value
+
+    def read_header(self) -> dict:
+        """
+        Reads the top-level fields that precede "messages" and stops at the
+        start of the messages array.
+        """
+        header = {}
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+            self._messages_pending = False
+            return header
+        while True:
+            key = self._decode_value()
+            self._expect(":")
+            if key == "messages":
+                if self._peek() != "[":
+                    raise ValueError("'messages' must be a list of messages.")
+                self._messages_pending = True
+                return header
+            header[key] = self._decode_value()
+            if self._expect(",}") == "}":
+                self._messages_pending = False
+                return header
+
+    def iter_messages(self):
+        if not self._messages_pending:
+            return
+        self._expect("[")
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield self._decode_value()
+            if self._expect(",]") == "]":
+                return
+
+
+@contextmanager
+def open_export(json_file_path: str, chunk_size: int = 1 << 16):
+    """
+    Opens a Telegram export for streaming.
+
+    Yields (header, messages) where header holds the chat fields such as
+    "name" and "id", and messages is an iterator over the "messages" items.
+    Raises json.JSONDecodeError on malformed input.
+    """
+    with open(json_file_path, "r", encoding="utf-8") as f:
+        stream = _ExportStream(f, chunk_size)
+        header = stream.read_header()
+        yield header, stream.iter_messages()
+
+
+def get_chat_title(header: dict) -> str:
+    return header.get("name", header.get("title", "Unknown Chat"))
@@ -0,0 +1,120 @@
+"""
+Compares the validation modes of the request path.
+
+For every query each mode is timed from the start of the request until the
+query is accepted (or rejected) and its context is retrieved:
+
+    serial       Gemini validation, then retrieval
+    speculative  Gemini validation and retrieval in parallel
+    local        topic-centroid distance, then retrieval
+
+It also reports how often each mode agrees with the expected label, which is
+what RELEVANCE_MAX_DISTANCE should be tuned against.
+
+    python scripts/validation_benchmark.py --rounds 3
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.append(project_root)
+
+from backend.databases.pool import close_async_pool, open_async_pool
+from backend.services.google_service import check_query, retrieve_context
+from backend.services.relevance_gate import topic_distance
+
+MODES = ["serial", "speculative", "local"]
+
+# (query, on topic)
+DEFAULT_QUERIES = [
+    ("Need information on technical schools?", True),
+    ("ILSE cuota", True),
+    ("Bilingual primary schools in Belgrano", True),
+    ("How does the secondary school admission work in Buenos Aires?", True),
+    ("Which schools offer the International Baccalaureate?", True),
+    ("What is the weather in Madrid tomorrow?", False),
+    ("Recipe for a chocolate cake", False),
+    ("Best smartphone under 300 dollars", False),
+]
+
+
+async def _time_request(query: str, mode: str, top_k: int) -> tuple[bool, float]:
+    start = time.perf_counter()
+    valid, context = await check_query(query, top_k, mode=mode)
+    if valid and context is None:
+        await retrieve_context(query, top_k)
+    return valid, time.perf_counter() - start
+
+
+async def run_benchmark(
+    queries: list[tuple[str, bool]], rounds: int, top_k: int, modes: list[str]
+) -> dict:
+    """
+    Returns {mode: summary} with latency percentiles in seconds and the share
+    of queries whose decision matched the label.
+    """
+    # Warm the query embedding cache so every mode sees the same embedding cost
+    for query, _ in queries:
+        await retrieve_context(query, top_k)
+
+    results = {}
+    for mode in modes:
+        latencies = []
+        correct = 0
+        for _ in range(rounds):
+            for query, expected in queries:
+                valid, elapsed = await _time_request(query, mode, top_k)
+                latencies.append(elapsed)
+                correct += valid == expected
+        summary = {
+            "requests": len(latencies),
+            "mean": statistics.mean(latencies),
+            "accuracy": correct / len(latencies),
+        }
+        if len(latencies) >= 2:
+            percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+            summary["p50"] = percentiles[49]
+            summary["p99"] = percentiles[98]
+        results[mode] = summary
+
+    results["distances"] = {query: await topic_distance(query) for query, _ in queries}
+    return results
+
+
+async def main(args):
+    await open_async_pool()
+    try:
+        return await run_benchmark(DEFAULT_QUERIES, args.rounds, args.top_k, args.modes)
+    finally:
+        await close_async_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the validation modes")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    args = parser.parse_args()
+
+    result = asyncio.run(main(args))
+
+    for mode in args.modes:
+        summary = result[mode]
+        line = f"{mode:<12} mean {summary['mean']:.3f}s"
+        if "p50" in summary:
+            line += f"  p50 {summary['p50']:.3f}s  p99 {summary['p99']:.3f}s"
+        line += f"  accuracy {summary['accuracy']:.0%}"
+        print(line)
+
+    print("\nTopic distance per query:")
+    for (query, expected), distance in zip(
+        DEFAULT_QUERIES, result["distances"].values()
+    ):
+        label = "on topic " if expected else "off topic"
+        shown = f"{distance:.4f}" if distance is not None else "n/a"
+        print(f"  {label} {shown}  {query}")
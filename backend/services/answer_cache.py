@@ -0,0 +1,166 @@
+import os
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from backend.databases.pool import async_connection
+from backend.services import ollama_service
+
+load_dotenv()
+
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+# Cosine distance under which a cached question counts as the same question
+ANSWER_CACHE_MAX_DISTANCE = float(os.getenv("ANSWER_CACHE_MAX_DISTANCE", "0.05"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+
+# The table lives in Postgres so every API worker shares it and the
+# ingestion script can invalidate entries from its own process.
+_CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS answer_cache (
+        id BIGSERIAL PRIMARY KEY,
+        embedding_model TEXT NOT NULL,
+        query TEXT NOT NULL,
+        embedding vector NOT NULL,
+        answer TEXT NOT NULL,
+        titles TEXT[] NOT NULL,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    CREATE INDEX IF NOT EXISTS answer_cache_titles_idx ON answer_cache USING GIN (titles);
+"""
+
+_table_ready = False
+_stats = {"hits": 0, "misses": 0, "stores": 0, "errors": 0}
+
+
+async def _ensure_table(cur):
+    global _table_ready
+    if not _table_ready:
+        await cur.execute(_CREATE_TABLE)
+        _table_ready = True
+
+
+async def lookup_answer(user_query: str, filters: dict = None) -> str | None:
+    """
+    Returns a stored answer for a semantically equivalent question that is
+    younger than the TTL, or None. Questions scoped with retrieval filters
+    are not cached: the same words can need a different answer per scope.
+    """
+    if not ANSWER_CACHE_ENABLED or filters:
+        return None
+    try:
+        query_embedding = await ollama_service.get_query_embedding(user_query)
+        async with async_connection() as conn:
+            async with conn.cursor() as cur:
+                await _ensure_table(cur)
+                await cur.execute(
+                    """
+                    SELECT answer, embedding <=> %s::vector AS distance
+                    FROM answer_cache
+                    WHERE embedding_model = %s
+                      AND created_at > now() - make_interval(secs => %s)
+                    ORDER BY distance ASC
+                    LIMIT 1;
+                    """,
+                    (
+                        query_embedding,
+                        ollama_service.model,
+                        ANSWER_CACHE_TTL_SECONDS,
+                    ),
+                )
+                row = await cur.fetchone()
+    except Exception as e:
+        _stats["errors"] += 1
+        print(f"Answer cache lookup failed: {e}")
+        return None
+
+    if row is not None and row[1] <= ANSWER_CACHE_MAX_DISTANCE:
+        _stats["hits"] += 1
+        print(f"Answer cache hit (distance {row[1]:.4f}) for: '{user_query}'")
+        return row[0]
+    _stats["misses"] += 1
+    return None
+
+
+async def store_answer(
+    user_query: str,
+    answer: str,
+    titles: list[str],
+    filters: dict = None,
+    created_at: datetime = None,
+):
+    """
+    Caches an answer together with the chats its context came from, then
+    drops expired entries and trims the cache to ANSWER_CACHE_MAX_ENTRIES.
+    created_at (default now) is when the answer was generated; the TTL
+    counts from it.
+    """
+    if not ANSWER_CACHE_ENABLED or not titles or filters:
+        return
+    try:
+        query_embedding = await ollama_service.get_query_embedding(user_query)
+        async with async_connection() as conn:
+            async with conn.cursor() as cur:
+                await _ensure_table(cur)
+                await cur.execute(
+                    """
+                    INSERT INTO answer_cache
+                        (embedding_model, query, embedding, answer, titles, created_at)
+                    VALUES (%s, %s, %s::vector, %s, %s, coalesce(%s, now()));
+                    """,
+                    (
+                        ollama_service.model,
+                        user_query,
+                        query_embedding,
+                        answer,
+                        sorted(set(titles)),
+                        created_at,
+                    ),
+                )
+                await cur.execute(
+                    """
+                    DELETE FROM answer_cache
+                    WHERE created_at <= now() - make_interval(secs => %s)
+                       OR id <= (
+                           SELECT id FROM answer_cache
+                           ORDER BY id DESC
+                           OFFSET %s LIMIT 1
+                       );
+                    """,
+                    (ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_MAX_ENTRIES),
+                )
+        _stats["stores"] += 1
+    except Exception as e:
+        _stats["errors"] += 1
+        print(f"Answer cache write failed: {e}")
+
+
+def create_answer_cache_table(cur):
+    """
+    Creates the table on a blocking cursor, for the ingestion script.
+    """
+    cur.execute(_CREATE_TABLE)
+
+
+def invalidate_answers_for_titles(cur, titles: list[str]) -> int:
+    """
+    Drops cached answers built from any of the given chats. Runs on the
+    caller's (blocking) cursor so ingestion can do it in the batch
+    transaction; create_answer_cache_table must have run before. Returns
+    the number of answers removed.
+    """
+    if not titles:
+        return 0
+    cur.execute("DELETE FROM answer_cache WHERE titles && %s;", (list(titles),))
+    return cur.rowcount
+
+
+def get_answer_cache_stats() -> dict:
+    lookups = _stats["hits"] + _stats["misses"]
+    return {
+        **_stats,
+        "enabled": ANSWER_CACHE_ENABLED,
+        "max_distance": ANSWER_CACHE_MAX_DISTANCE,
+        "hit_rate": _stats["hits"] / lookups if lookups else 0.0,
+    }
@@ -1,3 +1,4 @@
+import asyncio
 import os
 from datetime import datetime
 import sys
@@ -5,97 +6,156 @@ import sys
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
 sys.path.append(project_root)
 
-from backend.databases.postgre_db import get_db_connection
+from backend.databases.pool import async_connection
+from backend.services.google_vectorise import to_vector_literal
+from backend.services.tracing import span
 
+# Guards the walk up to the root against reply cycles in broken exports
+MAX_THREAD_DEPTH = int(os.getenv("MAX_THREAD_DEPTH", "1000"))
 
-def get_chain(item):
-    """
-    Reconstructs a conversation thread from a PostgreSQL database. Given a specific message item,
-    it queries the database for other messages sharing the same title and attempts
-    to build a complete chain of related messages by identifying the root message and then collecting
-    all messages belonging to that thread. The function returns a list of these messages, sorted by date,
-    providing a chronological view of the conversation"""
-
-    current_id = item.get("id")
-    current_title = item.get("metadata").get("title")
-    original_message_id = item.get("metadata", {}).get("message_id")
-
-    conn = get_db_connection()
-
-    cur = conn.cursor()
-
-    query = """
-        (SELECT
+_THREAD_COLUMNS_TEMPLATE = """
         id,
         content,
         metadata->>'title' AS title,
         metadata->>'message_id' AS message_id,
         metadata->>'reply_to_message_id' AS reply_to_message_id,
         metadata->>'date' AS date,
-        metadata->>'from' AS author
-        FROM items_3
-        WHERE
-        id < %s AND metadata->>'title' = %s 
-        ORDER BY id DESC
-        LIMIT 1000)
+        metadata->>'from' AS author,
+        embedding <=> {query_vector} AS distance
+"""
+_THREAD_COLUMNS = _THREAD_COLUMNS_TEMPLATE.format(query_vector="%(embedding)s::vector")
+
+# distance is the message's cosine distance to the query when an embedding
+# is passed (NULL otherwise); the context builder ranks messages with it.
+
+# Rows with a precomputed thread_id (see scripts/assign_threads.py): the
+# whole thread is one range scan on (title, thread_id).
+THREAD_BY_ID_QUERY = f"""
+    SELECT {_THREAD_COLUMNS}
+    FROM items_3
+    WHERE metadata->>'title' = %(title)s AND thread_id = %(thread_id)s
+    ORDER BY metadata->>'date' NULLS FIRST, id;
+"""
 
-        UNION ALL
+# Several threads in one round trip: the (title, thread_id) pairs are joined
+# against the same index.
+THREADS_BY_IDS_QUERY = f"""
+    SELECT t.thread_id, {_THREAD_COLUMNS}
+    FROM unnest(%(titles)s::text[], %(thread_ids)s::bigint[]) AS t(title, thread_id)
+    JOIN items_3 i
+      ON i.metadata->>'title' = t.title AND i.thread_id = t.thread_id
+    ORDER BY t.title, t.thread_id, i.metadata->>'date' NULLS FIRST, i.id;
+"""
+
+# The threads of a whole batch of queries in one round trip: every
+# (query, title, thread_id) triple carries its query vector, so the
+# distances are per query even when two queries share a thread.
+THREADS_BY_IDS_BATCH_QUERY = f"""
+    SELECT t.ord, t.thread_id, {_THREAD_COLUMNS_TEMPLATE.format(query_vector="t.query_vector")}
+    FROM unnest(
+        %(ords)s::int[],
+        %(titles)s::text[],
+        %(thread_ids)s::bigint[],
+        %(vectors)s::text[]::vector[]
+    ) AS t(ord, title, thread_id, query_vector)
+    JOIN items_3 i
+      ON i.metadata->>'title' = t.title AND i.thread_id = t.thread_id
+    ORDER BY t.ord, t.title, t.thread_id, i.metadata->>'date' NULLS FIRST, i.id;
+"""
 
-        (SELECT
-            id,
-            content,
-            metadata->>'title' AS title,
+# Fallback for rows ingested before thread_id was assigned.
+# Walks up reply_to_message_id to the thread root, then collects every
+# descendant of that root. Both steps are index lookups on
+# (title, message_id) and (title, reply_to_message_id), so only the thread
+# itself is read, however long the chat or the thread is.
+THREAD_QUERY = f"""
+    WITH RECURSIVE ancestors AS (
+        SELECT
             metadata->>'message_id' AS message_id,
-            metadata->>'reply_to_message_id' AS reply_to_message_id,
-            metadata->>'date' AS date,
-            metadata->>'from' AS author
+            metadata->>'reply_to_message_id' AS parent_id,
+            0 AS depth
         FROM items_3
-        WHERE
-            id >= %s AND metadata->>'title' = %s 
-        ORDER BY id ASC
-        LIMIT 1000)        
+        WHERE metadata->>'title' = %(title)s
+          AND metadata->>'message_id' = %(message_id)s
+      UNION ALL
+        SELECT
+            i.metadata->>'message_id',
+            i.metadata->>'reply_to_message_id',
+            a.depth + 1
+        FROM ancestors a
+        JOIN items_3 i
+          ON i.metadata->>'title' = %(title)s
+         AND i.metadata->>'message_id' = a.parent_id
+        WHERE a.depth < %(max_depth)s
+    ),
+    root AS (
+        SELECT message_id FROM ancestors ORDER BY depth DESC LIMIT 1
+    ),
+    thread AS (
+        SELECT i.id, i.content, i.metadata
+        FROM root
+        JOIN items_3 i
+          ON i.metadata->>'title' = %(title)s
+         AND i.metadata->>'message_id' = root.message_id
+      UNION
+        SELECT c.id, c.content, c.metadata
+        FROM thread t
+        JOIN items_3 c
+          ON c.metadata->>'title' = %(title)s
+         AND c.metadata->>'reply_to_message_id' = t.metadata->>'message_id'
+    )
+    -- Read back from items_3: a recursive UNION cannot carry the
+    -- (unhashable) vector column needed for the distance
+    SELECT {_THREAD_COLUMNS}
+    FROM items_3
+    WHERE id IN (SELECT id FROM thread)
+    ORDER BY metadata->>'date' NULLS FIRST, id;
 """
 
-    cur.execute(query, (current_id, current_title, current_id, current_title))
-    results = cur.fetchall()
-    conn.close()
-
-    messages = []
-    for row in results:
-        msg = {
-            "id": row[0],
-            "content": row[1],
-            "title": row[2],
-            "message_id": int(row[3]),
-            "reply_to_message_id": int(row[4]) if row[4] else None,
-            "date": datetime.fromisoformat(row[5]) if row[5] else None,
-            "author": row[6],
-        }
-        messages.append(msg)
 
-    id_to_msg = {msg["message_id"]: msg for msg in messages}
+async def get_chain(item):
+    """
+    Reconstructs a conversation thread from a PostgreSQL database. Given a specific message item,
+    it collects all messages of its thread: by the precomputed thread_id when the row has one,
+    otherwise with a single recursive query over the reply tree. The function returns a list of these messages,
+    sorted by date, providing a chronological view of the conversation"""
 
-    def find_root(msg_id):
-        current = id_to_msg.get(msg_id)
-        if not current:
-            return msg_id
+    current_title = item.get("metadata").get("title")
+    original_message_id = item.get("metadata", {}).get("message_id")
 
-        while current and current["reply_to_message_id"] is not None:
-            parent_id = current["reply_to_message_id"]
-            if parent_id in id_to_msg:
-                current = id_to_msg[parent_id]
-            else:
-                break
-        return current["message_id"] if current else msg_id
+    thread_id = item.get("thread_id")
+    if thread_id is not None:
+        query = THREAD_BY_ID_QUERY
+        params = {"title": current_title, "thread_id": thread_id, "embedding": None}
+    else:
+        query = THREAD_QUERY
+        params = {
+            "title": current_title,
+            "message_id": str(original_message_id),
+            "max_depth": MAX_THREAD_DEPTH,
+            "embedding": None,
+        }
 
-    root_id = find_root(original_message_id)
+    async with async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, params)
+            results = await cur.fetchall()
 
-    thread = []
-    for msg in messages:
-        if find_root(msg["message_id"]) == root_id:
-            thread.append(msg)
+    thread = [_row_to_message(row) for row in results]
 
-    thread.sort(key=lambda m: m["date"] if m["date"] else datetime.min)
+    if thread_id is not None:
+        root_id = thread_id
+    else:
+        # The root is the only message whose parent is not part of the thread
+        message_ids = {msg["message_id"] for msg in thread}
+        root_id = next(
+            (
+                msg["message_id"]
+                for msg in thread
+                if msg["reply_to_message_id"] not in message_ids
+            ),
+            original_message_id,
+        )
 
     def return_chain_thread(root_id, thread):
         message_chain = [{"root_id": root_id}]
@@ -110,3 +170,236 @@ def get_chain(item):
         return message_chain
 
     return return_chain_thread(root_id, thread)
+
+
+def _row_to_message(row):
+    return {
+        "id": row[0],
+        "content": row[1],
+        "title": row[2],
+        "message_id": int(row[3]),
+        "reply_to_message_id": int(row[4]) if row[4] else None,
+        "date": datetime.fromisoformat(row[5]) if row[5] else None,
+        "author": row[6],
+        "distance": row[7],
+    }
+
+
+async def _fetch_threads_by_id(keys, query_embedding=None):
+    """
+    keys: list of (title, thread_id). Returns {(title, thread_id): [messages]}.
+    """
+    with span("thread_query", method="thread_id", threads=len(keys)) as record:
+        async with async_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    THREADS_BY_IDS_QUERY,
+                    {
+                        "titles": [title for title, _ in keys],
+                        "thread_ids": [thread_id for _, thread_id in keys],
+                        "embedding": query_embedding,
+                    },
+                )
+                results = await cur.fetchall()
+        record["rows"] = len(results)
+
+    threads = {key: [] for key in keys}
+    for row in results:
+        message = _row_to_message(row[1:])
+        threads[(message["title"], row[0])].append(message)
+    return threads
+
+
+async def _fetch_thread_by_walk(item, query_embedding=None):
+    """
+    Recursive-query fallback for a hit without thread_id.
+    Returns (root_id, [messages]).
+    """
+    title = item["metadata"].get("title")
+    message_id = item["metadata"].get("message_id")
+    with span("thread_query", method="walk", threads=1) as record:
+        async with async_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    THREAD_QUERY,
+                    {
+                        "title": title,
+                        "message_id": str(message_id),
+                        "max_depth": MAX_THREAD_DEPTH,
+                        "embedding": query_embedding,
+                    },
+                )
+                results = await cur.fetchall()
+        record["rows"] = len(results)
+    messages = [_row_to_message(row) for row in results]
+    message_ids = {msg["message_id"] for msg in messages}
+    root_id = next(
+        (
+            msg["message_id"]
+            for msg in messages
+            if msg["reply_to_message_id"] not in message_ids
+        ),
+        message_id,
+    )
+    return root_id, messages
+
+
+async def get_threads(items, query_embedding=None):
+    """
+    Fetches the threads behind a list of retrieved items, each thread once.
+    With query_embedding every message also carries its cosine distance to
+    the query.
+
+    Hits that share a conversation are grouped, all threads with a known
+    thread_id come back in a single query, and the result keeps the order
+    of the best-ranked hit of each thread. Every thread is a dict with
+    title, root_id, hit_ids (ids of the retrieved items in it) and the
+    chronologically sorted messages.
+    """
+    with span("threads", hits=len(items)) as record:
+        threads = await _get_threads(items, query_embedding)
+        record["threads"] = len(threads)
+        record["rows"] = sum(len(thread["messages"]) for thread in threads)
+    return threads
+
+
+def _group_hits(items):
+    """
+    Splits hits into threads keyed by (title, thread_id) and the hits
+    without a thread_id, which need the recursive walk.
+    """
+    threads = {}
+    walk_items = []
+    for item in items:
+        title = item["metadata"].get("title")
+        if item.get("thread_id") is None:
+            walk_items.append(item)
+            continue
+        key = (title, item["thread_id"])
+        thread = threads.setdefault(
+            key, {"title": title, "root_id": item["thread_id"], "hit_ids": []}
+        )
+        thread["hit_ids"].append(item["id"])
+    return threads, walk_items
+
+
+async def _get_threads(items, query_embedding=None):
+    threads, walk_items = _group_hits(items)
+
+    fetches = []
+    if threads:
+        fetches.append(_fetch_threads_by_id(list(threads), query_embedding))
+    fetches.extend(_fetch_thread_by_walk(item, query_embedding) for item in walk_items)
+    results = await asyncio.gather(*fetches)
+
+    if threads:
+        for key, messages in results[0].items():
+            threads[key]["messages"] = messages
+        walk_results = results[1:]
+    else:
+        walk_results = results
+    return _merge_threads(items, threads, walk_items, walk_results)
+
+
+def _merge_threads(items, threads, walk_items, walk_results):
+    """
+    Adds the walked threads to the fetched ones and orders them by their
+    best-ranked hit.
+    """
+    for item, (root_id, messages) in zip(walk_items, walk_results):
+        key = (item["metadata"].get("title"), root_id)
+        thread = threads.setdefault(
+            key,
+            {
+                "title": key[0],
+                "root_id": root_id,
+                "hit_ids": [],
+                "messages": messages,
+            },
+        )
+        thread["hit_ids"].append(item["id"])
+
+    rank = {item["id"]: position for position, item in enumerate(items)}
+    return sorted(
+        threads.values(), key=lambda thread: min(rank[i] for i in thread["hit_ids"])
+    )
+
+
+async def _fetch_threads_batch(keys, query_vectors):
+    """
+    keys: list of (query index, title, thread_id). Returns
+    {(query index, title, thread_id): [messages]}.
+    """
+    with span("thread_query", method="thread_id", threads=len(keys)) as record:
+        async with async_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    THREADS_BY_IDS_BATCH_QUERY,
+                    {
+                        "ords": [query_index for query_index, _, _ in keys],
+                        "titles": [title for _, title, _ in keys],
+                        "thread_ids": [thread_id for _, _, thread_id in keys],
+                        "vectors": [
+                            query_vectors[query_index] for query_index, _, _ in keys
+                        ],
+                    },
+                )
+                results = await cur.fetchall()
+        record["rows"] = len(results)
+
+    threads = {key: [] for key in keys}
+    for row in results:
+        message = _row_to_message(row[2:])
+        threads[(row[0], message["title"], row[1])].append(message)
+    return threads
+
+
+async def get_threads_batch(items_per_query, query_embeddings):
+    """
+    get_threads for the hits of many queries: every thread with a known
+    thread_id comes back in one query for the whole batch. Returns one
+    thread list per query, in order.
+    """
+    with span("threads", hits=sum(len(items) for items in items_per_query)) as record:
+        grouped = [_group_hits(items) for items in items_per_query]
+        keys = [
+            (query_index, title, thread_id)
+            for query_index, (threads, _) in enumerate(grouped)
+            for title, thread_id in threads
+        ]
+        walks = [
+            (query_index, item)
+            for query_index, (_, walk_items) in enumerate(grouped)
+            for item in walk_items
+        ]
+
+        fetches = []
+        if keys:
+            query_vectors = [to_vector_literal(e) for e in query_embeddings]
+            fetches.append(_fetch_threads_batch(keys, query_vectors))
+        fetches.extend(
+            _fetch_thread_by_walk(item, query_embeddings[query_index])
+            for query_index, item in walks
+        )
+        results = await asyncio.gather(*fetches)
+        fetched = results[0] if keys else {}
+        walk_results = results[1:] if keys else results
+
+        per_query = []
+        for query_index, (items, (threads, walk_items)) in enumerate(
+            zip(items_per_query, grouped)
+        ):
+            for (title, thread_id), thread in threads.items():
+                thread["messages"] = fetched[(query_index, title, thread_id)]
+            own_walks = [
+                result
+                for (walk_index, _), result in zip(walks, walk_results)
+                if walk_index == query_index
+            ]
+            per_query.append(_merge_threads(items, threads, walk_items, own_walks))
+
+        record["threads"] = sum(len(threads) for threads in per_query)
+        record["rows"] = sum(
+            len(thread["messages"]) for threads in per_query for thread in threads
+        )
+    return per_query
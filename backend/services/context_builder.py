@@ -0,0 +1,311 @@
+import os
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+# Upper bound on the context pasted into the prompt; 0 disables the budget
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+# A single message longer than this is cut, so one paste cannot eat the budget
+MAX_MESSAGE_TOKENS = int(os.getenv("MAX_MESSAGE_TOKENS", "400"))
+
+_SEPARATOR = "\n---\n"
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """
+    Token count with tiktoken's cl100k_base; falls back to the usual
+    ~4 characters per token estimate when the encoding is not available
+    (it is downloaded on first use).
+    """
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoding = _get_encoding()
+    if encoding:
+        tokens = encoding.encode(text, disallowed_special=())
+        return encoding.decode(tokens[:max_tokens]) + " …"
+    return text[: max_tokens * 4] + " …"
+
+
+def _format_date(date) -> str:
+    if isinstance(date, datetime):
+        return date.strftime("%Y-%m-%d %H:%M")
+    return "no date"
+
+
+def _thread_header(thread: dict) -> str:
+    return f"Thread {thread['root_id']} in chat \"{thread['title']}\":"
+
+
+def _message_line(message: dict) -> str:
+    author = message.get("author") or "Unknown"
+    content = " ".join((message.get("content") or "").split())
+    if MAX_MESSAGE_TOKENS:
+        content = truncate_tokens(content, MAX_MESSAGE_TOKENS)
+    return f"[{_format_date(message.get('date'))}] {author}: {content}"
+
+
+def render_thread(thread: dict, keep: set[int] = None) -> str:
+    """
+    Compact plain-text form of a thread: a header line and one line per
+    message with date, author and content. With keep (message positions)
+    only those messages are rendered, in chronological order, and each gap
+    becomes a single "omitted" line.
+    """
+    lines = [_thread_header(thread)]
+    omitted = 0
+    for position, message in enumerate(thread["messages"]):
+        if keep is not None and position not in keep:
+            omitted += 1
+            continue
+        if omitted:
+            lines.append(f"[... {omitted} messages omitted]")
+            omitted = 0
+        lines.append(_message_line(message))
+    if omitted:
+        lines.append(f"[... {omitted} messages omitted]")
+    return "\n".join(lines)
+
+
+# Characters of a thread's legacy text that are tokenized; longer texts are
+# extrapolated from that sample
+LEGACY_SAMPLE_CHARS = 8000
+
+
+def _legacy_chain_text(thread: dict) -> str:
+    # What the old prompt pasted for one hit: str() of the get_chain list
+    chain = [{"root_id": thread["root_id"]}] + [
+        {
+            "author": message.get("author", "Unknown"),
+            "content": message.get("content", "No content"),
+            "date": message.get("date", "No date"),
+        }
+        for message in thread["messages"]
+    ]
+    return str(chain)
+
+
+def _legacy_tokens(threads: list[dict]) -> int:
+    """
+    Tokens the old prompt spent: one str(chain) per retrieved hit. Each
+    thread is rendered once and counted once, from a sample of at most
+    LEGACY_SAMPLE_CHARS characters, so huge threads cost no more than small
+    ones; the number is only reported.
+    """
+    total = 0
+    pieces = 0
+    for thread in threads:
+        hits = len(thread["hit_ids"])
+        if not hits:
+            continue
+        text = _legacy_chain_text(thread)
+        sample = text[:LEGACY_SAMPLE_CHARS]
+        tokens = count_tokens(sample)
+        if len(text) > len(sample):
+            tokens = round(tokens * len(text) / len(sample))
+        total += tokens * hits
+        pieces += hits
+    return total + count_tokens(_SEPARATOR) * max(pieces - 1, 0)
+
+
+def _candidates(threads: list[dict]) -> list[tuple[int, int]]:
+    """
+    Every (thread index, message position), most wanted first: the
+    retrieved messages thread by thread (threads come ordered by their best
+    hit) and in retrieval order within a thread, then the rest by
+    similarity to the query, closest to a hit first when no similarity is
+    known.
+    """
+    hits = []
+    others = []
+    for thread_index, thread in enumerate(threads):
+        hit_rank = {hit_id: rank for rank, hit_id in enumerate(thread["hit_ids"])}
+        hit_positions = [
+            position
+            for position, message in enumerate(thread["messages"])
+            if message["id"] in hit_rank
+        ]
+        hits.extend(
+            (thread_index, position)
+            for position in sorted(
+                hit_positions,
+                key=lambda position: hit_rank[thread["messages"][position]["id"]],
+            )
+        )
+        for position, message in enumerate(thread["messages"]):
+            if message["id"] in hit_rank:
+                continue
+            gap = min(
+                (abs(position - hit) for hit in hit_positions),
+                default=len(thread["messages"]),
+            )
+            distance = message.get("distance")
+            others.append(
+                (
+                    distance if distance is not None else float("inf"),
+                    gap,
+                    thread_index,
+                    position,
+                )
+            )
+    others.sort()
+    return hits + [(thread_index, position) for _, _, thread_index, position in others]
+
+
+def _render(threads: list[dict], keep: dict[int, set[int]]) -> str:
+    return _SEPARATOR.join(
+        render_thread(thread, keep[thread_index])
+        for thread_index, thread in enumerate(threads)
+        if keep.get(thread_index)
+    )
+
+
+_omitted_costs = {}
+
+
+def _omitted_cost(count: int) -> int:
+    if count not in _omitted_costs:
+        _omitted_costs[count] = count_tokens(f"[... {count} messages omitted]") + 1
+    return _omitted_costs[count]
+
+
+def _thread_cost(
+    thread: dict, positions: set[int], header_cost: int, line_costs: dict
+) -> int:
+    """
+    Tokens of render_thread(thread, positions) from the per-line counts,
+    "omitted" lines included; nothing is tokenized again.
+    """
+    cost = header_cost
+    previous = -1
+    for position in sorted(positions):
+        if position - previous > 1:
+            cost += _omitted_cost(position - previous - 1)
+        cost += line_costs[position]
+        previous = position
+    if len(thread["messages"]) - previous > 1:
+        cost += _omitted_cost(len(thread["messages"]) - previous - 1)
+    return cost
+
+
+def select_messages(threads: list[dict], token_budget: int) -> dict[int, set[int]]:
+    """
+    Picks the messages to show per thread ({thread index: positions}) so
+    the rendered context stays within token_budget. Messages are taken in
+    _candidates order while they fit; the first hit is always kept. Every
+    line is tokenized at most once.
+    """
+    keep = {}
+    taken = []
+    used = 0
+    # Tokens per line, newline included
+    header_costs = {}
+    line_costs = {}
+    for thread_index, position in _candidates(threads):
+        thread = threads[thread_index]
+        cost = count_tokens(_message_line(thread["messages"][position])) + 1
+        line_costs.setdefault(thread_index, {})[position] = cost
+        if thread_index not in keep:
+            header_costs[thread_index] = count_tokens(_thread_header(thread)) + 1
+            cost += header_costs[thread_index] + 2
+        if taken and used + cost > token_budget:
+            if token_budget - used < 16:
+                break  # not even a short message fits any more
+            continue
+        keep.setdefault(thread_index, set()).add(position)
+        taken.append((thread_index, position))
+        used += cost
+
+    # The estimate ignores the "omitted" lines; drop the least wanted
+    # messages until the rendering fits, updating only the affected thread.
+    separator_cost = count_tokens(_SEPARATOR)
+    thread_costs = {
+        thread_index: _thread_cost(
+            threads[thread_index],
+            positions,
+            header_costs[thread_index],
+            line_costs[thread_index],
+        )
+        for thread_index, positions in keep.items()
+    }
+    total = sum(thread_costs.values()) + separator_cost * (len(thread_costs) - 1)
+    while len(taken) > 1 and total > token_budget:
+        thread_index, position = taken.pop()
+        keep[thread_index].discard(position)
+        total -= thread_costs.pop(thread_index)
+        if keep[thread_index]:
+            thread_costs[thread_index] = _thread_cost(
+                threads[thread_index],
+                keep[thread_index],
+                header_costs[thread_index],
+                line_costs[thread_index],
+            )
+            total += thread_costs[thread_index]
+        else:
+            total -= separator_cost
+    return keep
+
+
+def build_context(threads: list[dict], token_budget: int = None) -> tuple[str, dict]:
+    """
+    Renders each thread once, in the order given, within token_budget
+    (CONTEXT_TOKEN_BUDGET by default, 0 for no limit). Inside the budget the
+    retrieved messages come first, then their threads' messages ranked by
+    similarity to the query; whatever is kept is shown chronologically.
+    The stats report how the budget was used and how many tokens merging
+    threads saves against pasting one str(chain) per retrieved hit (an
+    estimate for long threads, see _legacy_tokens). CPU bound: async
+    callers run it in a worker thread.
+    """
+    if token_budget is None:
+        token_budget = CONTEXT_TOKEN_BUDGET
+
+    if token_budget:
+        keep = select_messages(threads, token_budget)
+    else:
+        keep = {
+            thread_index: set(range(len(thread["messages"])))
+            for thread_index, thread in enumerate(threads)
+        }
+    context = _render(threads, keep)
+
+    tokens = count_tokens(context)
+    legacy_tokens = _legacy_tokens(threads)
+    messages_total = sum(len(thread["messages"]) for thread in threads)
+    messages_kept = sum(len(positions) for positions in keep.values())
+    stats = {
+        "hits": sum(len(thread["hit_ids"]) for thread in threads),
+        "threads": len(threads),
+        "threads_kept": sum(1 for positions in keep.values() if positions),
+        "messages": messages_total,
+        "messages_kept": messages_kept,
+        "messages_dropped": messages_total - messages_kept,
+        "context_tokens": tokens,
+        "token_budget": token_budget,
+        "budget_used": tokens / token_budget if token_budget else None,
+        "legacy_context_tokens": legacy_tokens,
+        "tokens_saved": legacy_tokens - tokens,
+    }
+    return context, stats
@@ -0,0 +1,276 @@
+import hashlib
+import os
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+from backend.databases.pool import async_connection
+
+load_dotenv()
+
+
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+EMBEDDING_CACHE_PERSIST = os.getenv("EMBEDDING_CACHE_PERSIST", "true").lower() == "true"
+# Upper bound for the Postgres tier; least recently used rows are pruned
+EMBEDDING_CACHE_DB_MAX_ROWS = int(os.getenv("EMBEDDING_CACHE_DB_MAX_ROWS", "200000"))
+_PRUNE_EVERY = 500
+
+
+def normalize_text(text: str) -> str:
+    """
+    Cache key normalisation: case-insensitive and whitespace-insensitive.
+    """
+    return " ".join(text.split()).casefold()
+
+
+def _text_hash(normalized: str) -> str:
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache of query embeddings keyed by (model, normalized text):
+    an in-process LRU in front of the embedding_cache table. The model name
+    is part of every key, so switching models never returns stale vectors.
+    The normalized text is only the key; the original text is what gets
+    embedded, the same way indexed documents are.
+    """
+
+    def __init__(self, max_size: int, persist: bool):
+        self.max_size = max_size
+        self.persist = persist
+        self._entries = OrderedDict()
+        self._table_ready = False
+        self._writes_since_prune = 0
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.db_errors = 0
+
+    def _remember(self, key, embedding):
+        self._entries[key] = embedding
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def _ensure_table(self, cur):
+        if self._table_ready:
+            return
+        await cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                text TEXT NOT NULL,
+                embedding vector NOT NULL,
+                last_used_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                PRIMARY KEY (model, text_hash)
+            );
+            """
+        )
+        await cur.execute(
+            """
+            CREATE INDEX IF NOT EXISTS embedding_cache_last_used_idx
+            ON embedding_cache (last_used_at);
+            """
+        )
+        self._table_ready = True
+
+    async def _load(self, model: str, normalized: str):
+        async with async_connection() as conn:
+            async with conn.cursor() as cur:
+                await self._ensure_table(cur)
+                await cur.execute(
+                    """
+                    UPDATE embedding_cache SET last_used_at = now()
+                    WHERE model = %s AND text_hash = %s
+                    RETURNING embedding::real[];
+                    """,
+                    (model, _text_hash(normalized)),
+                )
+                row = await cur.fetchone()
+        return list(row[0]) if row else None
+
+    async def _store(self, model: str, normalized: str, text: str, embedding):
+        async with async_connection() as conn:
+            async with conn.cursor() as cur:
+                await self._ensure_table(cur)
+                await cur.execute(
+                    """
+                    INSERT INTO embedding_cache (model, text_hash, text, embedding)
+                    VALUES (%s, %s, %s, %s::vector)
+                    ON CONFLICT (model, text_hash) DO UPDATE
+                    SET embedding = EXCLUDED.embedding, last_used_at = now();
+                    """,
+                    (model, _text_hash(normalized), text, embedding),
+                )
+                await self._count_writes(cur, 1)
+
+    async def _count_writes(self, cur, writes: int):
+        self._writes_since_prune += writes
+        if self._writes_since_prune >= _PRUNE_EVERY:
+            self._writes_since_prune = 0
+            await cur.execute(
+                """
+                DELETE FROM embedding_cache
+                WHERE last_used_at < (
+                    SELECT last_used_at FROM embedding_cache
+                    ORDER BY last_used_at DESC
+                    OFFSET %s LIMIT 1
+                );
+                """,
+                (EMBEDDING_CACHE_DB_MAX_ROWS,),
+            )
+
+    async def get_or_compute(self, model: str, text: str, compute):
+        """
+        Returns the cached embedding of text for model, calling
+        `await compute(text)` on a miss. Persistent-tier errors
+        are counted and otherwise ignored so the cache never fails a request.
+        """
+        normalized = normalize_text(text)
+        key = (model, normalized)
+
+        embedding = self._entries.get(key)
+        if embedding is not None:
+            self._entries.move_to_end(key)
+            self.memory_hits += 1
+            return embedding
+
+        if self.persist:
+            try:
+                embedding = await self._load(model, normalized)
+            except Exception as e:
+                self.db_errors += 1
+                print(f"Embedding cache lookup failed: {e}")
+            if embedding is not None:
+                self.db_hits += 1
+                self._remember(key, embedding)
+                return embedding
+
+        self.misses += 1
+        embedding = await compute(text)
+        if not embedding:
+            return embedding
+        self._remember(key, embedding)
+        if self.persist:
+            try:
+                await self._store(model, normalized, text, embedding)
+            except Exception as e:
+                self.db_errors += 1
+                print(f"Embedding cache write failed: {e}")
+        return embedding
+
+    async def _load_many(self, model: str, texts: list[str]) -> dict:
+        async with async_connection() as conn:
+            async with conn.cursor() as cur:
+                await self._ensure_table(cur)
+                await cur.execute(
+                    """
+                    UPDATE embedding_cache SET last_used_at = now()
+                    WHERE model = %s AND text_hash = ANY(%s)
+                    RETURNING text_hash, embedding::real[];
+                    """,
+                    (model, [_text_hash(text) for text in texts]),
+                )
+                rows = await cur.fetchall()
+        by_hash = {text_hash: list(embedding) for text_hash, embedding in rows}
+        return {
+            text: by_hash[_text_hash(text)]
+            for text in texts
+            if _text_hash(text) in by_hash
+        }
+
+    async def _store_many(self, model: str, embeddings: dict, originals: dict):
+        async with async_connection() as conn:
+            async with conn.cursor() as cur:
+                await self._ensure_table(cur)
+                await cur.executemany(
+                    """
+                    INSERT INTO embedding_cache (model, text_hash, text, embedding)
+                    VALUES (%s, %s, %s, %s::vector)
+                    ON CONFLICT (model, text_hash) DO UPDATE
+                    SET embedding = EXCLUDED.embedding, last_used_at = now();
+                    """,
+                    [
+                        (model, _text_hash(text), originals[text], embedding)
+                        for text, embedding in embeddings.items()
+                    ],
+                )
+                await self._count_writes(cur, len(embeddings))
+
+    async def get_or_compute_many(self, model: str, texts: list[str], compute_many):
+        """
+        Batch variant of get_or_compute: one lookup in the persistent tier
+        for every text missing in memory, and a single
+        `await compute_many(original_texts)` for the rest, one text per
+        normalized key. Returns the embeddings in the order of texts.
+        """
+        normalized = [normalize_text(text) for text in texts]
+        # The first spelling of each key is the one embedded
+        originals = {}
+        for key_text, text in zip(normalized, texts):
+            originals.setdefault(key_text, text)
+        found = {}
+        for text in dict.fromkeys(normalized):
+            embedding = self._entries.get((model, text))
+            if embedding is not None:
+                self._entries.move_to_end((model, text))
+                self.memory_hits += 1
+                found[text] = embedding
+
+        missing = [text for text in dict.fromkeys(normalized) if text not in found]
+        if missing and self.persist:
+            try:
+                loaded = await self._load_many(model, missing)
+            except Exception as e:
+                self.db_errors += 1
+                print(f"Embedding cache lookup failed: {e}")
+                loaded = {}
+            self.db_hits += len(loaded)
+            for text, embedding in loaded.items():
+                self._remember((model, text), embedding)
+            found.update(loaded)
+            missing = [text for text in missing if text not in loaded]
+
+        if missing:
+            self.misses += len(missing)
+            computed = dict(
+                zip(missing, await compute_many([originals[text] for text in missing]))
+            )
+            computed = {
+                text: embedding for text, embedding in computed.items() if embedding
+            }
+            for text, embedding in computed.items():
+                self._remember((model, text), embedding)
+            found.update(computed)
+            if self.persist and computed:
+                try:
+                    await self._store_many(model, computed, originals)
+                except Exception as e:
+                    self.db_errors += 1
+                    print(f"Embedding cache write failed: {e}")
+
+        return [found.get(text) for text in normalized]
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.db_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "persist": self.persist,
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "db_errors": self.db_errors,
+            "hit_rate": (self.memory_hits + self.db_hits) / lookups if lookups else 0.0,
+        }
+
+
+query_embedding_cache = EmbeddingCache(EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_PERSIST)
@@ -1,16 +1,26 @@
 from google import genai
 from dotenv import load_dotenv
+import asyncio
 import os
 import sys
 import time
-from datetime import datetime
 
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
 sys.path.append(project_root)
 
-from backend.services.google_vectorise import find_similar_items
-from backend.services.openai_service import get_response
-from backend.services.chaining_service import get_chain
+from backend.services.google_vectorise import (
+    find_similar_items,
+    find_similar_items_batch,
+)
+from backend.services.llm_providers import generate, stream
+from backend.services.chaining_service import get_threads, get_threads_batch
+from backend.services.context_builder import build_context, count_tokens
+from backend.services.answer_cache import lookup_answer, store_answer
+from backend.services.relevance_gate import is_relevant
+from backend.services.ollama_service import get_query_embedding, get_query_embeddings
+from backend.services.tracing import current_trace, span, stage_timings
+from backend.services.interaction_log import log_interaction
+from backend.services import single_flight
 
 
 load_dotenv()
@@ -18,24 +28,51 @@ load_dotenv()
 
 api_key = os.getenv("GOOGLE_API_KEY")
 llm_flag = os.getenv("llm_flag")
+# "serial": Gemini validation, then retrieval (original behaviour)
+# "speculative": Gemini validation and retrieval in parallel
+# "local": no LLM call, embedding distance to the topic centroid
+VALIDATION_MODE = os.getenv("VALIDATION_MODE", "serial")
+# answer_batch: LLM calls in flight, and questions retrieved per batch query
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+BATCH_RETRIEVAL_SIZE = int(os.getenv("BATCH_RETRIEVAL_SIZE", "64"))
 
 client = genai.Client(api_key=api_key)
 
+INVALID_QUERY_MESSAGE = "Invalid input. Please input related question."
 
-def log_llm_interaction(question: str, response: str):
+
+def log_llm_interaction(
+    question: str,
+    answer: str = None,
+    context: dict = None,
+    filters: dict = None,
+    provider: str = None,
+    cached: bool = False,
+    error: str = None,
+):
     """
-    Logs the user's question and the LLM's response to a Markdown file.
+    Queues the question, what was retrieved for it, the answer and the
+    stage timings of the current request for the interaction log.
     """
-    log_file_path = "./data/Schools.md"
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    with open(log_file_path, "a", encoding="utf-8") as f:
-        f.write(f"## Interaction on {timestamp}\n\n")
-        f.write(f"**Question:**\n{question}\n\n")
-        f.write(f"**LLM Response:**\n{response}\n\n")
-        f.write("---\n\n")
+    metadata = (context or {}).get("metadata", {})
+    current = current_trace()
+    log_interaction(
+        {
+            "query": question,
+            "filters": filters,
+            "hits": [hit["id"] for hit in metadata.get("hits", [])],
+            "threads": metadata.get("threads", []),
+            "titles": (context or {}).get("titles", []),
+            "answer": answer,
+            "provider": provider,
+            "cached": cached,
+            "error": error,
+            "timings": stage_timings(current) if current else None,
+        }
+    )
 
 
-def validate_input(user_query: str) -> bool:
+async def validate_input(user_query: str) -> bool:
     prompt = f"""
     Check that the user query is related to schools in Argentina and system of education.
     query can contain only school name e.g. ILSE
@@ -44,7 +81,7 @@ def validate_input(user_query: str) -> bool:
     User query: {user_query}
     """
 
-    response = client.models.generate_content(
+    response = await client.aio.models.generate_content(
         model="gemini-2.0-flash",
         contents=prompt,
     )
@@ -52,38 +89,8 @@ def validate_input(user_query: str) -> bool:
     return response.text.strip().lower() == "true"
 
 
-def get_llm_response_with_context(user_query: str, top_k_context: int = 5) -> str:
-    """
-    Searches for relevant information in the database
-    and uses it to generate an LLM response.
-    """
-    print(f"Searching for context for query: '{user_query}'")
-    # Step 1: Find relevant context
-    retrieved_items = find_similar_items(user_query, top_k=top_k_context)
-    retrieved_items_for_print = []
-    for item in retrieved_items:
-        retrieved_items_for_print.append(item.get("content"))
-
-    context_strings = []
-    if retrieved_items:
-        print(f"Found {len(retrieved_items)} relevant fragments.")
-
-        for item in retrieved_items:
-            context_strings.append(get_chain(item))
-    else:
-        print("Relevant context not found in the database.")
-
-    context_prompt = ""
-    if context_strings:
-        context_prompt = (
-            "\n\nAvailable context:\n"
-            + "\n---\n".join([str(c) for c in context_strings])
-            + "\n---\n"
-        )
-        context_prompt += "Use this context to answer the user's question. If the context does not contain the necessary information, state this."
-
-    # Main system prompt
-    system_instruction = """
+# Main system prompt
+SYSTEM_INSTRUCTION = """
     As the 'Argentine School Directory' assistant, 
     your primary goal is to deliver thorough and complete answers to questions by synthesizing 
     all pertinent information about schools in Argentina and particulary in Buenos Aires 
@@ -96,35 +103,435 @@ def get_llm_response_with_context(user_query: str, top_k_context: int = 5) -> st
     Answer in English.
     """
 
-    full_prompt = f"{system_instruction}\n\nUser question: {user_query}{context_prompt}"
+
+def _build_prompts(user_query: str, retrieved_items: list, threads: list) -> dict:
+    """
+    Builds the context from the fetched threads and the prompts around it.
+    """
+    context_text = ""
+    context_stats = {}
+    if threads:
+        with span("context_build") as build:
+            context_text, context_stats = build_context(threads)
+            build["rows"] = context_stats["messages_kept"]
+            build["context_tokens"] = context_stats["context_tokens"]
+        print(
+            f"Context: {context_stats['threads']} threads for {context_stats['hits']} hits, "
+            f"{context_stats['messages_kept']}/{context_stats['messages']} messages, "
+            f"{context_stats['context_tokens']} of {context_stats['token_budget'] or 'unlimited'} tokens "
+            f"({context_stats['tokens_saved']} saved by merging threads)."
+        )
+
+    context_prompt = ""
+    if context_text:
+        context_prompt = "\n\nAvailable context:\n" + context_text + "\n---\n"
+        context_prompt += "Use this context to answer the user's question. If the context does not contain the necessary information, state this."
+
+    return {
+        "context_prompt": context_prompt,
+        "full_prompt": f"{SYSTEM_INSTRUCTION}\n\nUser question: {user_query}{context_prompt}",
+        "titles": [item["metadata"].get("title") for item in retrieved_items],
+        "metadata": {
+            "hits": [
+                {
+                    "id": item["id"],
+                    "title": item["metadata"].get("title"),
+                    "message_id": item["metadata"].get("message_id"),
+                    "distance": item["distance"],
+                }
+                for item in retrieved_items
+            ],
+            "threads": [
+                {"title": thread["title"], "root_id": thread["root_id"]}
+                for thread in threads
+            ],
+            "context_tokens": context_stats.get("context_tokens", 0),
+            "token_budget": context_stats.get("token_budget"),
+            "messages_kept": context_stats.get("messages_kept", 0),
+            "messages_dropped": context_stats.get("messages_dropped", 0),
+        },
+    }
+
+
+async def retrieve_context(
+    user_query: str, top_k_context: int = 5, filters: dict = None
+) -> dict:
+    """
+    Finds the relevant items and their threads and builds the prompts.
+    Returns a dict with context_prompt, full_prompt, the titles the context
+    came from and retrieval metadata for the client. Concurrent calls for
+    the same query and filters share one retrieval ("retrieval" stage of
+    single_flight); the dict is shared too, so callers must not modify it.
+    """
+    return await single_flight.run(
+        "retrieval",
+        single_flight.query_key(user_query, top_k_context, filters),
+        lambda: _retrieve_context(user_query, top_k_context, filters),
+    )
+
+
+async def _retrieve_context(user_query: str, top_k_context: int, filters: dict) -> dict:
+    with span("retrieval", top_k=top_k_context) as record:
+        print(f"Searching for context for query: '{user_query}'")
+        # Step 1: Find relevant context
+        retrieved_items = await find_similar_items(
+            user_query, top_k=top_k_context, filters=filters
+        )
+        record["rows"] = len(retrieved_items)
+
+        threads = []
+        if retrieved_items:
+            print(f"Found {len(retrieved_items)} relevant fragments.")
+
+            # Hits from the same conversation share one thread, fetched once;
+            # the (cached) query embedding ranks the messages inside each thread
+            query_embedding = await get_query_embedding(user_query)
+            threads = await get_threads(retrieved_items, query_embedding)
+        else:
+            print("Relevant context not found in the database.")
+
+        # Tokenizing the threads is CPU work; keep it off the event loop
+        return await asyncio.to_thread(
+            _build_prompts, user_query, retrieved_items, threads
+        )
+
+
+async def retrieve_contexts(
+    user_queries: list[str], top_k_context: int = 5, filters: dict = None
+) -> list[dict]:
+    """
+    retrieve_context for many queries with one batched embedding call, one
+    multi-query vector search and one thread query for the whole batch.
+    """
+    with span("retrieval", top_k=top_k_context, batch=len(user_queries)) as record:
+        query_embeddings = await get_query_embeddings(user_queries)
+        items_per_query = await find_similar_items_batch(
+            user_queries,
+            top_k=top_k_context,
+            filters=filters,
+            query_embeddings=query_embeddings,
+        )
+        record["rows"] = sum(len(items) for items in items_per_query)
+        threads_per_query = await get_threads_batch(items_per_query, query_embeddings)
+        return await asyncio.to_thread(
+            lambda: [
+                _build_prompts(user_query, items, threads)
+                for user_query, items, threads in zip(
+                    user_queries, items_per_query, threads_per_query
+                )
+            ]
+        )
+
+
+async def check_query(
+    user_query: str, top_k_context: int = 5, mode: str = None, filters: dict = None
+) -> tuple[bool, dict | None]:
+    """
+    Decides whether the query is on topic according to VALIDATION_MODE.
+    Returns (valid, context); context is the retrieval result when the mode
+    already ran it, so callers can pass it on instead of retrieving again.
+    """
+    mode = mode or VALIDATION_MODE
+    if mode == "local":
+        with span("validation", mode=mode) as record:
+            record["valid"] = await is_relevant(user_query)
+        return record["valid"], None
+    if mode != "speculative":
+        with span("validation", mode=mode) as record:
+            record["valid"] = await validate_input(user_query)
+        return record["valid"], None
+
+    retrieval = asyncio.create_task(
+        retrieve_context(user_query, top_k_context, filters)
+    )
+    # A retrieval error is raised by the await below; a cancelled or
+    # abandoned task must not log "exception was never retrieved".
+    retrieval.add_done_callback(lambda task: task.cancelled() or task.exception())
+    try:
+        with span("validation", mode=mode) as record:
+            valid = record["valid"] = await validate_input(user_query)
+    except BaseException:
+        retrieval.cancel()
+        raise
+    if not valid:
+        retrieval.cancel()
+        return False, None
+    return True, await retrieval
+
+
+async def get_llm_response_with_context(
+    user_query: str,
+    top_k_context: int = 5,
+    context: dict = None,
+    filters: dict = None,
+) -> tuple[str, float]:
+    """
+    Searches for relevant information in the database
+    and uses it to generate an LLM response.
+    Returns (answer, process_time); the answer goes through the providers in
+    llm_providers, with their deadlines, retries and failover.
+    """
+    lookup_start = time.time()
+    with span("answer_cache") as record:
+        cached_answer = await lookup_answer(user_query, filters)
+        record["hit"] = cached_answer is not None
+    if cached_answer is not None:
+        log_llm_interaction(user_query, cached_answer, filters=filters, cached=True)
+        return cached_answer, (time.time() - lookup_start)
+
+    if context is None:
+        context = await retrieve_context(user_query, top_k_context, filters)
+    context_titles = context["titles"]
 
     start_time = time.time()
-    if llm_flag == "openai":
-        try:
-            llm_response_text = get_response(user_query, context_prompt)
-            log_llm_interaction(user_query, llm_response_text)
-            return llm_response_text
+    try:
+        with span(
+            "generation", prompt_tokens=count_tokens(context["full_prompt"])
+        ) as record:
+            llm_response_text, provider = await single_flight.run(
+                "generation",
+                single_flight.query_key(user_query, context["full_prompt"]),
+                lambda: generate(user_query, context),
+            )
+            record["provider"] = provider
+            record["completion_tokens"] = count_tokens(llm_response_text)
+    except Exception as e:
+        log_llm_interaction(user_query, context=context, filters=filters, error=str(e))
+        print(f"Error generating LLM response: {e}")
+        return "Sorry, an error occurred while getting the response.", (
+            time.time() - start_time
+        )
 
-        except Exception as e:
-            log_llm_interaction(user_query, f"Error: {e}")
-            print(f"Error generating LLM response: {e}")
-            return "Sorry, an error occurred while getting the response."
-
-    else:
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=full_prompt,
+    end_time = time.time()
+    await store_answer(user_query, llm_response_text, context_titles, filters)
+    log_llm_interaction(user_query, llm_response_text, context, filters, provider)
+    return llm_response_text, (end_time - start_time)
+
+
+async def stream_llm_response_with_context(
+    user_query: str,
+    top_k_context: int = 5,
+    context: dict = None,
+    filters: dict = None,
+):
+    """
+    Streaming variant of get_llm_response_with_context. Yields
+    (event, data) pairs: one "metadata" event once retrieval is done, a
+    "token" event per chunk the provider streams back, and a final "done"
+    event with the whole answer, process_time and per-stage timings.
+    """
+    start_time = time.time()
+    with span("answer_cache") as record:
+        cached_answer = await lookup_answer(user_query, filters)
+        record["hit"] = cached_answer is not None
+    if cached_answer is not None:
+        elapsed = time.time() - start_time
+        log_llm_interaction(user_query, cached_answer, filters=filters, cached=True)
+        yield "metadata", {"cached": True, "hits": [], "threads": []}
+        yield "token", {"text": cached_answer}
+        yield "done", {
+            "message": cached_answer,
+            "process_time": elapsed,
+            "timings": {"retrieval": elapsed, "first_token": elapsed, "total": elapsed},
+        }
+        return
+
+    if context is None:
+        context = await retrieve_context(user_query, top_k_context, filters)
+    retrieval_time = time.time() - start_time
+    yield "metadata", {
+        "cached": False,
+        **context["metadata"],
+        "retrieval_time": retrieval_time,
+    }
+
+    generation_start = time.time()
+    first_token_time = None
+    parts = []
+    provider = None
+    try:
+        with span(
+            "generation", prompt_tokens=count_tokens(context["full_prompt"])
+        ) as record:
+            async for text, provider in single_flight.stream(
+                "generation",
+                single_flight.query_key(user_query, context["full_prompt"]),
+                lambda: stream(user_query, context),
+            ):
+                if first_token_time is None:
+                    first_token_time = time.time() - start_time
+                    record["first_token"] = time.time() - generation_start
+                parts.append(text)
+                yield "token", {"text": text}
+            llm_response_text = "".join(parts)
+            record["provider"] = provider
+            record["completion_tokens"] = count_tokens(llm_response_text)
+    except Exception as e:
+        log_llm_interaction(user_query, context=context, filters=filters, error=str(e))
+        raise
+    end_time = time.time()
+    await store_answer(user_query, llm_response_text, context["titles"], filters)
+    log_llm_interaction(user_query, llm_response_text, context, filters, provider)
+    yield "done", {
+        "message": llm_response_text,
+        "process_time": end_time - generation_start,
+        "timings": {
+            "retrieval": retrieval_time,
+            "first_token": first_token_time or (end_time - start_time),
+            "total": end_time - start_time,
+        },
+    }
+
+
+async def answer_question(
+    user_query: str, top_k_context: int = 5, filters: dict = None
+) -> tuple[str, float | None]:
+    """
+    check_query, then get_llm_response_with_context for a valid question.
+    Concurrent calls with the same normalized question and filters get the
+    result of the one already in flight ("request" stage of single_flight),
+    so a burst of identical questions costs one validation and one LLM call.
+    Returns (answer, process_time); process_time is None for an invalid one.
+    """
+
+    async def answer():
+        valid, context = await check_query(user_query, top_k_context, filters=filters)
+        if not valid:
+            return INVALID_QUERY_MESSAGE, None
+        return await get_llm_response_with_context(
+            user_query, top_k_context, context=context, filters=filters
         )
 
-        end_time = time.time()
-        llm_response_text = response.text
-        # log_llm_interaction(user_query, llm_response_text)  # logging results into md file
-        return llm_response_text, (end_time - start_time)
+    return await single_flight.run(
+        "request",
+        single_flight.query_key(user_query, top_k_context, filters),
+        answer,
+    )
+
+
+async def stream_answer(user_query: str, top_k_context: int = 5, filters: dict = None):
+    """
+    Streaming variant of answer_question: the (event, data) pairs of
+    stream_llm_response_with_context, or a single "done" event with
+    INVALID_QUERY_MESSAGE. A request joining an identical one in flight
+    first gets the events it missed, then the rest as they are produced.
+    """
+
+    async def events():
+        valid, context = await check_query(user_query, top_k_context, filters=filters)
+        if not valid:
+            yield "done", {"message": INVALID_QUERY_MESSAGE, "process_time": None}
+            return
+        async for event, data in stream_llm_response_with_context(
+            user_query, top_k_context, context=context, filters=filters
+        ):
+            yield event, data
+
+    async for event, data in single_flight.stream(
+        "request",
+        single_flight.query_key(user_query, top_k_context, filters),
+        events,
+    ):
+        yield event, data
+
+
+async def answer_batch(
+    user_queries: list[str],
+    top_k_context: int = 5,
+    filters: dict = None,
+    concurrency: int = None,
+    chunk_size: int = None,
+):
+    """
+    Answers many questions. Retrieval runs on chunks of chunk_size questions
+    (retrieve_contexts: one embedding call, one vector query, one thread
+    query per chunk); generation goes through get_llm_response_with_context
+    with at most `concurrency` LLM calls in flight. Questions are not
+    validated, the caller is trusted to send on-topic ones.
+
+    Yields ("result", {"index", "query", "message", "process_time"}) as each
+    answer is ready, in completion order ("error" instead of "message" when
+    it failed), then ("done", summary) with the throughput. An unexpected
+    error while scheduling the questions is raised.
+    """
+    concurrency = concurrency or BATCH_LLM_CONCURRENCY
+    chunk_size = chunk_size or BATCH_RETRIEVAL_SIZE
+    semaphore = asyncio.Semaphore(concurrency)
+    results = asyncio.Queue()
+    tasks = []
+    start_time = time.time()
+
+    async def answer(index: int, user_query: str, context: dict):
+        result = {"index": index, "query": user_query}
+        async with semaphore:
+            try:
+                result["message"], result["process_time"] = (
+                    await get_llm_response_with_context(
+                        user_query, top_k_context, context=context, filters=filters
+                    )
+                )
+            except Exception as e:
+                result["error"] = str(e)
+        await results.put(result)
+
+    async def produce():
+        try:
+            for offset in range(0, len(user_queries), chunk_size):
+                # Retrieve at most one chunk ahead of the answers being generated
+                while sum(not task.done() for task in tasks) >= chunk_size:
+                    await asyncio.wait(
+                        [task for task in tasks if not task.done()],
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+                chunk = user_queries[offset : offset + chunk_size]
+                try:
+                    contexts = await retrieve_contexts(chunk, top_k_context, filters)
+                except Exception as e:
+                    print(f"Batch retrieval failed: {e}")
+                    for index, user_query in enumerate(chunk, offset):
+                        await results.put(
+                            {"index": index, "query": user_query, "error": str(e)}
+                        )
+                    continue
+                for index, (user_query, context) in enumerate(
+                    zip(chunk, contexts), offset
+                ):
+                    tasks.append(
+                        asyncio.create_task(answer(index, user_query, context))
+                    )
+        except Exception as e:
+            # Anything a failed retrieval does not cover ends the batch: the
+            # consumer would otherwise wait forever for the missing results
+            await results.put(e)
+
+    producer = asyncio.create_task(produce())
+    errors = 0
+    try:
+        for _ in range(len(user_queries)):
+            result = await results.get()
+            if isinstance(result, Exception):
+                raise result
+            errors += "error" in result
+            yield "result", result
+    finally:
+        producer.cancel()
+        for task in tasks:
+            task.cancel()
+
+    elapsed = time.time() - start_time
+    yield "done", {
+        "questions": len(user_queries),
+        "errors": errors,
+        "seconds": elapsed,
+        "questions_per_minute": len(user_queries) / elapsed * 60 if elapsed else 0.0,
+    }
 
 
 if __name__ == "__main__":
     rag_query_1 = "Need information on technical schools?"
-    llm_response_1 = get_llm_response_with_context(rag_query_1, top_k_context=3)
+    llm_response_1 = asyncio.run(
+        get_llm_response_with_context(rag_query_1, top_k_context=3)
+    )
     print(f"\nQuestion: {rag_query_1}")
 
     print(f"LLM Response {llm_flag}:\n{llm_response_1}")
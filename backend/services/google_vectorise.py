@@ -1,10 +1,25 @@
 from google import genai
 from dotenv import load_dotenv
-import psycopg2.extras
+from psycopg.types.json import Jsonb
+import asyncio
+import json
 import os
+import re
 
-from backend.databases.postgre_db import get_db_connection
-from backend.services.ollama_service import get_text_embedding
+from backend.databases.pool import async_connection, connection
+from backend.databases.vector_index import (
+    HNSW_EF_SEARCH,
+    SEARCH_SETTINGS_SQL,
+    nearest_sql,
+    search_settings,
+)
+from backend.services.ollama_service import (
+    get_query_embedding,
+    get_query_embeddings,
+    get_text_embedding,
+)
+from backend.services.local_index import search_local_index, search_local_index_batch
+from backend.services.tracing import span
 
 load_dotenv()
 
@@ -15,103 +30,449 @@ client = genai.Client(api_key=api_key)
 
 
 EMBEDDING_MODEL = os.getenv("GEMINI_EMBEDDING_MODEL")
+# "pgvector" (items_3 in Postgres), "hybrid" (pgvector + full-text search)
+# or "local" (services/local_index.py)
+RETRIEVER_BACKEND = os.getenv("RETRIEVER_BACKEND", "pgvector")
+# Hybrid retrieval: candidates taken from each list, and the RRF constant
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+HYBRID_TEXT_WEIGHT = float(os.getenv("HYBRID_TEXT_WEIGHT", "1.0"))
+# Minimum hnsw.ef_search for a filtered search
+FILTERED_EF_SEARCH = int(os.getenv("FILTERED_EF_SEARCH", "200"))
 
 
-def save_embedding_to_db(text: str, embedding: list[float], metadata: dict = None):
+_UPSERT_ON_MESSAGE_KEY = """
+    ON CONFLICT ((metadata->>'title'), (metadata->>'message_id')) DO UPDATE
+    SET content = EXCLUDED.content,
+        embedding = EXCLUDED.embedding,
+        metadata = EXCLUDED.metadata,
+        content_hash = EXCLUDED.content_hash
+"""
+
+
+def save_embedding_to_db(
+    text: str,
+    embedding: list[float],
+    metadata: dict = None,
+    content_hash: str = None,
+):
     """
     Saves text and its embedding to the PostgreSQL database.
+    A message that is already stored for the same chat is updated in place.
     """
-    conn = None
+    jsonb_metadata = Jsonb(metadata) if metadata is not None else None
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        jsonb_metadata = (
-            psycopg2.extras.Json(metadata) if metadata is not None else None
-        )
-        # SQL query for data insertion
-        # psycopg2 automatically converts a Python list to the PostgreSQL vector format
-        # psycopg2.extras.Json is for JSONB, but in this case psycopg2 handles dict on its own
-        cur.execute(
-            "INSERT INTO items_3 (content, embedding, metadata) VALUES (%s, %s, %s) RETURNING id;",
-            (text, embedding, jsonb_metadata),
-        )
-        item_id = cur.fetchone()[0]
-        conn.commit()
-        print(
-            f"Text and embedding for '{text[:30]}...' successfully saved with ID: {item_id}"
-        )
-        return item_id
+        with connection() as conn:
+            with conn.cursor() as cur:
+                # SQL query for data insertion
+                # The embedding list is sent as a float array and cast to vector
+                cur.execute(
+                    "INSERT INTO items_3 (content, embedding, metadata, content_hash) "
+                    "VALUES (%s, %s::vector, %s, %s)"
+                    + _UPSERT_ON_MESSAGE_KEY
+                    + "RETURNING id;",
+                    (text, embedding, jsonb_metadata, content_hash),
+                )
+                item_id = cur.fetchone()[0]
     except Exception as e:
         print(f"Error saving embedding to DB: {e}")
-        if conn:
-            conn.rollback()
         raise
-    finally:
-        if conn:
-            cur.close()
-            conn.close()
+
+    print(
+        f"Text and embedding for '{text[:30]}...' successfully saved with ID: {item_id}"
+    )
+    return item_id
 
 
-def find_similar_items(query_text: str, top_k: int = 5) -> list[dict]:
+def to_vector_literal(embedding: list[float]) -> str:
     """
-    Finds the most similar items in the database based on vector similarity.
+    Formats an embedding in pgvector's text representation, e.g. '[0.1,0.2]'.
     """
-    conn = None
-    try:
-        query_embedding = get_text_embedding(query_text)
-        if not query_embedding:
-            print("Failed to get embedding for the query.")
-            return []
-
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        # Query for cosine similarity search
-        # `<=>` is the cosine distance operator in pgvector.
-        # The smaller the distance, the greater the similarity.
-        # ORDER BY embedding <=> %s ASC - sort by increasing distance (i.e., by decreasing similarity)
-        cur.execute(
-            """
-            SELECT id, content, metadata, embedding <=> %s::vector AS distance
-            FROM items_3
-            ORDER BY distance ASC
-            LIMIT %s;
-            """,
-            (query_embedding, top_k),
-        )
+    return "[" + ",".join(str(float(x)) for x in embedding) + "]"
 
-        results = cur.fetchall()
 
-        # Convert results to a list of dictionaries for convenience
-        similar_items = []
-        for row in results:
-            item_id, content, metadata, distance = row
-            similar_items.append(
-                {
-                    "id": item_id,
-                    "content": content,
-                    "metadata": metadata,
-                    "distance": distance,
-                }
+def copy_embeddings_to_db(cur, rows: list[tuple[str, list[float], dict, str]]) -> int:
+    """
+    Bulk-loads (text, embedding, metadata, content_hash) rows into items_3.
+    Rows are COPY'd into a session-local staging table and then upserted on
+    (title, message_id), so re-ingesting a message replaces it instead of
+    duplicating it. Runs on the caller's cursor so the batch shares its
+    transaction. Returns the number of rows inserted or updated.
+    """
+    cur.execute(
+        """
+        CREATE TEMP TABLE IF NOT EXISTS items_stage (
+            content TEXT,
+            embedding vector,
+            metadata JSONB,
+            content_hash TEXT
+        ) ON COMMIT DELETE ROWS;
+        """
+    )
+    with cur.copy(
+        "COPY items_stage (content, embedding, metadata, content_hash) FROM STDIN"
+    ) as copy:
+        for text, embedding, metadata, content_hash in rows:
+            copy.write_row(
+                (
+                    text,
+                    to_vector_literal(embedding),
+                    json.dumps(metadata, ensure_ascii=False),
+                    content_hash,
+                )
             )
+    # DISTINCT ON keeps one row per message if an export repeats an id
+    cur.execute(
+        """
+        INSERT INTO items_3 (content, embedding, metadata, content_hash)
+        SELECT DISTINCT ON (metadata->>'title', metadata->>'message_id')
+            content, embedding, metadata, content_hash
+        FROM items_stage
+        ORDER BY metadata->>'title', metadata->>'message_id'
+        """
+        + _UPSERT_ON_MESSAGE_KEY
+        + """
+        WHERE items_3.content_hash IS DISTINCT FROM EXCLUDED.content_hash;
+        """
+    )
+    return cur.rowcount
+
+
+# Retrieval filters: {"titles", "date_from", "date_to", "authors"}, each
+# optional, matched against the generated columns of items_3 (see
+# ensure_metadata_columns) so the condition runs inside the vector query.
+_FILTER_CONDITIONS = {
+    "titles": "chat_title = ANY(%(titles)s)",
+    "date_from": "message_date >= %(date_from)s",
+    "date_to": "message_date <= %(date_to)s",
+    "authors": "author = ANY(%(authors)s)",
+}
+
+
+def filter_clause(filters: dict = None) -> tuple[str, dict]:
+    """
+    SQL condition (an AND of fixed fragments, never user text) and its
+    parameters for the filters that are set.
+    """
+    params = {
+        key: value
+        for key, value in (filters or {}).items()
+        if key in _FILTER_CONDITIONS and value not in (None, [])
+    }
+    if not params:
+        return "TRUE", {}
+    return " AND ".join(_FILTER_CONDITIONS[key] for key in params), params
 
-        print(f"Found {len(similar_items)} similar items for query: '{query_text}'")
-        # print(f"Found similar_items: '{similar_items.get('content')}'")
-        for content in similar_items:
-            print(f"Found similar_items: {content.get('content')}")
 
-        return similar_items
+def _filtered_ef_search(ef_search: int, params: dict) -> int:
+    # HNSW filters the ef_search nearest candidates it visited, so a
+    # selective filter needs a wider beam to still return top_k rows
+    if params:
+        return max(ef_search or HNSW_EF_SEARCH, FILTERED_EF_SEARCH)
+    return ef_search
+
+
+_ITEM_COLUMNS = "id, content, metadata, thread_id"
+# {where} is the filter_clause condition
+SEARCH_QUERY = (
+    nearest_sql(_ITEM_COLUMNS, "{where}", "%(embedding)s::vector", "%(top_k)s") + ";"
+)
+
+
+async def search_pgvector(
+    query_embedding,
+    top_k: int,
+    ef_search: int = None,
+    probes: int = None,
+    filters: dict = None,
+    **options,
+) -> list[dict]:
+    """
+    Nearest items by cosine distance in items_3. ef_search / probes tune the
+    HNSW / IVFFlat index for this query only; the configured defaults are
+    used otherwise.
+    """
+    where, params = filter_clause(filters)
+    ef_search = _filtered_ef_search(ef_search, params)
+    try:
+        async with async_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    SEARCH_SETTINGS_SQL, search_settings(top_k, ef_search, probes)
+                )
+                # Query for cosine similarity search
+                # `<=>` is the cosine distance operator in pgvector.
+                # The smaller the distance, the greater the similarity.
+                # Rows come sorted by increasing distance (i.e., by decreasing
+                # similarity); see nearest_sql for the compact storages.
+                await cur.execute(
+                    SEARCH_QUERY.format(where=where),
+                    {"embedding": query_embedding, "top_k": top_k, **params},
+                )
+
+                results = await cur.fetchall()
 
     except Exception as e:
         print(f"Error searching for similar items: {e}")
-        if conn:
-            conn.rollback()
         raise
-    finally:
-        if conn:
-            cur.close()
-            conn.close()
+
+    # Convert results to a list of dictionaries for convenience
+    return [_row_to_item(row) for row in results]
+
+
+def _row_to_item(row) -> dict:
+    item_id, content, metadata, thread_id, distance = row
+    return {
+        "id": item_id,
+        "content": content,
+        "metadata": metadata,
+        "thread_id": thread_id,
+        "distance": distance,
+    }
+
+
+# Many queries in one statement: every query vector drives its own
+# ORDER BY ... LIMIT through a LATERAL join, so each one is still an ANN
+# index scan. {where} is the filter_clause condition.
+BATCH_SEARCH_QUERY = f"""
+    SELECT q.ord, i.id, i.content, i.metadata, i.thread_id, i.distance
+    FROM unnest(%(embeddings)s::text[]::vector[]) WITH ORDINALITY AS q(embedding, ord)
+    CROSS JOIN LATERAL (
+        {nearest_sql(_ITEM_COLUMNS, "{where}", "q.embedding", "%(top_k)s")}
+    ) i
+    ORDER BY q.ord, i.distance;
+"""
+
+
+async def search_pgvector_batch(
+    query_embeddings,
+    top_k: int,
+    ef_search: int = None,
+    probes: int = None,
+    filters: dict = None,
+    **options,
+) -> list[list[dict]]:
+    """
+    search_pgvector for many query embeddings in one round trip. Returns
+    one result list per embedding, in order.
+    """
+    where, params = filter_clause(filters)
+    ef_search = _filtered_ef_search(ef_search, params)
+    async with async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                SEARCH_SETTINGS_SQL, search_settings(top_k, ef_search, probes)
+            )
+            await cur.execute(
+                BATCH_SEARCH_QUERY.format(where=where),
+                {
+                    "embeddings": [to_vector_literal(e) for e in query_embeddings],
+                    "top_k": top_k,
+                    **params,
+                },
+            )
+            rows = await cur.fetchall()
+
+    results = [[] for _ in query_embeddings]
+    for row in rows:
+        results[row[0] - 1].append(_row_to_item(row[1:]))
+    return results
+
+
+# Vector and full-text candidates ranked separately, then fused with
+# reciprocal rank fusion: score = sum over both lists of
+# weight / (rrf_k + rank), the text list weighted by HYBRID_TEXT_WEIGHT.
+# The vector CTE is the same ORDER BY ... LIMIT the ANN index serves; the
+# text CTE uses items_3_content_fts_idx. One statement, one round trip;
+# {where} is the filter_clause condition, applied to both halves.
+HYBRID_QUERY = f"""
+    WITH vector_hits AS (
+        SELECT id, rank() OVER (ORDER BY distance) AS rank
+        FROM (
+            {nearest_sql("id", "{where}", "%(embedding)s::vector", "%(candidates)s")}
+        ) nearest
+    ),
+    text_hits AS (
+        SELECT id, rank() OVER (ORDER BY text_rank DESC) AS rank
+        FROM (
+            SELECT id, ts_rank_cd(to_tsvector('simple', content), query) AS text_rank
+            FROM items_3, to_tsquery('simple', %(tsquery)s) AS query
+            WHERE to_tsvector('simple', content) @@ query AND {{where}}
+            ORDER BY text_rank DESC, id
+            LIMIT %(candidates)s
+        ) matches
+    ),
+    fused AS (
+        SELECT id, sum(weight / (%(rrf_k)s + rank)) AS score
+        FROM (
+            SELECT id, rank, 1.0 AS weight FROM vector_hits
+            UNION ALL
+            SELECT id, rank, %(text_weight)s AS weight FROM text_hits
+        ) ranked
+        GROUP BY id
+    )
+    SELECT i.id, i.content, i.metadata, i.thread_id,
+           i.embedding <=> %(embedding)s::vector AS distance
+    FROM fused f
+    JOIN items_3 i ON i.id = f.id
+    ORDER BY f.score DESC, distance
+    LIMIT %(top_k)s;
+"""
+
+
+def to_tsquery_text(query_text: str) -> str:
+    """
+    OR of the query's words for to_tsquery: a question rarely contains all
+    of its words in one message, and ts_rank_cd still ranks messages that
+    match more of them first. Only word characters pass, so the result is
+    always valid tsquery syntax.
+    """
+    words = dict.fromkeys(re.findall(r"\w{2,}", query_text.lower()))
+    return " | ".join(words)
+
+
+async def search_hybrid(
+    query_embedding,
+    top_k: int,
+    query_text: str = "",
+    ef_search: int = None,
+    probes: int = None,
+    filters: dict = None,
+    **options,
+) -> list[dict]:
+    """
+    Vector and full-text search over items_3 merged with reciprocal rank
+    fusion. Exact names ("ILSE") that the multilingual embedding misses
+    are found by the text half.
+    """
+    candidates = max(HYBRID_CANDIDATES, top_k)
+    where, params = filter_clause(filters)
+    ef_search = _filtered_ef_search(ef_search, params)
+    async with async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                SEARCH_SETTINGS_SQL, search_settings(candidates, ef_search, probes)
+            )
+            await cur.execute(
+                HYBRID_QUERY.format(where=where),
+                {
+                    "embedding": query_embedding,
+                    "tsquery": to_tsquery_text(query_text),
+                    "candidates": candidates,
+                    "rrf_k": RRF_K,
+                    "text_weight": HYBRID_TEXT_WEIGHT,
+                    "top_k": top_k,
+                    **params,
+                },
+            )
+            results = await cur.fetchall()
+
+    return [
+        {
+            "id": item_id,
+            "content": content,
+            "metadata": metadata,
+            "thread_id": thread_id,
+            "distance": distance,
+        }
+        for item_id, content, metadata, thread_id, distance in results
+    ]
+
+
+# Retriever backends: async (query_embedding, top_k, **options) -> list of
+# {"id", "content", "metadata", "thread_id", "distance"}, best first.
+# Options (query_text, filters, ef_search, probes) a backend does not use are
+# ignored; every backend applies filters.
+RETRIEVERS = {
+    "pgvector": search_pgvector,
+    "hybrid": search_hybrid,
+    "local": search_local_index,
+}
+
+# Backends that answer many queries in one call; the others run one search
+# per query, concurrently.
+BATCH_RETRIEVERS = {
+    "pgvector": search_pgvector_batch,
+    "local": search_local_index_batch,
+}
+
+
+async def find_similar_items(
+    query_text: str,
+    top_k: int = 5,
+    ef_search: int = None,
+    probes: int = None,
+    backend: str = None,
+    filters: dict = None,
+) -> list[dict]:
+    """
+    Finds the most similar items in the database based on vector similarity,
+    using the retriever selected by backend (RETRIEVER_BACKEND by default).
+    filters (titles, date_from, date_to, authors) restrict the search itself.
+    """
+    query_embedding = await get_query_embedding(query_text)
+    if not query_embedding:
+        print("Failed to get embedding for the query.")
+        return []
+
+    backend = backend or RETRIEVER_BACKEND
+    with span("vector_search", backend=backend, top_k=top_k) as record:
+        similar_items = await RETRIEVERS[backend](
+            query_embedding,
+            top_k,
+            query_text=query_text,
+            ef_search=ef_search,
+            probes=probes,
+            filters=filters,
+        )
+        record["rows"] = len(similar_items)
+
+    print(f"Found {len(similar_items)} similar items for query: '{query_text}'")
+    for content in similar_items:
+        print(f"Found similar_items: {content.get('content')}")
+
+    return similar_items
+
+
+async def find_similar_items_batch(
+    query_texts: list[str],
+    top_k: int = 5,
+    ef_search: int = None,
+    probes: int = None,
+    backend: str = None,
+    filters: dict = None,
+    query_embeddings: list = None,
+) -> list[list[dict]]:
+    """
+    find_similar_items for many queries: the embeddings come from one
+    batched call (unless given) and the search is a single multi-query
+    statement where the backend supports it. Returns one list per query.
+    """
+    if query_embeddings is None:
+        query_embeddings = await get_query_embeddings(query_texts)
+    backend = backend or RETRIEVER_BACKEND
+    options = {"ef_search": ef_search, "probes": probes, "filters": filters}
+
+    with span(
+        "vector_search", backend=backend, top_k=top_k, batch=len(query_texts)
+    ) as record:
+        if backend in BATCH_RETRIEVERS:
+            results = await BATCH_RETRIEVERS[backend](
+                query_embeddings, top_k, **options
+            )
+        else:
+            results = await asyncio.gather(
+                *(
+                    RETRIEVERS[backend](
+                        embedding, top_k, query_text=query_text, **options
+                    )
+                    for query_text, embedding in zip(query_texts, query_embeddings)
+                )
+            )
+        record["rows"] = sum(len(items) for items in results)
+
+    print(f"Found {record['rows']} similar items for {len(query_texts)} queries.")
+    return results
 
 
 # Example usage:
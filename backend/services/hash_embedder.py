@@ -0,0 +1,48 @@
+"""
+Deterministic embedding without a model: the feature-hashing stand-in for
+Ollama used by EMBEDDING_BACKEND=hash (offline benchmarks, CI).
+
+Words and their character trigrams are hashed (CRC32, stable across runs and
+processes) into EMBEDDING_DIMENSIONS signed buckets and the vector is L2
+normalised, so cosine distance reflects shared vocabulary. It knows nothing
+about meaning: retrieval quality measured with it is lexical quality.
+"""
+
+import re
+import zlib
+
+import numpy as np
+
+from backend.databases.vector_index import EMBEDDING_DIMENSIONS
+
+HASH_EMBEDDING_MODEL = f"hash-{EMBEDDING_DIMENSIONS}"
+
+_WORD = re.compile(r"\w+")
+# Trigrams make "school" and "schools" close; words still dominate
+_TRIGRAM_WEIGHT = 0.5
+
+
+def _features(text: str):
+    for word in _WORD.findall(text.casefold()):
+        yield word, 1.0
+        padded = f"<{word}>"
+        for i in range(len(padded) - 2):
+            yield padded[i : i + 3], _TRIGRAM_WEIGHT
+
+
+def hash_embedding(text: str) -> list[float]:
+    vector = np.zeros(EMBEDDING_DIMENSIONS, dtype=np.float32)
+    for feature, weight in _features(text):
+        code = zlib.crc32(feature.encode("utf-8"))
+        # Low bits pick the bucket, the top bit the sign
+        vector[code % EMBEDDING_DIMENSIONS] += weight if code >> 31 else -weight
+    norm = np.linalg.norm(vector)
+    if not norm:
+        # Text without a single word character still needs a valid vector
+        vector[0] = 1.0
+        norm = 1.0
+    return (vector / norm).tolist()
+
+
+def hash_embeddings(texts: list[str]) -> list[list[float]]:
+    return [hash_embedding(text) for text in texts]
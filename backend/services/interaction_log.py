@@ -0,0 +1,297 @@
+"""
+Asynchronous interaction log: one JSON line per answered question.
+
+Requests only enqueue a record (log_interaction never blocks; when the
+bounded queue is full the record is dropped and counted). A background task
+drains the queue in batches and appends them to INTERACTION_LOG_DIR/
+interactions.jsonl from a worker thread, rotating the file once it passes
+INTERACTION_LOG_MAX_BYTES.
+
+The log can be replayed:
+
+    python services/interaction_log.py --seed-cache             # answer cache
+    python services/interaction_log.py --labels queries.json    # benchmark set
+"""
+
+import asyncio
+import glob
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.append(project_root)
+
+from backend.databases.pool import async_connection
+from backend.services.answer_cache import ANSWER_CACHE_TTL_SECONDS, store_answer
+
+load_dotenv()
+
+
+INTERACTION_LOG_ENABLED = os.getenv("INTERACTION_LOG_ENABLED", "true").lower() == "true"
+INTERACTION_LOG_DIR = os.getenv("INTERACTION_LOG_DIR", "./data/interactions")
+# Records waiting for the writer; beyond this new records are dropped
+INTERACTION_LOG_QUEUE_SIZE = int(os.getenv("INTERACTION_LOG_QUEUE_SIZE", "1000"))
+INTERACTION_LOG_BATCH_SIZE = int(os.getenv("INTERACTION_LOG_BATCH_SIZE", "100"))
+# Longest a record waits in the queue before its batch is written
+INTERACTION_LOG_FLUSH_SECONDS = float(os.getenv("INTERACTION_LOG_FLUSH_SECONDS", "1.0"))
+INTERACTION_LOG_MAX_BYTES = int(
+    os.getenv("INTERACTION_LOG_MAX_BYTES", str(50 * 1024 * 1024))
+)
+# Rotated files kept next to the current one; 0 keeps all of them
+INTERACTION_LOG_BACKUPS = int(os.getenv("INTERACTION_LOG_BACKUPS", "20"))
+
+LOG_NAME = "interactions.jsonl"
+
+_state = {"queue": None, "writer": None, "loop": None}
+_stats = {
+    "enqueued": 0,
+    "written": 0,
+    "dropped": 0,
+    "batches": 0,
+    "rotations": 0,
+    "errors": 0,
+}
+
+
+def _current_path() -> str:
+    return os.path.join(INTERACTION_LOG_DIR, LOG_NAME)
+
+
+def _rotate():
+    """
+    Renames the current file to interactions-<UTC timestamp>.jsonl and
+    removes the oldest rotated files beyond INTERACTION_LOG_BACKUPS.
+    """
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    os.replace(
+        _current_path(),
+        os.path.join(INTERACTION_LOG_DIR, f"interactions-{stamp}.jsonl"),
+    )
+    _stats["rotations"] += 1
+    if INTERACTION_LOG_BACKUPS:
+        # The current file was just renamed, so these are all rotated ones
+        for path in log_files()[:-INTERACTION_LOG_BACKUPS]:
+            os.remove(path)
+
+
+def _write_batch(lines: list[str]):
+    os.makedirs(INTERACTION_LOG_DIR, exist_ok=True)
+    path = _current_path()
+    if os.path.exists(path) and os.path.getsize(path) >= INTERACTION_LOG_MAX_BYTES:
+        _rotate()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("".join(lines))
+
+
+async def _writer(queue: asyncio.Queue):
+    while True:
+        batch = [await queue.get()]
+        deadline = time.monotonic() + INTERACTION_LOG_FLUSH_SECONDS
+        while len(batch) < INTERACTION_LOG_BATCH_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        await _flush(batch)
+        for _ in batch:
+            queue.task_done()
+
+
+async def _flush(batch: list[dict]):
+    lines = [
+        json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in batch
+    ]
+    try:
+        await asyncio.to_thread(_write_batch, lines)
+        _stats["written"] += len(batch)
+        _stats["batches"] += 1
+    except Exception as e:
+        _stats["errors"] += 1
+        _stats["dropped"] += len(batch)
+        print(f"Interaction log write failed: {e}")
+
+
+def _ensure_writer() -> asyncio.Queue:
+    loop = asyncio.get_running_loop()
+    if _state["loop"] is not loop or _state["writer"].done():
+        _state["queue"] = asyncio.Queue(maxsize=INTERACTION_LOG_QUEUE_SIZE)
+        _state["writer"] = loop.create_task(_writer(_state["queue"]))
+        _state["loop"] = loop
+    return _state["queue"]
+
+
+def log_interaction(record: dict):
+    """
+    Queues one interaction for the writer; must be called from the event
+    loop. Never waits: a full queue drops the record and counts it.
+    """
+    if not INTERACTION_LOG_ENABLED:
+        return
+    queue = _ensure_writer()
+    record = {"ts": datetime.now(timezone.utc).isoformat(), **record}
+    try:
+        queue.put_nowait(record)
+        _stats["enqueued"] += 1
+    except asyncio.QueueFull:
+        _stats["dropped"] += 1
+
+
+async def flush_interaction_log(timeout: float = 5.0):
+    """
+    Waits until every queued record is written, then stops the writer.
+    Called on shutdown.
+    """
+    queue, writer = _state["queue"], _state["writer"]
+    if writer is None or _state["loop"] is not asyncio.get_running_loop():
+        return
+    try:
+        await asyncio.wait_for(queue.join(), timeout)
+    except asyncio.TimeoutError:
+        print(f"Interaction log: {queue.qsize()} records not written on shutdown.")
+    writer.cancel()
+    _state.update(queue=None, writer=None, loop=None)
+
+
+def log_files(directory: str = None) -> list[str]:
+    """
+    Every log file, oldest first: rotated files in timestamp order, then
+    the current one.
+    """
+    directory = directory or INTERACTION_LOG_DIR
+    files = sorted(glob.glob(os.path.join(directory, "interactions-*.jsonl")))
+    current = os.path.join(directory, LOG_NAME)
+    if os.path.exists(current):
+        files.append(current)
+    return files
+
+
+def read_interactions(directory: str = None):
+    """
+    Yields every logged record in write order. A torn last line (the
+    process died mid-write) is skipped.
+    """
+    for path in log_files(directory):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+
+async def _ingested_at() -> dict:
+    """
+    When each chat last received rows ({title: ingest_watermarks.updated_at});
+    every such batch dropped the cached answers built from the chat.
+    """
+    async with async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT to_regclass('ingest_watermarks') IS NOT NULL;")
+            if not (await cur.fetchone())[0]:
+                return {}
+            await cur.execute("SELECT title, updated_at FROM ingest_watermarks;")
+            return dict(await cur.fetchall())
+
+
+async def seed_answer_cache(directory: str = None, max_age_seconds: int = None) -> int:
+    """
+    Stores the logged answers in the answer cache, newest answer per query,
+    with the time they were logged, so their TTL is not restarted.
+    Cached, failed and filtered answers, answers older than max_age_seconds
+    (ANSWER_CACHE_TTL_SECONDS by default) and answers from before a later
+    ingest of one of their chats (which invalidated them) are skipped.
+    Returns the number of answers stored.
+    """
+    max_age_seconds = max_age_seconds or ANSWER_CACHE_TTL_SECONDS
+    now = datetime.now(timezone.utc)
+    ingested_at = await _ingested_at()
+    latest = {}
+    for record in read_interactions(directory):
+        if record.get("cached") or record.get("error") or record.get("filters"):
+            continue
+        if not record.get("answer") or not record.get("titles"):
+            continue
+        logged_at = datetime.fromisoformat(record["ts"])
+        if (now - logged_at).total_seconds() > max_age_seconds:
+            continue
+        if any(
+            title in ingested_at and logged_at < ingested_at[title]
+            for title in record["titles"]
+        ):
+            continue
+        latest[record["query"]] = record
+
+    for record in latest.values():
+        await store_answer(
+            record["query"],
+            record["answer"],
+            record["titles"],
+            created_at=datetime.fromisoformat(record["ts"]),
+        )
+    return len(latest)
+
+
+def benchmark_labels(directory: str = None) -> list[dict]:
+    """
+    Logged queries as a labelled set for scripts/retrieval_benchmark.py:
+    the ids that were retrieved for a query count as its relevant ids, so
+    the set measures how far another retriever drifts from the logged one.
+    """
+    labels = {}
+    for record in read_interactions(directory):
+        if record.get("hits") and not record.get("filters"):
+            labels[record["query"]] = {
+                "query": record["query"],
+                "relevant_ids": record["hits"],
+            }
+    return list(labels.values())
+
+
+def get_interaction_log_stats() -> dict:
+    queue = _state["queue"]
+    return {
+        **_stats,
+        "enabled": INTERACTION_LOG_ENABLED,
+        "queued": queue.qsize() if queue is not None else 0,
+        "queue_size": INTERACTION_LOG_QUEUE_SIZE,
+        "directory": INTERACTION_LOG_DIR,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from backend.databases.pool import close_async_pool, open_async_pool
+
+    parser = argparse.ArgumentParser(description="Replay the interaction log")
+    parser.add_argument("--dir", help="log directory (INTERACTION_LOG_DIR)")
+    parser.add_argument("--seed-cache", action="store_true")
+    parser.add_argument("--labels", help="write a retrieval benchmark set (JSON)")
+    args = parser.parse_args()
+
+    if args.seed_cache:
+
+        async def seed():
+            await open_async_pool()
+            try:
+                return await seed_answer_cache(args.dir)
+            finally:
+                await close_async_pool()
+
+        print(f"Seeded the answer cache with {asyncio.run(seed())} answers.")
+    if args.labels:
+        labels = benchmark_labels(args.dir)
+        with open(args.labels, "w", encoding="utf-8") as f:
+            json.dump(labels, f, indent=4, ensure_ascii=False)
+        print(f"Wrote {len(labels)} labelled queries to {args.labels}.")
+    if not (args.seed_cache or args.labels):
+        records = sum(1 for _ in read_interactions(args.dir))
+        print(f"{records} interactions in {len(log_files(args.dir))} files.")
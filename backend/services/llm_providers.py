@@ -0,0 +1,383 @@
+"""
+LLM providers behind one interface, with per-call deadlines, retries with
+jitter, optional hedging and failover.
+
+A provider is an entry of PROVIDERS with two coroutines taking
+(user_query, context), context being the retrieve_context() result:
+
+    generate -> the whole answer as a string
+    stream   -> async generator of text chunks
+
+LLM_PROVIDERS is the failover order, e.g. "google,openai": every call goes to
+the first provider, and to the next one once its retries are exhausted.
+"local" is a stand-in that answers without any network call, for tests and
+benchmarks.
+"""
+
+import asyncio
+import os
+import random
+import statistics
+import time
+from collections import deque
+
+from dotenv import load_dotenv
+from google import genai
+
+from backend.services.openai_service import get_response, stream_response
+from backend.services.tracing import span
+
+load_dotenv()
+
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+# Failover order; defaults to the single provider picked by llm_flag
+LLM_PROVIDERS = [
+    name.strip()
+    for name in os.getenv(
+        "LLM_PROVIDERS", "openai" if os.getenv("llm_flag") == "openai" else "google"
+    ).split(",")
+    if name.strip()
+]
+# Deadline of one attempt; for streams, of the first chunk and of every gap
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+# Deadline of a whole call across retries, hedges and failover
+LLM_TOTAL_TIMEOUT_SECONDS = float(os.getenv("LLM_TOTAL_TIMEOUT_SECONDS", "60"))
+# Retries per provider; the delay before retry n is uniform in
+# [0, min(max, base * 2**n)] ("full jitter")
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "4"))
+# Hedging: when the provider has not answered after this quantile of its
+# recent latencies, the same request also goes to the next provider and the
+# first answer wins. 0 disables it. Needs LLM_HEDGE_MIN_SAMPLES latencies
+# of complete generate() answers; stream first-chunk times are kept apart.
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LATENCY_WINDOW = 200
+
+# Behaviour of the local provider
+LOCAL_LLM_DELAY_SECONDS = float(os.getenv("LOCAL_LLM_DELAY_SECONDS", "0"))
+LOCAL_LLM_FAILURE_RATE = float(os.getenv("LOCAL_LLM_FAILURE_RATE", "0"))
+
+
+class LLMUnavailableError(RuntimeError):
+    """Every configured provider failed or the total deadline passed."""
+
+
+_gemini_client = None
+
+
+def _get_gemini_client():
+    global _gemini_client
+    if _gemini_client is None:
+        _gemini_client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+    return _gemini_client
+
+
+async def _generate_google(user_query: str, context: dict) -> str:
+    response = await _get_gemini_client().aio.models.generate_content(
+        model=GEMINI_MODEL,
+        contents=context["full_prompt"],
+    )
+    return response.text
+
+
+async def _stream_google(user_query: str, context: dict):
+    stream = await _get_gemini_client().aio.models.generate_content_stream(
+        model=GEMINI_MODEL,
+        contents=context["full_prompt"],
+    )
+    async for chunk in stream:
+        if chunk.text:
+            yield chunk.text
+
+
+async def _generate_openai(user_query: str, context: dict) -> str:
+    return await get_response(user_query, context["context_prompt"])
+
+
+async def _stream_openai(user_query: str, context: dict):
+    async for text in stream_response(user_query, context["context_prompt"]):
+        yield text
+
+
+def _local_answer(user_query: str, context: dict) -> str:
+    if LOCAL_LLM_FAILURE_RATE and random.random() < LOCAL_LLM_FAILURE_RATE:
+        raise RuntimeError("local provider: simulated failure")
+    return (
+        f"Local answer to: {user_query}\n\n"
+        f"Context: {len(context.get('titles') or [])} fragments, "
+        f"{len(context.get('context_prompt') or '')} characters."
+    )
+
+
+async def _generate_local(user_query: str, context: dict) -> str:
+    await asyncio.sleep(LOCAL_LLM_DELAY_SECONDS)
+    return _local_answer(user_query, context)
+
+
+async def _stream_local(user_query: str, context: dict):
+    await asyncio.sleep(LOCAL_LLM_DELAY_SECONDS)
+    for word in _local_answer(user_query, context).split(" "):
+        yield word + " "
+
+
+PROVIDERS = {
+    "google": {"generate": _generate_google, "stream": _stream_google},
+    "openai": {"generate": _generate_openai, "stream": _stream_openai},
+    "local": {"generate": _generate_local, "stream": _stream_local},
+}
+
+_stats = {}
+
+
+def _provider_stats(name: str) -> dict:
+    if name not in _stats:
+        _stats[name] = {
+            "calls": 0,
+            "successes": 0,
+            "failures": 0,
+            "timeouts": 0,
+            "retries": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+            "failovers": 0,
+            # Seconds to a complete answer (generate), which hedging uses
+            "latencies": deque(maxlen=LATENCY_WINDOW),
+            # Seconds to the first chunk of a stream
+            "first_chunk_latencies": deque(maxlen=LATENCY_WINDOW),
+        }
+    return _stats[name]
+
+
+def _quantile(values, quantile: float) -> float | None:
+    if len(values) < 2:
+        return None
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return cuts[min(98, max(0, round(quantile * 100) - 1))]
+
+
+def hedge_delay(name: str) -> float | None:
+    """
+    Seconds to wait for `name` before hedging, or None when hedging is off
+    or there are not enough latency samples yet. Only complete generate()
+    answers count: a stream's first chunk arrives much sooner.
+    """
+    latencies = _provider_stats(name)["latencies"]
+    if not LLM_HEDGE_QUANTILE or len(latencies) < LLM_HEDGE_MIN_SAMPLES:
+        return None
+    return _quantile(latencies, LLM_HEDGE_QUANTILE)
+
+
+def retry_delay(attempt: int) -> float:
+    return random.uniform(
+        0.0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2**attempt)
+    )
+
+
+def _remaining(deadline: float) -> float:
+    return deadline - time.monotonic()
+
+
+async def _call_with_retries(
+    name: str, user_query: str, context: dict, deadline: float
+) -> str:
+    stats = _provider_stats(name)
+    generate = PROVIDERS[name]["generate"]
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        timeout = min(LLM_TIMEOUT_SECONDS, _remaining(deadline))
+        if timeout <= 0:
+            raise asyncio.TimeoutError(f"{name}: total deadline exceeded")
+        if attempt:
+            stats["retries"] += 1
+        stats["calls"] += 1
+        start = time.monotonic()
+        try:
+            with span("llm_call", provider=name, attempt=attempt + 1):
+                text = await asyncio.wait_for(generate(user_query, context), timeout)
+        except asyncio.TimeoutError:
+            stats["timeouts"] += 1
+            error = asyncio.TimeoutError(f"{name}: no answer after {timeout:.1f}s")
+        except Exception as e:
+            stats["failures"] += 1
+            error = e
+        else:
+            stats["successes"] += 1
+            stats["latencies"].append(time.monotonic() - start)
+            return text
+        print(f"LLM provider {name} attempt {attempt + 1} failed: {error}")
+        if attempt == LLM_MAX_RETRIES:
+            raise error
+        await asyncio.sleep(min(retry_delay(attempt), max(0.0, _remaining(deadline))))
+
+
+async def _hedged_call(
+    name: str,
+    hedge: str | None,
+    user_query: str,
+    context: dict,
+    deadline: float,
+    tried: set,
+) -> tuple[str, str]:
+    """
+    Calls `name`; once its hedge delay has passed without an answer, `hedge`
+    gets the same request and the first success wins. Every provider called
+    is added to tried. Returns (text, provider).
+    """
+    tried.add(name)
+    primary = asyncio.create_task(
+        _call_with_retries(name, user_query, context, deadline)
+    )
+    tasks = {primary: name}
+    try:
+        delay = hedge_delay(name) if hedge else None
+        if delay is None:
+            return await primary, name
+
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result(), name
+
+        print(f"LLM provider {name} slower than {delay:.2f}s, hedging with {hedge}")
+        _provider_stats(name)["hedges"] += 1
+        tried.add(hedge)
+        secondary = asyncio.create_task(
+            _call_with_retries(hedge, user_query, context, deadline)
+        )
+        tasks[secondary] = hedge
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    if task is secondary:
+                        _provider_stats(name)["hedge_wins"] += 1
+                    return task.result(), tasks[task]
+                error = task.exception()
+        raise error
+    finally:
+        # Also when the caller is cancelled while waiting
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def generate(
+    user_query: str, context: dict, providers: list[str] = None
+) -> tuple[str, str]:
+    """
+    Answers through the first provider that succeeds, in failover order.
+    A provider already called as a hedge is not failed over to again.
+    Returns (text, provider name); raises LLMUnavailableError when all fail.
+    """
+    providers = providers or LLM_PROVIDERS
+    deadline = time.monotonic() + LLM_TOTAL_TIMEOUT_SECONDS
+    errors = []
+    tried = set()
+    for index, name in enumerate(providers):
+        if _remaining(deadline) <= 0:
+            break
+        if name in tried:
+            continue
+        if index:
+            _provider_stats(name)["failovers"] += 1
+            print(f"Failing over to LLM provider {name}")
+        hedge = next(
+            (other for other in providers[index + 1 :] if other not in tried), None
+        )
+        try:
+            return await _hedged_call(name, hedge, user_query, context, deadline, tried)
+        except Exception as e:
+            errors.append(f"{name}: {e!r}")
+    raise LLMUnavailableError("; ".join(errors) or "total deadline exceeded")
+
+
+async def stream(user_query: str, context: dict, providers: list[str] = None):
+    """
+    Streaming counterpart of generate: yields (text, provider name) chunks.
+    Retries and failover only happen before the first chunk, since text the
+    client already received cannot be taken back; after that a stalled
+    stream (no chunk within LLM_TIMEOUT_SECONDS) is an error. Streams are not
+    hedged.
+    """
+    providers = providers or LLM_PROVIDERS
+    deadline = time.monotonic() + LLM_TOTAL_TIMEOUT_SECONDS
+    errors = []
+    for index, name in enumerate(providers):
+        stats = _provider_stats(name)
+        if index:
+            stats["failovers"] += 1
+            print(f"Failing over to LLM provider {name}")
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            if _remaining(deadline) <= 0:
+                raise LLMUnavailableError("; ".join(errors) or "deadline exceeded")
+            if attempt:
+                stats["retries"] += 1
+                await asyncio.sleep(
+                    min(retry_delay(attempt - 1), max(0.0, _remaining(deadline)))
+                )
+            stats["calls"] += 1
+            start = time.monotonic()
+            chunks = PROVIDERS[name]["stream"](user_query, context)
+            started = False
+            try:
+                while True:
+                    timeout = LLM_TIMEOUT_SECONDS
+                    if not started:
+                        timeout = min(timeout, _remaining(deadline))
+                    try:
+                        text = await asyncio.wait_for(anext(chunks), timeout)
+                    except StopAsyncIteration:
+                        break
+                    if not started:
+                        started = True
+                        # Not a complete answer: kept out of the hedging window
+                        stats["first_chunk_latencies"].append(time.monotonic() - start)
+                    yield text, name
+            except asyncio.TimeoutError:
+                stats["timeouts"] += 1
+                error = f"{name}: no chunk within {LLM_TIMEOUT_SECONDS:.1f}s"
+            except Exception as e:
+                stats["failures"] += 1
+                error = f"{name}: {e!r}"
+            else:
+                stats["successes"] += 1
+                return
+            finally:
+                await chunks.aclose()
+            print(f"LLM provider {name} stream attempt {attempt + 1} failed: {error}")
+            if started:
+                raise LLMUnavailableError(error)
+            errors.append(error)
+    raise LLMUnavailableError("; ".join(errors))
+
+
+def get_llm_provider_stats() -> dict:
+    providers = {}
+    for name, stats in _stats.items():
+        latencies = stats["latencies"]
+        first_chunk = stats["first_chunk_latencies"]
+        providers[name] = {
+            **{
+                key: value
+                for key, value in stats.items()
+                if key not in ("latencies", "first_chunk_latencies")
+            },
+            "p50_seconds": _quantile(latencies, 0.5),
+            "p95_seconds": _quantile(latencies, 0.95),
+            "first_chunk_p50_seconds": _quantile(first_chunk, 0.5),
+            "first_chunk_p95_seconds": _quantile(first_chunk, 0.95),
+            "hedge_after_seconds": hedge_delay(name),
+        }
+    return {
+        "order": LLM_PROVIDERS,
+        "timeout_seconds": LLM_TIMEOUT_SECONDS,
+        "total_timeout_seconds": LLM_TOTAL_TIMEOUT_SECONDS,
+        "max_retries": LLM_MAX_RETRIES,
+        "hedge_quantile": LLM_HEDGE_QUANTILE,
+        "providers": providers,
+    }
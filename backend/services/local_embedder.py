@@ -0,0 +1,201 @@
+"""
+In-process CPU embedding engine for EMBEDDING_BACKEND=local.
+
+Loads the same multilingual model Ollama serves (paraphrase-multilingual
+is sentence-transformers' paraphrase-multilingual-mpnet-base-v2) once per
+process with sentence-transformers, on PyTorch or ONNX Runtime
+(LOCAL_EMBEDDING_RUNTIME). Both are optional dependencies:
+
+    pip install sentence-transformers            # torch
+    pip install "sentence-transformers[onnx]"    # onnx
+
+Concurrent requests are micro-batched: the first text waits at most
+LOCAL_EMBEDDING_MAX_WAIT_MS for others to arrive, then up to
+LOCAL_EMBEDDING_BATCH_SIZE texts go through one forward pass in a worker
+thread. Forward passes never overlap, so LOCAL_EMBEDDING_THREADS is the
+CPU the engine uses.
+"""
+
+import asyncio
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+load_dotenv()
+
+
+LOCAL_EMBEDDING_MODEL = os.getenv(
+    "LOCAL_EMBEDDING_MODEL",
+    "sentence-transformers/paraphrase-multilingual-mpnet-base-v2",
+)
+# "torch" or "onnx"
+LOCAL_EMBEDDING_RUNTIME = os.getenv("LOCAL_EMBEDDING_RUNTIME", "torch")
+# Intra-op threads of a forward pass; 0 keeps the runtime's default
+LOCAL_EMBEDDING_THREADS = int(os.getenv("LOCAL_EMBEDDING_THREADS", "0"))
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "32"))
+# Longest a text waits for others to share its forward pass
+LOCAL_EMBEDDING_MAX_WAIT_MS = float(os.getenv("LOCAL_EMBEDDING_MAX_WAIT_MS", "5"))
+
+_model = {"model": None}
+_load_lock = threading.Lock()
+# One forward pass at a time: the batcher and ingestion threads share the model
+_encode_lock = threading.Lock()
+_state = {"queue": None, "worker": None, "loop": None}
+_stats = {
+    "texts": 0,
+    "batches": 0,
+    "max_batch": 0,
+    "encode_seconds": 0.0,
+    "wait_seconds": 0.0,
+    "load_seconds": None,
+}
+
+
+def _load_model():
+    if SentenceTransformer is None:
+        raise RuntimeError(
+            "EMBEDDING_BACKEND=local needs sentence-transformers "
+            "(pip install sentence-transformers)"
+        )
+    options = {}
+    if LOCAL_EMBEDDING_RUNTIME == "onnx":
+        import onnxruntime
+
+        session_options = onnxruntime.SessionOptions()
+        if LOCAL_EMBEDDING_THREADS:
+            session_options.intra_op_num_threads = LOCAL_EMBEDDING_THREADS
+        options["model_kwargs"] = {
+            "provider": "CPUExecutionProvider",
+            "session_options": session_options,
+        }
+    elif LOCAL_EMBEDDING_THREADS:
+        import torch
+
+        torch.set_num_threads(LOCAL_EMBEDDING_THREADS)
+    return SentenceTransformer(
+        LOCAL_EMBEDDING_MODEL,
+        device="cpu",
+        backend=LOCAL_EMBEDDING_RUNTIME,
+        **options,
+    )
+
+
+def get_model():
+    """
+    The loaded model; the first call loads it (seconds, not milliseconds).
+    """
+    if _model["model"] is None:
+        with _load_lock:
+            if _model["model"] is None:
+                start = time.perf_counter()
+                _model["model"] = _load_model()
+                _stats["load_seconds"] = time.perf_counter() - start
+    return _model["model"]
+
+
+def embed_texts(texts: list[str]) -> list[list[float]]:
+    """
+    Embeds texts in one forward pass per LOCAL_EMBEDDING_BATCH_SIZE texts.
+    Vectors are L2-normalized, like Ollama's /api/embed.
+    """
+    if not texts:
+        return []
+    model = get_model()
+    with _encode_lock:
+        start = time.perf_counter()
+        vectors = model.encode(
+            texts,
+            batch_size=LOCAL_EMBEDDING_BATCH_SIZE,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+        )
+        _stats["encode_seconds"] += time.perf_counter() - start
+    _stats["texts"] += len(texts)
+    _stats["batches"] += 1
+    _stats["max_batch"] = max(_stats["max_batch"], len(texts))
+    return vectors.tolist()
+
+
+def warm_up():
+    """
+    Loads the model and runs one forward pass, so the first request does
+    not pay for either. Called on startup.
+    """
+    embed_texts(["warm-up"])
+
+
+async def _batcher(queue: asyncio.Queue):
+    while True:
+        batch = [await queue.get()]
+        deadline = time.monotonic() + LOCAL_EMBEDDING_MAX_WAIT_MS / 1000
+        while len(batch) < LOCAL_EMBEDDING_BATCH_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        now = time.monotonic()
+        _stats["wait_seconds"] += sum(now - queued for _, _, queued in batch)
+        try:
+            vectors = await asyncio.to_thread(
+                embed_texts, [text for text, _, _ in batch]
+            )
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+        for (_, future, _), vector in zip(batch, vectors):
+            # A cancelled caller leaves a done future behind
+            if not future.done():
+                future.set_result(vector)
+
+
+def _ensure_batcher() -> asyncio.Queue:
+    loop = asyncio.get_running_loop()
+    if _state["loop"] is not loop or _state["worker"].done():
+        _state["queue"] = asyncio.Queue()
+        _state["worker"] = loop.create_task(_batcher(_state["queue"]))
+        _state["loop"] = loop
+    return _state["queue"]
+
+
+async def embed(text: str) -> list[float]:
+    """
+    Embedding of one text, computed in a forward pass shared with the other
+    texts requested within LOCAL_EMBEDDING_MAX_WAIT_MS.
+    """
+    future = asyncio.get_running_loop().create_future()
+    _ensure_batcher().put_nowait((text, future, time.monotonic()))
+    return await future
+
+
+async def embed_many(texts: list[str]) -> list[list[float]]:
+    """
+    Embeddings of many texts; they join the micro-batches like single
+    requests do, so a large list is split at LOCAL_EMBEDDING_BATCH_SIZE.
+    """
+    return list(await asyncio.gather(*(embed(text) for text in texts)))
+
+
+def get_local_embedder_stats() -> dict:
+    batches = _stats["batches"]
+    return {
+        **_stats,
+        "loaded": _model["model"] is not None,
+        "model": LOCAL_EMBEDDING_MODEL,
+        "runtime": LOCAL_EMBEDDING_RUNTIME,
+        "threads": LOCAL_EMBEDDING_THREADS,
+        "mean_batch": _stats["texts"] / batches if batches else 0.0,
+        "queued": _state["queue"].qsize() if _state["queue"] is not None else 0,
+    }
@@ -0,0 +1,424 @@
+"""
+In-process vector index: exact cosine top-k over a memory-mapped NumPy
+matrix, for single-node deployments and tests that should not need a
+Postgres round trip per query.
+
+LOCAL_INDEX_DIR holds a CURRENT file naming the live version directory;
+a rebuild writes a new version and swaps CURRENT with one rename, so
+readers always find a complete index. A version directory holds
+
+    embeddings.npy  (rows, dims) float32 or float16, L2-normalized rows
+    ids.npy         items_3.id per row
+    thread_ids.npy  items_3.thread_id per row, -1 when not assigned
+    offsets.npy     rows + 1 byte offsets into items.bin
+    items.bin       one JSON record {"content", "metadata"} per row
+    dates.npy       message date per row (datetime64[s], NaT when unknown)
+    title_codes.npy / author_codes.npy
+                    index into titles.json / authors.json per row
+
+The last three serve the retrieval filters, applied as a row mask before
+the top-k selection.
+
+Everything is opened with mmap, so loading takes milliseconds and only the
+pages a search touches are read. Build it from items_3 with
+
+    python services/local_index.py --build [--dtype float16]
+"""
+
+import asyncio
+import json
+from datetime import datetime
+import mmap
+import os
+import shutil
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+LOCAL_INDEX_DIR = os.getenv(
+    "LOCAL_INDEX_DIR",
+    os.path.join(os.path.dirname(__file__), "..", "data", "vector_index"),
+)
+LOCAL_INDEX_DTYPE = os.getenv("LOCAL_INDEX_DTYPE", "float32")
+# Rows scored per matrix product; bounds the temporary score matrix
+LOCAL_INDEX_CHUNK_ROWS = int(os.getenv("LOCAL_INDEX_CHUNK_ROWS", "262144"))
+# float16 rows are upcast to a float32 copy per product (NumPy has no fast
+# float16 matmul), so they go in smaller chunks: 16384 x 768 is 48 MiB
+LOCAL_INDEX_FLOAT16_CHUNK_ROWS = int(
+    os.getenv("LOCAL_INDEX_FLOAT16_CHUNK_ROWS", "16384")
+)
+# Versions kept on disk: the live one and the one before, which a reader
+# that looked at CURRENT just before the swap may still be opening
+LOCAL_INDEX_KEEP_VERSIONS = 2
+CURRENT_FILE = "CURRENT"
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class LocalVectorIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self.embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+        self.ids = np.load(os.path.join(path, "ids.npy"), mmap_mode="r")
+        self.thread_ids = np.load(os.path.join(path, "thread_ids.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self.dates = np.load(os.path.join(path, "dates.npy"), mmap_mode="r")
+        self.title_codes = np.load(os.path.join(path, "title_codes.npy"), mmap_mode="r")
+        self.author_codes = np.load(
+            os.path.join(path, "author_codes.npy"), mmap_mode="r"
+        )
+        with open(os.path.join(path, "titles.json"), encoding="utf-8") as f:
+            self.titles = {title: code for code, title in enumerate(json.load(f))}
+        with open(os.path.join(path, "authors.json"), encoding="utf-8") as f:
+            self.authors = {author: code for code, author in enumerate(json.load(f))}
+        self._items_file = open(os.path.join(path, "items.bin"), "rb")
+        if self.offsets[-1]:
+            self._items = mmap.mmap(
+                self._items_file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        else:
+            self._items = b""
+        self.loaded_at = time.time()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def close(self):
+        if isinstance(self._items, mmap.mmap):
+            self._items.close()
+        self._items_file.close()
+
+    def filter_mask(self, filters: dict = None) -> np.ndarray | None:
+        """
+        Boolean row mask for the retrieval filters (same keys and semantics
+        as google_vectorise.filter_clause), or None when nothing is filtered.
+        """
+        filters = {key: value for key, value in (filters or {}).items() if value}
+        if not filters:
+            return None
+        mask = np.ones(len(self), dtype=bool)
+        if filters.get("titles"):
+            codes = [self.titles[t] for t in filters["titles"] if t in self.titles]
+            mask &= np.isin(self.title_codes, codes)
+        if filters.get("authors"):
+            codes = [self.authors[a] for a in filters["authors"] if a in self.authors]
+            mask &= np.isin(self.author_codes, codes)
+        if filters.get("date_from"):
+            mask &= self.dates >= _to_datetime64(filters["date_from"])
+        if filters.get("date_to"):
+            mask &= self.dates <= _to_datetime64(filters["date_to"])
+        return mask
+
+    def search(
+        self, queries: np.ndarray, top_k: int, mask: np.ndarray = None
+    ) -> list[list[tuple[int, float]]]:
+        """
+        Exact cosine top-k for a batch of query vectors (one per row), over
+        the rows where mask is True if a mask is given.
+        Returns, per query, (row, cosine distance) pairs sorted by distance.
+        """
+        queries = _normalize(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        top_k = min(top_k, len(self) if mask is None else int(mask.sum()))
+        if top_k == 0:
+            return [[] for _ in queries]
+
+        chunk_rows = LOCAL_INDEX_CHUNK_ROWS
+        if self.embeddings.dtype != np.float32:
+            chunk_rows = min(chunk_rows, LOCAL_INDEX_FLOAT16_CHUNK_ROWS)
+        candidate_rows = []
+        candidate_scores = []
+        for start in range(0, len(self), chunk_rows):
+            chunk = self.embeddings[start : start + chunk_rows]
+            # (queries, rows); float16 storage is upcast chunk by chunk
+            scores = queries @ chunk.T.astype(np.float32, copy=False)
+            if mask is not None:
+                scores[:, ~mask[start : start + chunk_rows]] = -np.inf
+            k = min(top_k, scores.shape[1])
+            best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            candidate_rows.append(best + start)
+            candidate_scores.append(np.take_along_axis(scores, best, axis=1))
+
+        rows = np.concatenate(candidate_rows, axis=1)
+        scores = np.concatenate(candidate_scores, axis=1)
+        if rows.shape[1] > top_k:
+            best = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+            rows = np.take_along_axis(rows, best, axis=1)
+            scores = np.take_along_axis(scores, best, axis=1)
+        order = np.argsort(-scores, axis=1)
+        rows = np.take_along_axis(rows, order, axis=1)
+        scores = np.take_along_axis(scores, order, axis=1)
+        return [
+            [
+                (int(row), float(1.0 - score))
+                for row, score in zip(r, s)
+                if score != -np.inf
+            ]
+            for r, s in zip(rows, scores)
+        ]
+
+    def item(self, row: int, distance: float) -> dict:
+        """
+        The row as find_similar_items returns it.
+        """
+        record = json.loads(self._items[self.offsets[row] : self.offsets[row + 1]])
+        thread_id = int(self.thread_ids[row])
+        return {
+            "id": int(self.ids[row]),
+            "content": record["content"],
+            "metadata": record["metadata"],
+            "thread_id": thread_id if thread_id >= 0 else None,
+            "distance": distance,
+        }
+
+
+def _to_datetime64(value) -> np.datetime64:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        # Message dates are stored naive, as in the export
+        value = value.replace(tzinfo=None)
+    return np.datetime64(value, "s")
+
+
+def write_index(path: str, rows, count: int, dims: int, dtype: str = None) -> int:
+    """
+    Writes an index from an iterable of (id, content, metadata, thread_id,
+    embedding) with at most count rows. The files go to a new version
+    directory under path that CURRENT is switched to at the end, so a
+    running reader never sees a half-written index. Returns the number of
+    rows written.
+    """
+    dtype = np.dtype(dtype or LOCAL_INDEX_DTYPE)
+    version = f"v{time.time_ns()}"
+    tmp_path = os.path.join(path, f"{version}.part")
+    os.makedirs(tmp_path)
+
+    embeddings = np.lib.format.open_memmap(
+        os.path.join(tmp_path, "embeddings.npy"),
+        mode="w+",
+        dtype=dtype,
+        shape=(count, dims),
+    )
+    ids = np.empty(count, dtype=np.int64)
+    thread_ids = np.empty(count, dtype=np.int64)
+    offsets = np.empty(count + 1, dtype=np.int64)
+    offsets[0] = 0
+    dates = np.full(count, np.datetime64("NaT", "s"), dtype="datetime64[s]")
+    title_codes = np.empty(count, dtype=np.int32)
+    author_codes = np.empty(count, dtype=np.int32)
+    titles = {}
+    authors = {}
+
+    written = 0
+    with open(os.path.join(tmp_path, "items.bin"), "wb") as items:
+        for item_id, content, metadata, thread_id, embedding in rows:
+            vector = np.asarray(embedding, dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            embeddings[written] = vector / norm if norm else vector
+            ids[written] = item_id
+            thread_ids[written] = thread_id if thread_id is not None else -1
+            metadata = metadata or {}
+            title_codes[written] = titles.setdefault(metadata.get("title"), len(titles))
+            author_codes[written] = authors.setdefault(
+                metadata.get("from"), len(authors)
+            )
+            try:
+                dates[written] = _to_datetime64(metadata["date"])
+            except (KeyError, TypeError, ValueError):
+                pass
+            record = json.dumps(
+                {"content": content, "metadata": metadata}, ensure_ascii=False
+            ).encode("utf-8")
+            items.write(record)
+            offsets[written + 1] = offsets[written] + len(record)
+            written += 1
+    embeddings.flush()
+    del embeddings
+
+    if written < count:
+        # Rows deleted while the build was running: shrink to what was read
+        full = np.load(os.path.join(tmp_path, "embeddings.npy"), mmap_mode="r")
+        np.save(os.path.join(tmp_path, "embeddings_trim.npy"), full[:written])
+        del full
+        os.replace(
+            os.path.join(tmp_path, "embeddings_trim.npy"),
+            os.path.join(tmp_path, "embeddings.npy"),
+        )
+    np.save(os.path.join(tmp_path, "ids.npy"), ids[:written])
+    np.save(os.path.join(tmp_path, "thread_ids.npy"), thread_ids[:written])
+    np.save(os.path.join(tmp_path, "offsets.npy"), offsets[: written + 1])
+    np.save(os.path.join(tmp_path, "dates.npy"), dates[:written])
+    np.save(os.path.join(tmp_path, "title_codes.npy"), title_codes[:written])
+    np.save(os.path.join(tmp_path, "author_codes.npy"), author_codes[:written])
+    with open(os.path.join(tmp_path, "titles.json"), "w", encoding="utf-8") as f:
+        json.dump(list(titles), f, ensure_ascii=False)
+    with open(os.path.join(tmp_path, "authors.json"), "w", encoding="utf-8") as f:
+        json.dump(list(authors), f, ensure_ascii=False)
+
+    os.replace(tmp_path, os.path.join(path, version))
+    pointer = os.path.join(path, f"{CURRENT_FILE}.{version}")
+    with open(pointer, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(pointer, os.path.join(path, CURRENT_FILE))
+
+    versions = sorted(
+        name
+        for name in os.listdir(path)
+        if name.startswith("v")
+        and "." not in name
+        and os.path.isdir(os.path.join(path, name))
+    )
+    for name in versions[:-LOCAL_INDEX_KEEP_VERSIONS]:
+        shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+    return written
+
+
+def current_index_path(path: str = None) -> str | None:
+    """
+    Directory of the live index version under path (LOCAL_INDEX_DIR by
+    default), or None when no index has been built yet.
+    """
+    path = path or LOCAL_INDEX_DIR
+    try:
+        with open(os.path.join(path, CURRENT_FILE), encoding="utf-8") as f:
+            return os.path.join(path, f.read().strip())
+    except FileNotFoundError:
+        return None
+
+
+def build_from_database(path: str = None, dtype: str = None) -> int:
+    """
+    Dumps items_3 into a local index with a server-side cursor, so memory
+    stays flat however large the table is. Returns the number of rows.
+    """
+    from backend.databases.pool import connection
+
+    path = path or LOCAL_INDEX_DIR
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT count(*), max(vector_dims(embedding)) FROM items_3 "
+                "WHERE embedding IS NOT NULL;"
+            )
+            count, dims = cur.fetchone()
+        with conn.cursor(name="local_index_build") as cur:
+            cur.itersize = 10000
+            cur.execute(
+                """
+                SELECT id, content, metadata, thread_id, embedding::real[]
+                FROM items_3
+                WHERE embedding IS NOT NULL
+                ORDER BY id;
+                """
+            )
+            return write_index(path, cur, count, dims or 0, dtype)
+
+
+_index = {"index": None, "version": None}
+
+
+def get_local_index() -> LocalVectorIndex | None:
+    """
+    The live index in LOCAL_INDEX_DIR, reopened when it was rebuilt since
+    it was last loaded. None when no index has been built yet. The previous
+    index is not closed: searches running on it in other threads finish,
+    and its maps are released when the last reference goes.
+    """
+    version_path = current_index_path()
+    if version_path is None:
+        return None
+    if _index["index"] is None or _index["version"] != version_path:
+        _index["index"] = LocalVectorIndex(version_path)
+        _index["version"] = version_path
+    return _index["index"]
+
+
+def _search_items(
+    query_embeddings, top_k: int, filters: dict = None
+) -> list[list[dict]]:
+    index = get_local_index()
+    if index is None:
+        raise RuntimeError(
+            f"No local vector index in {LOCAL_INDEX_DIR}; "
+            "build it with services/local_index.py --build"
+        )
+    return [
+        [index.item(row, distance) for row, distance in hits]
+        for hits in index.search(query_embeddings, top_k, index.filter_mask(filters))
+    ]
+
+
+async def search_local_index(
+    query_embedding, top_k: int, filters: dict = None, **options
+) -> list[dict]:
+    """
+    Retriever entry point with the same result shape as the pgvector one.
+    The matrix product runs in a worker thread (NumPy releases the GIL).
+    """
+    results = await asyncio.to_thread(_search_items, [query_embedding], top_k, filters)
+    return results[0]
+
+
+async def search_local_index_batch(
+    query_embeddings, top_k: int, filters: dict = None, **options
+) -> list[list[dict]]:
+    return await asyncio.to_thread(_search_items, query_embeddings, top_k, filters)
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    sys.path.append(
+        os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+    )
+    from backend.databases.pool import close_pool
+
+    parser = argparse.ArgumentParser(description="Local vector index")
+    parser.add_argument("--build", action="store_true", help="rebuild from items_3")
+    parser.add_argument("--dtype", choices=["float32", "float16"])
+    parser.add_argument(
+        "--benchmark", type=int, metavar="QUERIES", help="time random top-k queries"
+    )
+    parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.build:
+        start = time.perf_counter()
+        written = build_from_database(dtype=args.dtype)
+        close_pool()
+        print(f"Wrote {written} rows in {time.perf_counter() - start:.1f}s.")
+
+    start = time.perf_counter()
+    index = get_local_index()
+    if index is None:
+        print(f"No index in {LOCAL_INDEX_DIR}.")
+        sys.exit(1)
+    print(
+        f"Loaded {len(index)} x {index.embeddings.shape[1]} "
+        f"{index.embeddings.dtype} in {(time.perf_counter() - start) * 1000:.1f}ms."
+    )
+
+    if args.benchmark:
+        rng = np.random.default_rng(0)
+        queries = rng.standard_normal((args.benchmark, index.embeddings.shape[1]))
+        index.search(queries[:1], args.top_k)  # page the matrix in
+        start = time.perf_counter()
+        for query in queries:
+            index.search(query, args.top_k)
+        single = (time.perf_counter() - start) / args.benchmark
+        start = time.perf_counter()
+        index.search(queries, args.top_k)
+        batched = (time.perf_counter() - start) / args.benchmark
+        print(
+            f"top-{args.top_k}: {single * 1000:.2f}ms per query, "
+            f"{batched * 1000:.2f}ms per query in one batch of {args.benchmark}."
+        )
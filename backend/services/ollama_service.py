@@ -1,9 +1,120 @@
+import asyncio
+import os
+
 import ollama
+from dotenv import load_dotenv
+
+from backend.services.embedding_cache import query_embedding_cache
+from backend.services import local_embedder, single_flight
+from backend.services.hash_embedder import (
+    HASH_EMBEDDING_MODEL,
+    hash_embedding,
+    hash_embeddings,
+)
+from backend.services.tracing import span
+
+load_dotenv()
+
+# "ollama", "local" (the model in-process, see local_embedder) or "hash"
+# for the deterministic offline stand-in (no model, no network; see
+# hash_embedder)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "ollama")
+
+OLLAMA_MODEL = "paraphrase-multilingual:278m"
+# OLLAMA_MODEL = "nomic-embed-text:v1.5"
+model = OLLAMA_MODEL
+if EMBEDDING_BACKEND == "hash":
+    model = HASH_EMBEDDING_MODEL
+elif EMBEDDING_BACKEND == "local":
+    model = local_embedder.LOCAL_EMBEDDING_MODEL
 
-model = "paraphrase-multilingual:278m"
-# model = "nomic-embed-text:v1.5"
+async_client = ollama.AsyncClient()
+
+
+def warm_up():
+    """
+    Loads the in-process model on startup; the other backends need nothing.
+    """
+    if EMBEDDING_BACKEND == "local":
+        local_embedder.warm_up()
 
 
 def get_text_embedding(text: str):
+    if EMBEDDING_BACKEND == "hash":
+        return hash_embedding(text)
+    if EMBEDDING_BACKEND == "local":
+        return local_embedder.embed_texts([text])[0]
     response = ollama.embeddings(model=model, prompt=text)
     return response["embedding"]
+
+
+def get_text_embeddings(texts: list[str]) -> list[list[float]]:
+    """
+    Embeds a batch of texts in a single call to Ollama's /api/embed endpoint.
+    """
+    if not texts:
+        return []
+    if EMBEDDING_BACKEND == "hash":
+        return hash_embeddings(texts)
+    if EMBEDDING_BACKEND == "local":
+        return local_embedder.embed_texts(texts)
+    response = ollama.embed(model=model, input=texts)
+    return response["embeddings"]
+
+
+async def get_text_embedding_async(text: str):
+    """
+    Non-blocking variant of get_text_embedding for the request path.
+    """
+    if EMBEDDING_BACKEND == "hash":
+        return hash_embedding(text)
+    if EMBEDDING_BACKEND == "local":
+        return await local_embedder.embed(text)
+    response = await async_client.embeddings(model=model, prompt=text)
+    return response["embedding"]
+
+
+async def get_query_embedding(text: str):
+    """
+    Embedding of a user query, served from the query embedding cache when
+    the same (normalized) question was embedded before with this model.
+    """
+    with span("embedding", model=model, cached=True) as record:
+
+        async def compute(text):
+            record["cached"] = False
+            return await get_text_embedding_async(text)
+
+        # Identical queries in flight share one cache miss
+        return await single_flight.run(
+            "embedding",
+            single_flight.query_key(text, model),
+            lambda: query_embedding_cache.get_or_compute(model, text, compute),
+        )
+
+
+async def get_text_embeddings_async(texts: list[str]) -> list[list[float]]:
+    """
+    Non-blocking variant of get_text_embeddings: one /api/embed call.
+    """
+    if not texts:
+        return []
+    if EMBEDDING_BACKEND == "hash":
+        return await asyncio.to_thread(hash_embeddings, texts)
+    if EMBEDDING_BACKEND == "local":
+        return await local_embedder.embed_many(texts)
+    response = await async_client.embed(model=model, input=texts)
+    return response["embeddings"]
+
+
+async def get_query_embeddings(texts: list[str]) -> list[list[float]]:
+    """
+    Embeddings of many user queries: cached ones come from the query
+    embedding cache, all others from a single batched Ollama call.
+    """
+    with span("embedding", model=model, batch=len(texts)) as record:
+        embeddings = await query_embedding_cache.get_or_compute_many(
+            model, texts, get_text_embeddings_async
+        )
+        record["rows"] = len(embeddings)
+        return embeddings
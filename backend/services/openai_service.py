@@ -1,4 +1,4 @@
-from openai import OpenAI
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
 import os
 
@@ -8,11 +8,11 @@ model = os.getenv("OPENAI_MODEL")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 
 
-def get_response(user_query, context_prompt):
-    messages = [
+def _build_messages(user_query, context_prompt):
+    return [
         {
             "role": "system",
             "content": "You are a helpful assistant that answers questions "
@@ -23,10 +23,31 @@ def get_response(user_query, context_prompt):
         {"role": "user", "content": user_query},
     ]
 
-    response = client.chat.completions.create(
+
+async def get_response(user_query, context_prompt):
+    messages = _build_messages(user_query, context_prompt)
+
+    response = await client.chat.completions.create(
         model=model,
         # temperature=0.2,
         messages=messages,
     )
 
     return response.choices[0].message.content
+
+
+async def stream_response(user_query, context_prompt):
+    """
+    Same request as get_response with stream=True; yields the text deltas
+    as they arrive.
+    """
+    messages = _build_messages(user_query, context_prompt)
+
+    stream = await client.chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=True,
+    )
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
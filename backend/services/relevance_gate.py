@@ -0,0 +1,116 @@
+import asyncio
+import os
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+
+from backend.databases.pool import async_connection
+from backend.services import ollama_service
+
+load_dotenv()
+
+
+# Cosine distance to the topic centroid above which a query counts as off topic
+RELEVANCE_MAX_DISTANCE = float(os.getenv("RELEVANCE_MAX_DISTANCE", "0.5"))
+# Age after which the centroid is recomputed from items_3 in the background
+RELEVANCE_CENTROID_TTL_SECONDS = int(
+    os.getenv("RELEVANCE_CENTROID_TTL_SECONDS", "3600")
+)
+
+# The centroid's "vector" when items_3 had no embeddings at the last scan;
+# None means it was never computed
+_EMPTY = object()
+_centroid = {"vector": None, "computed_at": 0.0, "refresh": None, "loop": None}
+_stats = {"accepted": 0, "rejected": 0, "refreshes": 0, "refresh_errors": 0}
+
+
+async def _compute_centroid():
+    # A full scan of items_3: at most one runs at a time (_refresh)
+    try:
+        async with async_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("SELECT avg(embedding)::real[] FROM items_3;")
+                row = await cur.fetchone()
+    except Exception as e:
+        _stats["refresh_errors"] += 1
+        print(f"Topic centroid refresh failed: {e}")
+        return
+    _stats["refreshes"] += 1
+    _centroid["computed_at"] = time.time()
+    if row is not None and row[0] is not None:
+        _centroid["vector"] = np.asarray(row[0], dtype=np.float32)
+    else:
+        _centroid["vector"] = _EMPTY
+
+
+def _refresh() -> asyncio.Task:
+    """
+    The centroid refresh in flight, started if there is none.
+    """
+    loop = asyncio.get_running_loop()
+    task = _centroid["refresh"]
+    if task is None or task.done() or _centroid["loop"] is not loop:
+        task = _centroid["refresh"] = loop.create_task(_compute_centroid())
+        _centroid["loop"] = loop
+    return task
+
+
+async def get_topic_centroid() -> np.ndarray | None:
+    """
+    Mean embedding of every stored message. The corpus is the topic, so the
+    centroid is what an on-topic question should be close to. Only the
+    first call waits for it; once it is older than the TTL the stale one is
+    served while a single background task recomputes it. None while
+    items_3 is empty, which is cached for the TTL as well.
+    """
+    if _centroid["vector"] is None:
+        # Cold start: every caller waits for one scan
+        await asyncio.shield(_refresh())
+    elif time.time() - _centroid["computed_at"] >= RELEVANCE_CENTROID_TTL_SECONDS:
+        _refresh()
+    vector = _centroid["vector"]
+    return None if vector is _EMPTY else vector
+
+
+def cosine_distance(a, b) -> float:
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    norm = float(np.linalg.norm(a) * np.linalg.norm(b))
+    if not norm:
+        return 1.0
+    return 1.0 - float(np.dot(a, b)) / norm
+
+
+async def topic_distance(user_query: str) -> float | None:
+    centroid = await get_topic_centroid()
+    if centroid is None:
+        return None
+    query_embedding = await ollama_service.get_query_embedding(user_query)
+    return cosine_distance(query_embedding, centroid)
+
+
+async def is_relevant(user_query: str) -> bool:
+    """
+    Local replacement for validate_input: no LLM call, only the (cached)
+    query embedding compared against the topic centroid. With an empty
+    table every query is let through.
+    """
+    distance = await topic_distance(user_query)
+    relevant = distance is None or distance <= RELEVANCE_MAX_DISTANCE
+    _stats["accepted" if relevant else "rejected"] += 1
+    if distance is not None:
+        print(f"Topic distance {distance:.4f} for: '{user_query}'")
+    return relevant
+
+
+def get_relevance_gate_stats() -> dict:
+    return {
+        **_stats,
+        "max_distance": RELEVANCE_MAX_DISTANCE,
+        "centroid_age_seconds": (
+            time.time() - _centroid["computed_at"]
+            if _centroid["vector"] is not None
+            else None
+        ),
+    }
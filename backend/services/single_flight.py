@@ -0,0 +1,188 @@
+"""
+Single-flight: concurrent calls with the same key share one computation.
+
+The first caller for a key (the leader) starts the work in a task; callers
+arriving while it is in flight attach to it and get the same result, the
+same exception or, for streams, every chunk from the first one on. The key
+is forgotten as soon as the work finishes, so this never serves stale
+answers; repeats after that are the answer cache's job.
+
+The work outlives a caller that goes away (a client disconnect) as long as
+another caller still waits for it, and is cancelled with the last one.
+
+Stages are coalesced independently, SINGLE_FLIGHT_STAGES picks them:
+  - request     the whole question: validation, retrieval and generation
+  - embedding   the query embedding (same text, any filters)
+  - retrieval   vector search, threads and prompt (same text and filters)
+  - generation  the LLM call for the same prompt
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sys
+
+from dotenv import load_dotenv
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.append(project_root)
+
+from backend.services.embedding_cache import normalize_text
+from backend.services.tracing import span
+
+load_dotenv()
+
+
+STAGES = ("request", "embedding", "retrieval", "generation")
+SINGLE_FLIGHT_STAGES = {
+    stage.strip()
+    for stage in os.getenv("SINGLE_FLIGHT_STAGES", ",".join(STAGES)).split(",")
+    if stage.strip()
+}
+
+# (stage, key) -> _Flight
+_flights = {}
+_stats = {
+    stage: {"leaders": 0, "coalesced": 0, "errors": 0, "cancelled": 0}
+    for stage in STAGES
+}
+
+
+class _Flight:
+    """
+    One computation in flight and the callers waiting for it. A streamed
+    flight also keeps the chunks produced so far for late subscribers.
+    """
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.task = None
+        self.subscribers = 0
+        self.chunks = []
+        self.changed = asyncio.Event()
+
+    def publish(self, chunk=None):
+        if chunk is not None:
+            self.chunks.append(chunk)
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+def query_key(user_query: str, *parts) -> str:
+    """
+    Key for a question: normalized text (case and whitespace insensitive,
+    like the caches) plus whatever else changes the answer, e.g. filters.
+    """
+    payload = json.dumps(
+        [normalize_text(user_query), *parts], sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _finished(flight_key: tuple, flight: _Flight, task: asyncio.Task):
+    if _flights.get(flight_key) is flight:
+        del _flights[flight_key]
+    if not task.cancelled() and task.exception() is not None:
+        _stats[flight.stage]["errors"] += 1
+    # Streams wait on the event, not on the task
+    flight.publish()
+
+
+def _join(stage: str, key, start) -> tuple[_Flight, bool]:
+    """
+    Returns the flight for (stage, key) and whether this caller leads it,
+    starting it with start(flight) when none is in flight.
+    """
+    flight_key = (stage, key)
+    flight = _flights.get(flight_key)
+    leader = flight is None
+    if leader:
+        flight = _Flight(stage)
+        flight.task = asyncio.create_task(start(flight))
+        flight.task.add_done_callback(lambda task: _finished(flight_key, flight, task))
+        _flights[flight_key] = flight
+        _stats[stage]["leaders"] += 1
+    else:
+        _stats[stage]["coalesced"] += 1
+    flight.subscribers += 1
+    return flight, leader
+
+
+def _leave(stage: str, key, flight: _Flight):
+    flight.subscribers -= 1
+    if flight.subscribers == 0 and not flight.task.done():
+        # Nobody wants the result any more; a new caller starts afresh
+        if _flights.get((stage, key)) is flight:
+            del _flights[(stage, key)]
+        flight.task.cancel()
+        _stats[stage]["cancelled"] += 1
+
+
+async def run(stage: str, key, factory):
+    """
+    Result of await factory(), shared with every concurrent call for the
+    same stage and key.
+    """
+    if stage not in SINGLE_FLIGHT_STAGES:
+        return await factory()
+
+    async def start(flight):
+        return await factory()
+
+    flight, leader = _join(stage, key, start)
+    try:
+        if leader:
+            return await asyncio.shield(flight.task)
+        with span("single_flight", stage=stage):
+            return await asyncio.shield(flight.task)
+    finally:
+        _leave(stage, key, flight)
+
+
+async def stream(stage: str, key, factory):
+    """
+    Chunks of the async generator factory(), shared with every concurrent
+    call for the same stage and key. A caller that joins late first gets
+    the chunks it missed.
+    """
+    if stage not in SINGLE_FLIGHT_STAGES:
+        async for chunk in factory():
+            yield chunk
+        return
+
+    async def start(flight):
+        async for chunk in factory():
+            flight.publish(chunk)
+
+    flight, _ = _join(stage, key, start)
+    try:
+        index = 0
+        while True:
+            changed = flight.changed
+            if index < len(flight.chunks):
+                index += 1
+                yield flight.chunks[index - 1]
+            elif flight.task.done():
+                # Re-raises the producer's exception, if any
+                flight.task.result()
+                return
+            else:
+                await changed.wait()
+    finally:
+        _leave(stage, key, flight)
+
+
+def get_single_flight_stats() -> dict:
+    stats = {}
+    for stage, counters in _stats.items():
+        calls = counters["leaders"] + counters["coalesced"]
+        stats[stage] = {
+            **counters,
+            "enabled": stage in SINGLE_FLIGHT_STAGES,
+            "in_flight": sum(
+                1 for flight in _flights.values() if flight.stage == stage
+            ),
+            "coalesced_ratio": counters["coalesced"] / calls if calls else 0.0,
+        }
+    return stats
@@ -0,0 +1,233 @@
+"""
+Per-request tracing and per-stage latency histograms.
+
+    with trace("POST /ai") as current:
+        with span("vector_search", backend="hybrid") as record:
+            items = ...
+            record["rows"] = len(items)
+
+Every span is timed and observed in a histogram per stage name, whether or
+not a trace is active. Inside a trace the span is also recorded with its
+parent and attributes, so the whole request can be returned to the client
+(trace_summary) or printed as one JSON line (TRACE_LOG). Spans are also
+forwarded to OpenTelemetry when the API is installed; without a configured
+SDK that is a no-op. The histograms are exported in the Prometheus text
+format by /metrics/prometheus.
+"""
+
+import json
+import os
+import statistics
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+from dotenv import load_dotenv
+
+try:
+    from opentelemetry import trace as otel_trace
+
+    _tracer = otel_trace.get_tracer("ai_chatbot_agent")
+except ImportError:
+    _tracer = None
+
+load_dotenv()
+
+
+# Print every finished trace as one JSON line
+TRACE_LOG = os.getenv("TRACE_LOG", "false").lower() == "true"
+# Histogram bucket upper bounds in seconds
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Numeric span attributes that are also summed per stage
+COUNTED_ATTRIBUTES = ("rows", "prompt_tokens", "completion_tokens")
+RECENT_WINDOW = 1000
+
+_current_trace = ContextVar("current_trace", default=None)
+_current_span = ContextVar("current_span", default=None)
+_stages = {}
+
+
+def _stage(name: str) -> dict:
+    if name not in _stages:
+        _stages[name] = {
+            "buckets": [0] * len(STAGE_BUCKETS),
+            "count": 0,
+            "sum": 0.0,
+            "errors": 0,
+            "totals": {attribute: 0 for attribute in COUNTED_ATTRIBUTES},
+            "recent": deque(maxlen=RECENT_WINDOW),
+        }
+    return _stages[name]
+
+
+def _observe(record: dict):
+    stage = _stage(record["name"])
+    duration = record["duration"]
+    for index, bound in enumerate(STAGE_BUCKETS):
+        if duration <= bound:
+            stage["buckets"][index] += 1
+            break
+    stage["count"] += 1
+    stage["sum"] += duration
+    stage["errors"] += "error" in record
+    stage["recent"].append(duration)
+    for attribute in COUNTED_ATTRIBUTES:
+        if isinstance(record.get(attribute), (int, float)):
+            stage["totals"][attribute] += record[attribute]
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Times the block as stage `name`. Yields the span record; attributes
+    known only at the end (row counts, tokens) are set on it directly.
+    """
+    record = {"name": name, **attributes}
+    current = _current_trace.get()
+    parent = _current_span.get()
+    token = _current_span.set(record)
+    start = time.perf_counter()
+    otel_span = _tracer.start_as_current_span(name) if _tracer else nullcontext()
+    with otel_span as exported:
+        try:
+            yield record
+        except BaseException as e:
+            record["error"] = type(e).__name__
+            raise
+        finally:
+            record["duration"] = time.perf_counter() - start
+            try:
+                _current_span.reset(token)
+            except ValueError:
+                # Closed from another context (an abandoned generator)
+                pass
+            _observe(record)
+            if current is not None:
+                record["start"] = start - current["started"]
+                record["parent"] = parent["name"] if parent else None
+                current["spans"].append(record)
+            if exported is not None:
+                for key, value in record.items():
+                    if key != "name" and isinstance(value, (str, bool, int, float)):
+                        exported.set_attribute(key, value)
+
+
+@contextmanager
+def trace(name: str, **attributes):
+    """
+    Collects every span opened inside the block, including spans of tasks
+    started from it. Yields the trace; see trace_summary.
+    """
+    current = {
+        "trace_id": uuid.uuid4().hex,
+        "started": time.perf_counter(),
+        "spans": [],
+    }
+    token = _current_trace.set(current)
+    try:
+        with span(name, **attributes):
+            yield current
+    finally:
+        try:
+            _current_trace.reset(token)
+        except ValueError:
+            pass
+        if TRACE_LOG:
+            print(json.dumps(trace_summary(current), default=str))
+
+
+def current_trace() -> dict | None:
+    return _current_trace.get()
+
+
+def trace_summary(current: dict) -> dict:
+    """
+    JSON-friendly trace: spans in start order with start offset, duration
+    (seconds), parent stage and attributes.
+    """
+    spans = sorted(current["spans"], key=lambda record: record.get("start", 0.0))
+    total = max(
+        (record.get("start", 0.0) + record["duration"] for record in spans),
+        default=0.0,
+    )
+    return {"trace_id": current["trace_id"], "total": total, "spans": spans}
+
+
+def stage_timings(current: dict) -> dict[str, float]:
+    """
+    Seconds per stage name, summed over spans of the same stage, without
+    the root span.
+    """
+    timings = {}
+    for record in current["spans"]:
+        if record.get("parent") is None:
+            continue
+        timings[record["name"]] = timings.get(record["name"], 0.0) + record["duration"]
+    return timings
+
+
+def _quantile(values, quantile: float) -> float | None:
+    if len(values) < 2:
+        return None
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return cuts[min(98, max(0, round(quantile * 100) - 1))]
+
+
+def get_stage_stats() -> dict:
+    """
+    Per stage: count, errors, mean and p50/p95/p99 over the last
+    RECENT_WINDOW spans, and the summed COUNTED_ATTRIBUTES.
+    """
+    stats = {}
+    for name, stage in _stages.items():
+        recent = stage["recent"]
+        stats[name] = {
+            "count": stage["count"],
+            "errors": stage["errors"],
+            "mean_seconds": stage["sum"] / stage["count"] if stage["count"] else 0.0,
+            "p50_seconds": _quantile(recent, 0.5),
+            "p95_seconds": _quantile(recent, 0.95),
+            "p99_seconds": _quantile(recent, 0.99),
+            **stage["totals"],
+        }
+    return stats
+
+
+def prometheus_text() -> str:
+    """
+    The stage histograms and counters in the Prometheus text format.
+    """
+    lines = [
+        "# HELP rag_stage_duration_seconds Duration of each request stage.",
+        "# TYPE rag_stage_duration_seconds histogram",
+    ]
+    for name, stage in sorted(_stages.items()):
+        cumulative = 0
+        for bound, count in zip(STAGE_BUCKETS, stage["buckets"]):
+            cumulative += count
+            lines.append(
+                f'rag_stage_duration_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}'
+            )
+        lines.append(
+            f'rag_stage_duration_seconds_bucket{{stage="{name}",le="+Inf"}} {stage["count"]}'
+        )
+        lines.append(f'rag_stage_duration_seconds_sum{{stage="{name}"}} {stage["sum"]}')
+        lines.append(
+            f'rag_stage_duration_seconds_count{{stage="{name}"}} {stage["count"]}'
+        )
+
+    lines.append("# HELP rag_stage_errors_total Stages that raised.")
+    lines.append("# TYPE rag_stage_errors_total counter")
+    for name, stage in sorted(_stages.items()):
+        lines.append(f'rag_stage_errors_total{{stage="{name}"}} {stage["errors"]}')
+
+    for attribute in COUNTED_ATTRIBUTES:
+        metric = f"rag_stage_{attribute}_total"
+        lines.append(f"# HELP {metric} Sum of {attribute} reported by each stage.")
+        lines.append(f"# TYPE {metric} counter")
+        for name, stage in sorted(_stages.items()):
+            if stage["totals"][attribute]:
+                lines.append(f'{metric}{{stage="{name}"}} {stage["totals"][attribute]}')
+    return "\n".join(lines) + "\n"
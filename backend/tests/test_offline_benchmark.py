@@ -0,0 +1,18 @@
+import os
+import subprocess
+import sys
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+
+def test_offline_benchmark_imports():
+    # In a subprocess: the module points DB_NAME and the services at the
+    # offline stand-ins when it is imported
+    result = subprocess.run(
+        [sys.executable, "-c", "import backend.scripts.offline_benchmark"],
+        cwd=project_root,
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,87 @@
+import asyncio
+import contextlib
+
+from backend.services import relevance_gate
+
+
+class _Cursor:
+    def __init__(self, row, scans):
+        self.row = row
+        self.scans = scans
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, query, params=None):
+        self.scans.append(query)
+
+    async def fetchone(self):
+        return self.row
+
+
+class _Connection:
+    def __init__(self, row, scans):
+        self.row = row
+        self.scans = scans
+
+    def cursor(self):
+        return _Cursor(self.row, self.scans)
+
+
+def _fake_items_3(monkeypatch, row):
+    """
+    Points the gate at a fake items_3 whose centroid query returns row and
+    resets the cached centroid. Returns the list of queries run.
+    """
+    scans = []
+
+    @contextlib.asynccontextmanager
+    async def async_connection():
+        yield _Connection(row, scans)
+
+    monkeypatch.setattr(relevance_gate, "async_connection", async_connection)
+    monkeypatch.setitem(relevance_gate._centroid, "vector", None)
+    monkeypatch.setitem(relevance_gate._centroid, "computed_at", 0.0)
+    monkeypatch.setitem(relevance_gate._centroid, "refresh", None)
+    monkeypatch.setitem(relevance_gate._centroid, "loop", None)
+    return scans
+
+
+def test_empty_table_is_scanned_once_per_ttl(monkeypatch):
+    scans = _fake_items_3(monkeypatch, (None,))
+
+    async def centroids():
+        return [await relevance_gate.get_topic_centroid() for _ in range(3)]
+
+    assert asyncio.run(centroids()) == [None, None, None]
+    assert len(scans) == 1
+
+
+def test_empty_table_is_rescanned_after_ttl(monkeypatch):
+    scans = _fake_items_3(monkeypatch, (None,))
+    monkeypatch.setattr(relevance_gate, "RELEVANCE_CENTROID_TTL_SECONDS", 0)
+
+    async def centroids():
+        first = await relevance_gate.get_topic_centroid()
+        # Expired at once: served as empty while one background scan runs
+        second = await relevance_gate.get_topic_centroid()
+        await relevance_gate._centroid["refresh"]
+        return first, second
+
+    assert asyncio.run(centroids()) == (None, None)
+    assert len(scans) == 2
+
+
+def test_centroid_is_cached(monkeypatch):
+    scans = _fake_items_3(monkeypatch, ([1.0, 0.0],))
+
+    async def centroids():
+        return [await relevance_gate.get_topic_centroid() for _ in range(2)]
+
+    first, second = asyncio.run(centroids())
+    assert first.tolist() == [1.0, 0.0]
+    assert second is first
+    assert len(scans) == 1
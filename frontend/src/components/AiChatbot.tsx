@@ -2,6 +2,13 @@ import { useState } from "react";
 import styles from "./AiChatbot.module.css";
 import ReactMarkdown from "react-markdown";
 
+type StreamEventData = {
+  text?: string;
+  message?: string;
+  process_time?: number | null;
+  detail?: string;
+};
+
 function AiChatbot() {
   const [userInput, setUserInput] = useState<string>("");
   const [messages, setMessages] = useState("");
@@ -25,9 +32,17 @@ function AiChatbot() {
     setQuery(userInput);
 
     try {
-      const responseData = await sendMessage(userInput);
-      setMessages(responseData.message);
-      setProcessTime(responseData.process_time);
+      await streamMessage(userInput, (event, data) => {
+        if (event === "token") {
+          setIsLoading(false); // First token replaces the spinner
+          setMessages((current) => current + (data.text ?? ""));
+        } else if (event === "done") {
+          setMessages(data.message ?? "");
+          setProcessTime(data.process_time ?? 0);
+        } else if (event === "error") {
+          throw new Error(data.detail);
+        }
+      });
       setUserInput("");
     } catch (e) {
       console.error("Error sending from component:", e);
@@ -36,8 +51,12 @@ function AiChatbot() {
     }
   };
 
-  const sendMessage = async (payload: string) => {
-    const res = await fetch(`${backendUrl}/ai`, {
+  // Reads the server-sent events of /ai/stream and hands each one to onEvent
+  const streamMessage = async (
+    payload: string,
+    onEvent: (event: string, data: StreamEventData) => void
+  ) => {
+    const res = await fetch(`${backendUrl}/ai/stream`, {
       method: "POST",
       headers: {
         "Content-Type": "application/json",
@@ -45,7 +64,7 @@ function AiChatbot() {
       body: JSON.stringify({ message: payload }),
     });
 
-    if (!res.ok) {
+    if (!res.ok || !res.body) {
       const errorData = await res
         .json()
         .catch(() => ({ detail: res.statusText }));
@@ -53,7 +72,28 @@ function AiChatbot() {
         `Error HTTP: ${res.status} - ${errorData.detail || res.statusText}`
       );
     }
-    return res.json();
+
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      let boundary = buffer.indexOf("\n\n");
+      while (boundary !== -1) {
+        const block = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        let event = "message";
+        let data = "";
+        for (const line of block.split("\n")) {
+          if (line.startsWith("event: ")) event = line.slice(7);
+          else if (line.startsWith("data: ")) data += line.slice(6);
+        }
+        if (data) onEvent(event, JSON.parse(data));
+        boundary = buffer.indexOf("\n\n");
+      }
+    }
   };
 
   return (